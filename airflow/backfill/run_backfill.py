@@ -0,0 +1,164 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import dotenv_values
+
+import pandas as pd
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "dags"))
+
+"""
+Standalone backfill runner for bulk registry imports. Runs the fast pipeline of the registry DAG (see
+query_pacs_dags.py, PACS_DAG_MODE=registry) for many cases without Airflow scheduling. Cases are processed by a
+thread pool driven by asyncio, the PACS traffic is bounded by the shared association pool and rate limiter. Progress
+is checkpointed per case in the MongoDB collection pacs_backfill, i.e., a restarted run skips finished cases. In
+per-patient mode, the cases of a patient are processed by the same worker after a single study query.
+"""
+
+STAGES = ["query_case", "query_case_instances", "move_case_images", "dump_case"]
+
+
+def load_cases(dags):
+    """Cases with time frame (same format as select_cases of the registry DAG), sorted by _SSRID."""
+    df = pd.DataFrame(dags.registry_collection().find(
+        {}, {"_id": 0, "_SSRID": 1, "PatientID": 1, "arrival_time_at_hospital": 1}).sort([("_SSRID", 1)]))
+    df.index = df["_SSRID"]
+    time_frames = dags.get_time_frames(df)
+    patient_time_frames = {}
+    for n, (start_time_str, end_time_str) in time_frames.items():
+        patient_time_frames.setdefault(df.loc[n, "PatientID"], []).append((n, start_time_str, end_time_str))
+    cases = []
+    for n in df.index:
+        if n not in time_frames:
+            continue
+        frames = patient_time_frames[df.loc[n, "PatientID"]]
+        cases.append({
+            "ssr_id": n, "patient_id": df.loc[n, "PatientID"],
+            "arrival_time_at_hospital": df.loc[n, "arrival_time_at_hospital"].isoformat(),
+            "study_date": f"{min(f[1] for f in frames)}-{max(f[2] for f in frames)}"
+            if dags.query_per_patient else f"{time_frames[n][0]}-{time_frames[n][1]}",
+            "time_frames": frames if dags.query_per_patient else None})
+    return cases
+
+
+class Progress:
+    """Live throughput of the backfill."""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+
+    def report(self, limiter=None):
+        elapsed = time.monotonic() - self.start
+        finished = self.done + self.failed
+        per_hour = finished / elapsed * 3600 if elapsed > 0 else 0
+        eta = (self.total - finished) / per_hour if per_hour > 0 else float("inf")
+        rate = f", PACS rate {limiter.rate:.2f} req/s" if limiter is not None else ""
+        print(f"[{datetime.now():%H:%M:%S}] {finished}/{self.total} cases ({self.failed} failed), "
+              f"{per_hour:.0f} cases/h, ETA {eta:.1f}h{rate}", flush=True)
+
+
+def group_cases(dags, cases):
+    """Units of work: all cases of a patient in per-patient mode, single cases otherwise."""
+    if not dags.query_per_patient:
+        return [[case] for case in cases]
+    patients = {}
+    for case in cases:
+        patients.setdefault(case["patient_id"], []).append(case)
+    return list(patients.values())
+
+
+def process_cases(dags, checkpoints, run_id, cases):
+    """Run the stages of the registry DAG for a group of cases, sharing the study query in per-patient mode."""
+    if dags.query_per_patient:
+        dags.assign_patient_studies(cases)
+    return [process_case(dags, checkpoints, run_id, case) for case in cases]
+
+
+def process_case(dags, checkpoints, run_id, case):
+    """Run the stages of the registry DAG for one case. The current stage and the outcome are checkpointed."""
+    _id = f"{run_id}/{case['ssr_id']}"
+    start = time.monotonic()
+    for stage in STAGES:
+        checkpoints.update_one(
+            {"_id": _id},
+            {"$set": {"run_id": run_id, "ssr_id": case["ssr_id"], "state": "running", "stage": stage,
+                      "updated_at": datetime.utcnow()}},
+            upsert=True)
+        case = getattr(dags, stage).function(case)
+        if "error" in case:
+            break
+    state = "failed" if "error" in case else "done"
+    checkpoints.update_one({"_id": _id}, {"$set": {
+        "state": state, "error": case.get("error", None), "duration": time.monotonic() - start,
+        "updated_at": datetime.utcnow()}})
+    return state
+
+
+async def run(dags, cases, checkpoints, run_id, workers, report_interval, limiter=None):
+    progress = Progress(len(cases))
+    loop = asyncio.get_running_loop()
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(report_interval)
+            progress.report(limiter)
+
+    async def worker(group):
+        try:
+            states = await loop.run_in_executor(executor, process_cases, dags, checkpoints, run_id, group)
+        except Exception:
+            logging.exception(f"Cases {[case['ssr_id'] for case in group]} failed.")
+            states = ["failed"] * len(group)
+        progress.done += states.count("done")
+        progress.failed += len(states) - states.count("done")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        reporting = asyncio.create_task(reporter())
+        try:
+            await asyncio.gather(*[worker(group) for group in group_cases(dags, cases)])
+        finally:
+            reporting.cancel()
+    progress.report(limiter)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the registry without Airflow scheduling.")
+    parser.add_argument("--env", default=".env", help="environment file, same as for docker-compose")
+    parser.add_argument("--run-id", default="backfill", help="checkpoint namespace, reuse it to resume a run")
+    parser.add_argument("--limit", type=int, default=None, help="maximum number of cases")
+    parser.add_argument("--workers", type=int, default=None, help="cases in parallel (default PACS_MAX_CONCURRENCY)")
+    parser.add_argument("--retry-failed", action="store_true", help="also rerun cases failed in a previous run")
+    parser.add_argument("--report-interval", type=float, default=30, help="seconds between progress reports")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.environ.update({k: v for k, v in dotenv_values(args.env).items() if k not in os.environ})
+    # the registry DAG does not access MongoDB when imported
+    os.environ["PACS_DAG_MODE"] = "registry"
+    import query_pacs_dags as dags
+    from pacs.rate_limit import rate_limiter
+    from utils.misc import mongo_get_collection
+
+    checkpoints = mongo_get_collection(
+        "pacs_backfill",
+        user=dags.config["MONGODB_USER"], password=dags.config["MONGODB_PASSWORD"],
+        url=dags.config["DEPLOYMENT_URL"], port=dags.config["MONGODB_PORT"], db=dags.config["MONGODB_DATABASE_NAME"])
+    finished_states = ["done"] if args.retry_failed else ["done", "failed"]
+    finished = set(checkpoints.distinct("ssr_id", {"run_id": args.run_id, "state": {"$in": finished_states}}))
+
+    cases = [case for case in load_cases(dags) if case["ssr_id"] not in finished][:args.limit]
+    print(f"{len(cases)} cases to process, {len(finished)} already finished in run '{args.run_id}'.")
+    workers = args.workers or int(dags.config.get("PACS_MAX_CONCURRENCY", 4))
+    asyncio.run(run(dags, cases, checkpoints, args.run_id, workers, args.report_interval,
+                    limiter=rate_limiter(**dags.config)))
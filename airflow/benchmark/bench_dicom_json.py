@@ -0,0 +1,105 @@
+from pathlib import Path
+
+from dicom_parser import Header
+from pydicom import Dataset, dcmread
+from pydicom.data import get_testdata_files
+from pydicom.multival import MultiValue
+from pydicom.sequence import Sequence
+from pydicom.tag import BaseTag
+from pydicom.uid import UID
+from pydicom.valuerep import DSfloat, IS, PersonName
+
+import argparse
+import sys
+import time
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "dags"))
+
+from database.dicom_json import to_mongo_dict
+
+"""
+Micro-benchmark of the conversion of DICOM JSON instance headers to MongoDB documents: the previous
+Dataset.from_json + dicom_parser Header.to_dict + parse_tag round trip (reference implementation below) against the
+single-pass converter in database/dicom_json.py. Also checks that both produce the same documents, i.e., fails if
+any header differs.
+"""
+
+
+def parse_tag(v):
+    if type(v) is bytes:
+        return v
+    elif type(v) == list:
+        return [parse_tag(e) for e in v]
+    elif type(v) in [str, int, float]:
+        return v
+    elif type(v) == DSfloat:
+        return float(v)
+    elif type(v) == MultiValue:
+        return [parse_tag(i) for i in v]
+    elif type(v) in [UID, PersonName, BaseTag]:
+        return str(v)
+    elif type(v) is IS:
+        return int(v)
+    elif type(v) is Sequence:
+        return [parse_tag(i) for i in v]
+    elif type(v) is Dataset:
+        return parse_tag(Header(v).to_dict(parsed=False))
+    elif type(v) is dict:
+        return {key.replace(".", ""): parse_tag(val) for key, val in v.items()}
+    elif v is None:
+        return v
+    raise ValueError(f"Unknown value type {type(v)}!")
+
+
+def reference_to_mongo_dict(ds):
+    image_dict = Header(Dataset.from_json(ds, bulk_data_uri_handler=lambda _: None)).to_dict(parsed=False)
+    return {k.replace(".", ""): parse_tag(v) for k, v in image_dict.items()
+            if type(v) is not bytes and k not in ["", "Unknown"] and "UserData" not in k}
+
+
+def load_headers(paths):
+    """Instance headers as DICOM JSON strings, i.e., the format passed between the tasks (without pixel data)."""
+    headers = []
+    for path in paths:
+        try:
+            ds = dcmread(path, stop_before_pixels=True)
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        try:
+            headers.append(ds.to_json())
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+    return headers
+
+
+def timed(convert, headers, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for ds in headers:
+            convert(ds)
+    return (time.perf_counter() - start) / (repeat * len(headers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark DICOM JSON to MongoDB document conversion.")
+    parser.add_argument("files", nargs="*", help="DICOM files (default: pydicom test files)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    headers = load_headers(args.files or get_testdata_files("*.dcm"))
+    mismatches = 0
+    for ds in headers:
+        expected, actual = reference_to_mongo_dict(ds), to_mongo_dict(ds)
+        if expected != actual:
+            mismatches += 1
+            keys = sorted(k for k in set(expected) | set(actual) if expected.get(k, None) != actual.get(k, None))
+            print(f"Mismatch in {keys[:10]}")
+
+    t_reference = timed(reference_to_mongo_dict, headers, args.repeat)
+    t_direct = timed(to_mongo_dict, headers, args.repeat)
+    print(f"{len(headers)} headers, {mismatches} mismatches")
+    print(f"Header().to_dict + parse_tag: {t_reference * 1e6:.1f} us/instance")
+    print(f"dicom_json.to_mongo_dict:     {t_direct * 1e6:.1f} us/instance ({t_reference / t_direct:.1f}x)")
+    if mismatches > 0:
+        sys.exit(f"{mismatches} of {len(headers)} headers differ from the reference implementation!")
@@ -0,0 +1,131 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import urlparse, parse_qs
+
+from pydicom import Dataset
+from pydicom.datadict import tag_for_keyword, dictionary_VR
+
+from mock_pacs import create_hierarchy, matches, UNIQUE_KEYS
+
+import argparse
+import json
+import logging
+import time
+
+"""
+Mock DICOMweb server (QIDO-RS and WADO-RS /metadata) serving the same synthetic hierarchy as the mock PACS. Uses
+HTTP/1.1 such that clients can keep connections alive.
+"""
+
+
+def to_identifier(level, params):
+    """Build a C-FIND like identifier from QIDO-RS matching parameters."""
+    identifier = Dataset()
+    identifier.QueryRetrieveLevel = level
+    for keyword, values in params.items():
+        tag = tag_for_keyword(keyword)
+        if tag is not None:
+            identifier.add_new(tag, dictionary_VR(tag), values[0])
+    return identifier
+
+
+def to_metadata(ds):
+    """DICOM JSON of the dataset, PixelData is referenced as bulk data."""
+    return ds.to_json_dict(bulk_data_threshold=0, bulk_data_element_handler=lambda _: "bulkdata")
+
+
+class MockDICOMweb:
+    """QIDO-RS/WADO-RS server serving a synthetic hierarchy."""
+
+    def __init__(self, instances, port=8042, latency=0.0):
+        self.instances = instances
+        self.port = int(port)
+        self.latency = float(latency)
+        self.stats = {"connections": 0, "qido": 0, "wado": 0}
+        self._lock = Lock()
+        self._server = None
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def handle(self, path, params):
+        """Return the DICOM JSON response for the request path, None if not found."""
+        parts = [p for p in path.strip("/").split("/") if p != ""]
+        uids = {}
+        for key, value in zip(parts[0::2], parts[1::2]):
+            uids[{"studies": "StudyInstanceUID", "series": "SeriesInstanceUID",
+                  "instances": "SOPInstanceUID"}.get(key, key)] = value
+        time.sleep(self.latency)
+
+        if parts[-1] == "metadata":
+            self._count("wado")
+            identifier = to_identifier("IMAGE", {k: [v] for k, v in uids.items()})
+            return [to_metadata(ds) for ds in self.instances if matches(ds, identifier)]
+
+        self._count("qido")
+        level = {"studies": "STUDY", "series": "SERIES", "instances": "IMAGE"}.get(parts[-1], None)
+        if level is None:
+            return None
+        identifier = to_identifier(level, {**params, **{k: [v] for k, v in uids.items()}})
+        seen, res = set(), []
+        for ds in self.instances:
+            if matches(ds, identifier) and ds.get(UNIQUE_KEYS[level]) not in seen:
+                seen.add(ds.get(UNIQUE_KEYS[level]))
+                res.append(to_metadata(ds))
+        return res
+
+    def start(self):
+        """Start the server in the background."""
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                mock._count("connections")
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v for k, v in parse_qs(url.query).items() if k != "includefield"}
+                res = mock.handle(url.path, params)
+                body = b"" if res is None else json.dumps(res).encode()
+                self.send_response(404 if res is None else 200 if len(res) > 0 else 204)
+                self.send_header("Content-Type", "application/dicom+json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("0.0.0.0", self.port), Handler)
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        logging.info(f"Mock DICOMweb server listening on port {self.port} with {len(self.instances)} instances.")
+        return self
+
+    def shutdown(self):
+        """Stop the server."""
+        self._server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the mock DICOMweb server.")
+    parser.add_argument("--port", type=int, default=8042)
+    parser.add_argument("--patients", type=int, default=10)
+    parser.add_argument("--studies", type=int, default=3)
+    parser.add_argument("--series", type=int, default=10)
+    parser.add_argument("--instances", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    mock_dicomweb = MockDICOMweb(
+        create_hierarchy(args.patients, args.studies, args.series, args.instances),
+        port=args.port, latency=args.latency).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock_dicomweb.shutdown()
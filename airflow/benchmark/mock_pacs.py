@@ -0,0 +1,227 @@
+from datetime import datetime, timedelta
+from threading import Lock
+
+from pydicom import Dataset
+from pydicom.dataset import FileMetaDataset
+from pydicom.uid import generate_uid, ImplicitVRLittleEndian
+from pynetdicom import AE, evt, StoragePresentationContexts, QueryRetrievePresentationContexts
+from pynetdicom.sop_class import MRImageStorage, CTImageStorage
+
+import argparse
+import logging
+import random
+import time
+
+"""
+Mock PACS (Query/Retrieve SCP) for local testing and benchmarking. Serves a synthetic patient/study/series/instance
+hierarchy via C-FIND, C-MOVE and C-GET with configurable latency and failure injection.
+"""
+
+LEVELS = ["PATIENT", "STUDY", "SERIES", "IMAGE"]
+UNIQUE_KEYS = {"PATIENT": "PatientID", "STUDY": "StudyInstanceUID",
+               "SERIES": "SeriesInstanceUID", "IMAGE": "SOPInstanceUID"}
+
+
+def create_hierarchy(nr_of_patients=10, nr_of_studies=3, nr_of_series=10, nr_of_instances=50,
+                     pixels=64, seed=42):
+    """Create a synthetic hierarchy. Returns a list of instance datasets including PixelData."""
+    rnd = random.Random(seed)
+    instances = []
+    for p in range(nr_of_patients):
+        patient_id = f"MOCK{p:06d}"
+        for st in range(nr_of_studies):
+            study_uid = generate_uid(entropy_srcs=[patient_id, str(st)])
+            study_date = datetime(2020, 1, 1) + timedelta(days=rnd.randint(0, 365))
+            modality = rnd.choice(["MR", "CT"])
+            for se in range(nr_of_series):
+                series_uid = generate_uid(entropy_srcs=[study_uid, str(se)])
+                for i in range(nr_of_instances):
+                    ds = Dataset()
+                    ds.PatientID = patient_id
+                    ds.PatientName = f"Mock^{p}"
+                    ds.StudyInstanceUID = study_uid
+                    ds.StudyDate = study_date.strftime("%Y%m%d")
+                    ds.StudyTime = "120000"
+                    ds.StudyDescription = "Mock study"
+                    ds.AccessionNumber = f"{p:06d}{st:03d}"
+                    ds.Modality = modality
+                    ds.SeriesInstanceUID = series_uid
+                    ds.SeriesNumber = se + 1
+                    ds.SeriesDescription = rnd.choice(["t1_mprage", "DWI", "ADC", "FLAIR", "SWI", "TOF"])
+                    ds.SeriesDate = ds.StudyDate
+                    ds.SeriesTime = ds.StudyTime
+                    ds.SOPClassUID = MRImageStorage if modality == "MR" else CTImageStorage
+                    ds.SOPInstanceUID = generate_uid(entropy_srcs=[series_uid, str(i)])
+                    ds.InstanceNumber = i + 1
+                    ds.Rows, ds.Columns = pixels, pixels
+                    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+                    ds.SamplesPerPixel, ds.PixelRepresentation = 1, 0
+                    ds.PhotometricInterpretation = "MONOCHROME2"
+                    ds.PixelData = bytes(2 * pixels * pixels)
+                    ds.file_meta = FileMetaDataset()
+                    ds.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian
+                    ds.is_little_endian, ds.is_implicit_VR = True, True
+                    instances.append(ds)
+    return instances
+
+
+def matches(record, identifier):
+    """Check whether the record matches the (non-empty) keys of the identifier. Supports date ranges."""
+    for elem in identifier:
+        if elem.keyword in ["QueryRetrieveLevel", "SpecificCharacterSet"] or elem.value in [None, ""]:
+            continue
+        value = str(record.get(elem.keyword, ""))
+        query = str(elem.value)
+        if elem.VR == "DA" and "-" in query:
+            start, end = query.split("-")
+            if (start and value < start) or (end and value > end):
+                return False
+        elif value != query:
+            return False
+    return True
+
+
+class MockPACS:
+    """Query/Retrieve SCP serving a synthetic hierarchy."""
+
+    def __init__(self, instances, ae_title="MOCK_PACS", port=11112, destinations=None,
+                 latency=0.0, failure_rate=0.0, seed=42):
+        self.instances = instances
+        self.ae_title = ae_title
+        self.port = int(port)
+        self.destinations = destinations or {}
+        self.latency = float(latency)
+        self.failure_rate = float(failure_rate)
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self.stats = {"associations": 0, "c_find": 0, "c_move": 0, "c_get": 0, "c_store": 0, "failures": 0}
+        self._server = None
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _fail(self):
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            self._count("failures")
+        return failed
+
+    def _records(self, identifier):
+        """Unique records for the query level of the identifier."""
+        level = identifier.QueryRetrieveLevel
+        key = UNIQUE_KEYS[level]
+        seen, res = set(), []
+        for ds in self.instances:
+            if matches(ds, identifier) and ds.get(key) not in seen:
+                seen.add(ds.get(key))
+                res.append(ds)
+        return res
+
+    def _handle_established(self, event):
+        self._count("associations")
+
+    def _handle_find(self, event):
+        self._count("c_find")
+        identifier = event.identifier
+        time.sleep(self.latency)
+        if self._fail():
+            yield 0xC000, None
+            return
+        for record in self._records(identifier):
+            if event.is_cancelled:
+                yield 0xFE00, None
+                return
+            res = Dataset()
+            for elem in identifier:
+                res.add_new(elem.tag, elem.VR, record.get(elem.keyword, elem.value))
+            res.QueryRetrieveLevel = identifier.QueryRetrieveLevel
+            yield 0xFF00, res
+
+    def _handle_move(self, event):
+        self._count("c_move")
+        identifier = event.identifier
+        if event.move_destination not in self.destinations:
+            yield None, None
+            return
+        yield self.destinations[event.move_destination]
+        time.sleep(self.latency)
+        if self._fail():
+            yield 0
+            yield 0xC000, None
+            return
+        level = identifier.QueryRetrieveLevel
+        instances = [ds for ds in self.instances if matches(ds, identifier)] if level in LEVELS else []
+        yield len(instances)
+        for ds in instances:
+            if event.is_cancelled:
+                yield 0xFE00, None
+                return
+            self._count("c_store")
+            yield 0xFF00, ds
+
+    def _handle_get(self, event):
+        self._count("c_get")
+        identifier = event.identifier
+        time.sleep(self.latency)
+        if self._fail():
+            yield 0
+            yield 0xC000, None
+            return
+        instances = [ds for ds in self.instances if matches(ds, identifier)]
+        yield len(instances)
+        for ds in instances:
+            if event.is_cancelled:
+                yield 0xFE00, None
+                return
+            self._count("c_store")
+            yield 0xFF00, ds
+
+    def start(self):
+        """Start the SCP in the background."""
+        ae = AE(ae_title=self.ae_title)
+        ae.supported_contexts = QueryRetrievePresentationContexts
+        for cx in StoragePresentationContexts:
+            # C-GET: the requestor acts as Storage SCP
+            ae.add_supported_context(cx.abstract_syntax, scu_role=True, scp_role=True)
+        ae.requested_contexts = StoragePresentationContexts[:120]
+        self._server = ae.start_server(
+            ("0.0.0.0", self.port), block=False,
+            evt_handlers=[(evt.EVT_ESTABLISHED, self._handle_established),
+                          (evt.EVT_C_FIND, self._handle_find),
+                          (evt.EVT_C_MOVE, self._handle_move),
+                          (evt.EVT_C_GET, self._handle_get)])
+        logging.info(f"Mock PACS listening on port {self.port} with {len(self.instances)} instances.")
+        return self
+
+    def shutdown(self):
+        """Stop the SCP."""
+        self._server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the mock PACS.")
+    parser.add_argument("--port", type=int, default=11112)
+    parser.add_argument("--ae-title", default="MOCK_PACS")
+    parser.add_argument("--destination", nargs=3, action="append", default=[],
+                        metavar=("AE_TITLE", "HOST", "PORT"), help="C-MOVE destination")
+    parser.add_argument("--patients", type=int, default=10)
+    parser.add_argument("--studies", type=int, default=3)
+    parser.add_argument("--series", type=int, default=10)
+    parser.add_argument("--instances", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    mock_pacs = MockPACS(
+        create_hierarchy(args.patients, args.studies, args.series, args.instances),
+        ae_title=args.ae_title, port=args.port,
+        destinations={ae: (host, int(port)) for ae, host, port in args.destination},
+        latency=args.latency, failure_rate=args.failure_rate).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock_pacs.shutdown()
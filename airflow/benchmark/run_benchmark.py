@@ -0,0 +1,105 @@
+from pathlib import Path
+
+import argparse
+import logging
+import resource
+import sys
+import time
+import tracemalloc
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "dags"))
+
+from pacs.client import association_count, map_queries
+from pacs.query_study_level import query_study_level
+from pacs.query_series_level import query_series_level
+from pacs.query_instance_level import query_instance_level
+from pacs.move_images import move_image, move_series, failed_images, successful_images
+
+from mock_pacs import MockPACS, create_hierarchy
+from mock_dicomweb import MockDICOMweb
+
+"""
+End-to-end throughput benchmark of the PACS stages (query_study_level to move_series) against the local mock
+PACS. Reports cases per hour, the number of associations and the memory usage. The C-FIND cache is disabled,
+since it requires MongoDB.
+"""
+
+
+def run_case(patient_id, config):
+    """Run the PACS stages of the fast pipeline for one patient."""
+    studies = query_study_level.function(PatientID=patient_id, StudyDate="20200101-20201231", **config)
+    series = []
+    for series_ in map_queries(
+            lambda study: query_series_level.function(study_dataset=study, **config), studies, **config):
+        series.extend(series_)
+    instances = map_queries(
+        lambda s: query_instance_level.function(series_dataset=s, **config), series, **config)
+    images = [move_image.function(instance_dataset=inst, **config) for inst in instances]
+    images_failed = failed_images.function(images)
+    images_series = [move_series.function(series_dataset=inst, **config) for inst in images_failed]
+    return len(successful_images.function(images)) + len(successful_images.function(images_series))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the PACS stages against the mock PACS.")
+    parser.add_argument("--cases", type=int, default=5)
+    parser.add_argument("--studies", type=int, default=3)
+    parser.add_argument("--series", type=int, default=10)
+    parser.add_argument("--instances", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.01, help="latency per request (s)")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--pool-size", type=int, default=4, help="0 disables association reuse")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--cancel-early", action="store_true")
+    parser.add_argument("--retrieve-mode", choices=["move", "get"], default="move")
+    parser.add_argument("--transport", choices=["dimse", "dicomweb"], default="dimse")
+    parser.add_argument("--dicomweb-port", type=int, default=8042)
+    parser.add_argument("--remote-port", type=int, default=11112)
+    parser.add_argument("--local-port", type=int, default=11113)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    config = {
+        "PACS_LOCAL_AE_TITLE": "BENCHMARK", "PACS_LOCAL_PORT": str(args.local_port),
+        "PACS_REMOTE_AE_TITLE": "MOCK_PACS", "PACS_REMOTE_URL": "127.0.0.1",
+        "PACS_REMOTE_PORT": str(args.remote_port),
+        "PACS_POOL_SIZE": str(args.pool_size), "PACS_MAX_CONCURRENCY": str(args.concurrency),
+        "PACS_RATE_LIMIT_CEILING": "1000", "PACS_RATE_LIMIT_INITIAL": "1000",
+        "PACS_CACHE_TTL": "0", "PACS_STUDY_QUERY_LEARN_WINDOW": "false",
+        "PACS_MOVE_SERIES_CANCEL_EARLY": str(args.cancel_early).lower(),
+        "PACS_RETRIEVE_MODE": args.retrieve_mode, "PACS_TRANSPORT": args.transport,
+        "PACS_DICOMWEB_URL": f"http://127.0.0.1:{args.dicomweb_port}"}
+
+    instances = create_hierarchy(args.cases, args.studies, args.series, args.instances)
+    mock_pacs = MockPACS(
+        instances,
+        port=args.remote_port, destinations={"BENCHMARK": ("127.0.0.1", args.local_port)},
+        latency=args.latency, failure_rate=args.failure_rate).start()
+    mock_dicomweb = MockDICOMweb(instances, port=args.dicomweb_port, latency=args.latency).start()
+
+    tracemalloc.start()
+    start = time.monotonic()
+    nr_of_images = 0
+    try:
+        for p in range(args.cases):
+            nr_of_images += run_case(f"MOCK{p:06d}", config)
+    finally:
+        duration = time.monotonic() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        mock_pacs.shutdown()
+        mock_dicomweb.shutdown()
+
+    print(f"Cases:                 {args.cases}")
+    print(f"Reference images:      {nr_of_images}")
+    print(f"Duration:              {duration:.1f}s")
+    print(f"Cases per hour:        {args.cases / duration * 3600:.0f}")
+    print(f"Associations (client): {association_count()}")
+    print(f"Associations (PACS):   {mock_pacs.stats['associations']}")
+    print(f"Requests (PACS):       C-FIND {mock_pacs.stats['c_find']}, C-MOVE {mock_pacs.stats['c_move']}, "
+          f"C-GET {mock_pacs.stats['c_get']}, C-STORE {mock_pacs.stats['c_store']}")
+    print(f"Requests (DICOMweb):   QIDO-RS {mock_dicomweb.stats['qido']}, WADO-RS {mock_dicomweb.stats['wado']}, "
+          f"connections {mock_dicomweb.stats['connections']}")
+    print(f"Peak traced memory:    {peak / 1024 ** 2:.1f} MiB")
+    print(f"Max RSS:               {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
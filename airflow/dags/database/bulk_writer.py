@@ -0,0 +1,76 @@
+from bson import InvalidDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import logging
+
+"""
+Buffered, unordered bulk inserts for the dump_* tasks. Documents are collected and written with insert_many in
+batches of MONGODB_BULK_BATCH_SIZE, i.e., one round trip per batch instead of one per document. Failing documents
+are reported without aborting the remaining documents of the batch.
+"""
+
+ID_KEYS = ["AccessionNumber", "StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID"]
+
+
+def describe(doc) -> str:
+    """Identifiers of a document for error reports."""
+    return ", ".join(f"{k}={doc[k]}" for k in ID_KEYS if k in doc) or str(doc.get("_id", None))
+
+
+class BulkWriter:
+    """Buffers documents and inserts them in unordered batches. Use as context manager to flush the rest."""
+
+    def __init__(self, collection, batch_size=500):
+        self.collection = collection
+        self.batch_size = max(int(batch_size), 1)
+        self.buffer = []
+        self.inserted = 0
+        self.errors = []
+
+    def insert(self, doc):
+        self.buffer.append(doc)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        docs, self.buffer = self.buffer, []
+        if len(docs) == 0:
+            return
+        try:
+            self.inserted += len(self.collection.insert_many(docs, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            self.inserted += e.details["nInserted"]
+            for error in e.details["writeErrors"]:
+                self._report(docs[error["index"]], error["errmsg"])
+        except InvalidDocument:
+            # raised while encoding, before or between the sub-batches sent to the server: insert one by one,
+            # documents already inserted are skipped since insert_many has assigned their _id
+            for doc in docs:
+                try:
+                    self.collection.insert_one(doc)
+                    self.inserted += 1
+                except DuplicateKeyError:
+                    self.inserted += 1
+                except InvalidDocument as e:
+                    self._report(doc, str(e))
+
+    def check(self):
+        """Fail the task after all other documents have been written if any document could not be inserted."""
+        if len(self.errors) > 0:
+            raise RuntimeError(f"{len(self.errors)} documents could not be inserted into {self.collection.name}: "
+                               + "; ".join(e["document"] for e in self.errors))
+
+    def _report(self, doc, message):
+        self.errors.append({"document": describe(doc), "error": message})
+        logging.error(f"Could not insert document into {self.collection.name} ({describe(doc)}): {message}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+        logging.info(f"Inserted {self.inserted} documents into {self.collection.name}, {len(self.errors)} failed.")
+
+
+def bulk_writer(collection, **kwargs) -> BulkWriter:
+    return BulkWriter(collection, batch_size=kwargs.get("MONGODB_BULK_BATCH_SIZE", 500))
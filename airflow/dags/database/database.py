@@ -1,16 +1,7 @@
 from typing import List, Union, Dict, Any
 
-import pandas as pd
 from airflow.decorators import task
-from bson import InvalidDocument
-from pydicom import Dataset
 from datetime import datetime
-from dicom_parser import Header
-from pydicom.valuerep import DSfloat, IS, PersonName
-from pydicom.multival import MultiValue
-from pydicom.uid import UID
-from pydicom.sequence import Sequence
-from pydicom.tag import BaseTag
 from collections import OrderedDict
 
 import dateutil.parser
@@ -22,25 +13,74 @@ import requests
 import sys
 sys.path.append(".")
 
+from database import prediction_cache
+from database.bulk_writer import bulk_writer
+from database.dicom_json import to_mongo_dict
 from utils.misc import mongo_get_collection
 
 
 def predict_sequence_type(mod, tag, df_predict, url, port):
     """Creates and submits the prediction query to sequence-classification module."""
-    if "t1" in df_predict[tag].values[0]:
-        return "T1 Imaging"   # workaround until more training data is available
-    elif mod not in ["CT", "MR"]:
-        return "Other"
-    else:
+    return predict_sequence_types(mod, tag, df_predict[tag].to_list(), url, port)[0]
+
+
+def predict_sequence_types(mod, tag, values, url, port, **kwargs):
+    """
+    Predicts the sequence types of a list of tag values of one modality with a single request to the
+    sequence-classification module. Each distinct value is only submitted once, cached predictions of the current
+    model version are reused (see prediction_cache.py).
+    """
+    res = {}
+    for v in values:
+        if "t1" in v:
+            res[v] = "T1 Imaging"   # workaround until more training data is available
+        elif mod not in ["CT", "MR"]:
+            res[v] = "Other"
+    unknown = list(dict.fromkeys(v for v in values if v not in res))
+    if len(unknown) > 0:
+        version = prediction_cache.model_version(mod, tag, url, port, **kwargs) \
+            if prediction_cache.cache_size(**kwargs) > 0 else None
+        cached = prediction_cache.get_cached(mod, tag, unknown, version, **kwargs)
+        res.update(cached)
+        unknown = [v for v in unknown if v not in cached]
+    if len(unknown) > 0:
         predict_query = {
             "modality": mod,
             "tag": tag,
-            "model_version": -1,  # use current version
-            "dataset": df_predict.to_dict(orient="records")}
+            "model_version": -1 if version is None else version,  # -1: use current version
+            "dataset": [{tag: v} for v in unknown]}
         predict_response = requests.post(
             f"http://{url}:{port}/predict", json=predict_query)
         predict_response = predict_response.json()
-        return predict_response["prediction_dataset"][0]["y"]
+        predicted = dict(zip(unknown, [p["y"] for p in predict_response["prediction_dataset"]]))
+        prediction_cache.set_cached(mod, tag, predicted, version, **kwargs)
+        res.update(predicted)
+    return [res[v] for v in values]
+
+
+def assign_sequence_types(parsed_images, url, port, **kwargs):
+    """Sets _SequenceType of all images of a case, one prediction request per modality."""
+    descriptions = {}
+    for parsed_image in parsed_images:
+        if "Modality" in parsed_image and "SeriesDescription" in parsed_image:
+            descriptions.setdefault(parsed_image["Modality"], set()).add(parsed_image["SeriesDescription"])
+        else:
+            parsed_image["_SequenceType"] = "Other"
+    sequence_types = {}
+    for mod, values in descriptions.items():
+        values = sorted(values)
+        predictions = predict_sequence_types(mod, "SeriesDescription", values, url, port, **kwargs)
+        for v, sequence_type in zip(values, predictions):
+            sequence_types[(mod, v)] = sequence_type
+            logging.info(f"{v} --> {sequence_type}")
+    for parsed_image in parsed_images:
+        if "_SequenceType" not in parsed_image:
+            parsed_image["_SequenceType"] = sequence_types[
+                (parsed_image["Modality"], parsed_image["SeriesDescription"])]
+    if prediction_cache.cache_size(**kwargs) > 0:
+        stats = prediction_cache.cache_stats()
+        logging.info(f"Sequence type cache: {stats['hits']} hits, {stats['shared_hits']} shared hits, "
+                     f"{stats['misses']} misses (hit rate {stats['hit_rate']:.1%}).")
 
 
 def parse_date(date_str):
@@ -56,63 +96,25 @@ def parse_date(date_str):
     raise ValueError(f"{date_str} is an invalid date/time format!")
 
 
-def parse_tag(v):
-    """Parse DICOM tags and store them in a MongoDB-compatible format."""
-    if type(v) is bytes:
-        return v
-    elif type(v) == list:
-        return [parse_tag(e) for e in v]
-    elif type(v) in [str, int, float]:
-        return v
-    elif type(v) == DSfloat:
-        return float(v)
-    elif type(v) == MultiValue:
-        return [parse_tag(i) for i in v]
-    elif type(v) in [UID, PersonName, BaseTag]:
-        return str(v)
-    elif type(v) is IS:
-        return int(v)
-    elif type(v) is Sequence:
-        return [parse_tag(i) for i in v]
-    elif type(v) is Dataset:
-        return parse_tag(Header(v).to_dict(parsed=False))
-    elif type(v) is dict:
-        _v = {}
-        for key, val in v.items():
-            _v[key.replace(".", "")] = parse_tag(val)
-        return _v
-    elif v is None:
-        return v
-    else:
-        logging.error(str(type(v)))
-        raise ValueError("Unknown value type!")
-
-
-def dataset_to_mongo_dict(image_dict):
-    """Parse DICOM data and return MongoDB-compatible dictionary."""
-    res = {}
-    for k, v in image_dict.items():
-        if type(v) is bytes:
-            continue
-        elif k == "":
-            continue
-        elif k == "Unknown":
-            continue
-        elif "UserData" in k:
-            continue
-        elif "." in k:
-            k_new = k.replace(".", "")
-            res[k_new] = parse_tag(image_dict[k])
-        else:
-            res[k] = parse_tag(image_dict[k])
-    return res
+def delete_case(ssr_id, **kwargs):
+    """
+    Remove the studies, series, images, failed retrievals and tests of ssr_id, such that a dump interrupted after
+    writing some of them (e.g., a resumed backfill or a retried task) can be repeated without duplicates.
+    """
+    for collection_name in ["studies", "series", "instances", "errors", "tests"]:
+        collection = mongo_get_collection(
+            collection_name,
+            user=kwargs["MONGODB_USER"], password=kwargs["MONGODB_PASSWORD"],
+            url=kwargs["DEPLOYMENT_URL"], port=kwargs["MONGODB_PORT"], db=kwargs["MONGODB_DATABASE_NAME"])
+        res = collection.delete_many({"_SSRID": ssr_id})
+        if res.deleted_count > 0:
+            logging.info(f"Removed {res.deleted_count} documents of {ssr_id} from {collection_name}.")
 
 
 def parse_datasets(datasets: List[Dict[str, Any]]):
     """Transforms the json datasets to dicts."""
     for ds in datasets:
-        yield dataset_to_mongo_dict(Header(
-            Dataset.from_json(ds, bulk_data_uri_handler=lambda _: None)).to_dict(parsed=False))
+        yield to_mongo_dict(ds)
 
 
 @task
@@ -125,15 +127,17 @@ def dump_studies(ssr_id, **kwargs):
     task_instance = kwargs["ti"]
     studies = task_instance.xcom_pull(task_ids=f"filter_studies")
     logging.info(f"Writing {len(studies)} studies to database.")
-    for parsed_study in parse_datasets(studies):
-        parsed_study["_SSRID"] = ssr_id
-        d = parsed_study["StudyDate"][:8] + parsed_study["StudyTime"][:6]
-        try:
-            parsed_study["_StudyTimeExact"] = parse_date(d)
-        except ValueError:
-            logging.error(f"{d} is an invalid study date/time format! "
-                          f"({parsed_study['AccessionNumber']})")
-        studies_collection.insert_one(parsed_study)
+    with bulk_writer(studies_collection, **kwargs) as writer:
+        for parsed_study in parse_datasets(studies):
+            parsed_study["_SSRID"] = ssr_id
+            d = parsed_study["StudyDate"][:8] + parsed_study["StudyTime"][:6]
+            try:
+                parsed_study["_StudyTimeExact"] = parse_date(d)
+            except ValueError:
+                logging.error(f"{d} is an invalid study date/time format! "
+                              f"({parsed_study['AccessionNumber']})")
+            writer.insert(parsed_study)
+    writer.check()
 
 
 @task
@@ -144,15 +148,17 @@ def dump_studies_all(ssr_id, studies, **kwargs):
         user=kwargs["MONGODB_USER"], password=kwargs["MONGODB_PASSWORD"],
         url=kwargs["DEPLOYMENT_URL"], port=kwargs["MONGODB_PORT"], db=kwargs["MONGODB_DATABASE_NAME"])
     logging.info(f"Writing {len(studies)} studies to database.")
-    for parsed_study in parse_datasets(studies):
-        parsed_study["_SSRID"] = ssr_id
-        d = parsed_study["StudyDate"][:8] + parsed_study["StudyTime"][:6]
-        try:
-            parsed_study["_StudyTimeExact"] = parse_date(d)
-        except ValueError:
-            logging.error(f"{d} is an invalid study date/time format! "
-                          f"({parsed_study['AccessionNumber']})")
-        studies_collection.insert_one(parsed_study)
+    with bulk_writer(studies_collection, **kwargs) as writer:
+        for parsed_study in parse_datasets(studies):
+            parsed_study["_SSRID"] = ssr_id
+            d = parsed_study["StudyDate"][:8] + parsed_study["StudyTime"][:6]
+            try:
+                parsed_study["_StudyTimeExact"] = parse_date(d)
+            except ValueError:
+                logging.error(f"{d} is an invalid study date/time format! "
+                              f"({parsed_study['AccessionNumber']})")
+            writer.insert(parsed_study)
+    writer.check()
 
 
 @task
@@ -165,22 +171,24 @@ def dump_series(ssr_id, **kwargs):
     task_instance = kwargs["ti"]
     series = task_instance.xcom_pull(task_ids=f"filter_series")
     logging.info(f"Writing {len(series)} series to database.")
-    for parsed_series in parse_datasets(series):
-        d = parsed_series["StudyDate"][:8] + parsed_series["StudyTime"][:6]
-        try:
-            parsed_series["_StudyTimeExact"] = parse_date(d)
-        except ValueError:
-            logging.error(f"{d} is an invalid study date/time format! "
-                          f"({parsed_series['AccessionNumber']})")
-        if "SeriesDate" in parsed_series and "SeriesTime" in parsed_series:
-            d = parsed_series["SeriesDate"][:8] + parsed_series["SeriesTime"][:6]
+    with bulk_writer(series_collection, **kwargs) as writer:
+        for parsed_series in parse_datasets(series):
+            d = parsed_series["StudyDate"][:8] + parsed_series["StudyTime"][:6]
             try:
-                parsed_series["_SeriesTimeExact"] = parse_date(d)
+                parsed_series["_StudyTimeExact"] = parse_date(d)
             except ValueError:
-                logging.error(f"{d} is an invalid series date/time format! "
+                logging.error(f"{d} is an invalid study date/time format! "
                               f"({parsed_series['AccessionNumber']})")
-        parsed_series["_SSRID"] = ssr_id
-        series_collection.insert_one(parsed_series)
+            if "SeriesDate" in parsed_series and "SeriesTime" in parsed_series:
+                d = parsed_series["SeriesDate"][:8] + parsed_series["SeriesTime"][:6]
+                try:
+                    parsed_series["_SeriesTimeExact"] = parse_date(d)
+                except ValueError:
+                    logging.error(f"{d} is an invalid series date/time format! "
+                                  f"({parsed_series['AccessionNumber']})")
+            parsed_series["_SSRID"] = ssr_id
+            writer.insert(parsed_series)
+    writer.check()
 
 
 @task
@@ -191,22 +199,24 @@ def dump_series_all(ssr_id, series, **kwargs):
         user=kwargs["MONGODB_USER"], password=kwargs["MONGODB_PASSWORD"],
         url=kwargs["DEPLOYMENT_URL"], port=kwargs["MONGODB_PORT"], db=kwargs["MONGODB_DATABASE_NAME"])
     logging.info(f"Writing {len(series)} series to database.")
-    for parsed_series in parse_datasets(series):
-        d = parsed_series["StudyDate"][:8] + parsed_series["StudyTime"][:6]
-        try:
-            parsed_series["_StudyTimeExact"] = parse_date(d)
-        except ValueError:
-            logging.error(f"{d} is an invalid study date/time format! "
-                          f"({parsed_series['AccessionNumber']})")
-        if "SeriesDate" in parsed_series and "SeriesTime" in parsed_series:
-            d = parsed_series["SeriesDate"][:8] + parsed_series["SeriesTime"][:6]
+    with bulk_writer(series_collection, **kwargs) as writer:
+        for parsed_series in parse_datasets(series):
+            d = parsed_series["StudyDate"][:8] + parsed_series["StudyTime"][:6]
             try:
-                parsed_series["_SeriesTimeExact"] = parse_date(d)
+                parsed_series["_StudyTimeExact"] = parse_date(d)
             except ValueError:
-                logging.error(f"{d} is an invalid series date/time format! "
+                logging.error(f"{d} is an invalid study date/time format! "
                               f"({parsed_series['AccessionNumber']})")
-        parsed_series["_SSRID"] = ssr_id
-        series_collection.insert_one(parsed_series)
+            if "SeriesDate" in parsed_series and "SeriesTime" in parsed_series:
+                d = parsed_series["SeriesDate"][:8] + parsed_series["SeriesTime"][:6]
+                try:
+                    parsed_series["_SeriesTimeExact"] = parse_date(d)
+                except ValueError:
+                    logging.error(f"{d} is an invalid series date/time format! "
+                                  f"({parsed_series['AccessionNumber']})")
+            parsed_series["_SSRID"] = ssr_id
+            writer.insert(parsed_series)
+    writer.check()
 
 
 @task
@@ -219,45 +229,39 @@ def dump_images(ssr_id, **kwargs):
     task_instance = kwargs["ti"]
     images = task_instance.xcom_pull(task_ids=f"filter_images")
     logging.info(f"Writing {len(images)} images to database.")
-    for parsed_image in parse_datasets(images):
-        parsed_image["_SSRID"] = ssr_id
-        if "StudyDate" in parsed_image and "StudyTime" in parsed_image:
-            d = parsed_image["StudyDate"][:8] + parsed_image["StudyTime"][:6]
-            try:
-                parsed_image["_StudyTimeExact"] = parse_date(d)
-            except ValueError:
-                logging.error(f"{d} is an invalid study date/time format! "
-                              f"({parsed_image['AccessionNumber']})")
-        if "SeriesDate" in parsed_image and "SeriesTime" in parsed_image:
-            d = parsed_image["SeriesDate"][:8] + parsed_image["SeriesTime"][:6]
-            try:
-                parsed_image["_SeriesTimeExact"] = parse_date(d)
-            except ValueError:
-                logging.error(f"{d} is an invalid series date/time format! "
-                              f"({parsed_image['AccessionNumber']})")
-        if "AcquisitionDate" in parsed_image and "AcquisitionTime" in parsed_image:
-            d = parsed_image["AcquisitionDate"][:8] + parsed_image["AcquisitionTime"][:6]
-            try:
-                parsed_image["_AcquisitionTimeExact"] = parse_date(d)
-            except ValueError:
-                logging.error(f"{d} is an invalid acquisition date/time format! "
-                              f"({parsed_image['AccessionNumber']})")
-        if "Modality" in parsed_image and "SeriesDescription" in parsed_image:
-            df_predict = pd.DataFrame(
-                {"SeriesDescription": [parsed_image["SeriesDescription"]]})
-            parsed_image["_SequenceType"] = predict_sequence_type(
-                mod=parsed_image["Modality"], tag="SeriesDescription",
-                df_predict=df_predict, url=kwargs["DEPLOYMENT_URL"],
-                port=kwargs["SEQUENCE_CLASSIFICATION_PORT"])
-            logging.info(f"{parsed_image['SeriesDescription']} --> "
-                         f"{parsed_image['_SequenceType']}")
-        else:
-            parsed_image["_SequenceType"] = "Other"
-        odict = OrderedDict(sorted(
-            [(k, v) for k, v in parsed_image.items()], key=lambda t: t[0]))
-        if "Volumes_info" in odict:
-            del odict["Volumes_info"]
-        instances_collection.insert_one(odict)
+    parsed_images = list(parse_datasets(images))
+    assign_sequence_types(
+        parsed_images, url=kwargs["DEPLOYMENT_URL"], port=kwargs["SEQUENCE_CLASSIFICATION_PORT"], **kwargs)
+    with bulk_writer(instances_collection, **kwargs) as writer:
+        for parsed_image in parsed_images:
+            parsed_image["_SSRID"] = ssr_id
+            if "StudyDate" in parsed_image and "StudyTime" in parsed_image:
+                d = parsed_image["StudyDate"][:8] + parsed_image["StudyTime"][:6]
+                try:
+                    parsed_image["_StudyTimeExact"] = parse_date(d)
+                except ValueError:
+                    logging.error(f"{d} is an invalid study date/time format! "
+                                  f"({parsed_image['AccessionNumber']})")
+            if "SeriesDate" in parsed_image and "SeriesTime" in parsed_image:
+                d = parsed_image["SeriesDate"][:8] + parsed_image["SeriesTime"][:6]
+                try:
+                    parsed_image["_SeriesTimeExact"] = parse_date(d)
+                except ValueError:
+                    logging.error(f"{d} is an invalid series date/time format! "
+                                  f"({parsed_image['AccessionNumber']})")
+            if "AcquisitionDate" in parsed_image and "AcquisitionTime" in parsed_image:
+                d = parsed_image["AcquisitionDate"][:8] + parsed_image["AcquisitionTime"][:6]
+                try:
+                    parsed_image["_AcquisitionTimeExact"] = parse_date(d)
+                except ValueError:
+                    logging.error(f"{d} is an invalid acquisition date/time format! "
+                                  f"({parsed_image['AccessionNumber']})")
+            odict = OrderedDict(sorted(
+                [(k, v) for k, v in parsed_image.items()], key=lambda t: t[0]))
+            if "Volumes_info" in odict:
+                del odict["Volumes_info"]
+            writer.insert(odict)
+    writer.check()
 
 
 @task
@@ -268,50 +272,39 @@ def dump_images_all(ssr_id, images, **kwargs):
         user=kwargs["MONGODB_USER"], password=kwargs["MONGODB_PASSWORD"],
         url=kwargs["DEPLOYMENT_URL"], port=kwargs["MONGODB_PORT"], db=kwargs["MONGODB_DATABASE_NAME"])
     logging.info(f"Writing {len(images)} images to database.")
-    for parsed_image in parse_datasets(images):
-        parsed_image["_SSRID"] = ssr_id
-        if "StudyDate" in parsed_image and "StudyTime" in parsed_image:
-            d = parsed_image["StudyDate"][:8] + parsed_image["StudyTime"][:6]
-            try:
-                parsed_image["_StudyTimeExact"] = parse_date(d)
-            except ValueError:
-                logging.error(f"{d} is an invalid study date/time format! "
-                              f"({parsed_image['AccessionNumber']})")
-        if "SeriesDate" in parsed_image and "SeriesTime" in parsed_image:
-            d = parsed_image["SeriesDate"][:8] + parsed_image["SeriesTime"][:6]
-            try:
-                parsed_image["_SeriesTimeExact"] = parse_date(d)
-            except ValueError:
-                logging.error(f"{d} is an invalid series date/time format! "
-                              f"({parsed_image['AccessionNumber']})")
-        if "AcquisitionDate" in parsed_image and "AcquisitionTime" in parsed_image:
-            d = parsed_image["AcquisitionDate"][:8] + parsed_image["AcquisitionTime"][:6]
-            try:
-                parsed_image["_AcquisitionTimeExact"] = parse_date(d)
-            except ValueError:
-                logging.error(f"{d} is an invalid acquisition date/time format! "
-                              f"({parsed_image['AccessionNumber']})")
-        if "Modality" in parsed_image and "SeriesDescription" in parsed_image:
-            df_predict = pd.DataFrame(
-                {"SeriesDescription": [parsed_image["SeriesDescription"]]})
-            parsed_image["_SequenceType"] = predict_sequence_type(
-                mod=parsed_image["Modality"], tag="SeriesDescription",
-                df_predict=df_predict, url=kwargs["DEPLOYMENT_URL"],
-                port=kwargs["SEQUENCE_CLASSIFICATION_PORT"])
-            logging.info(f"{parsed_image['SeriesDescription']} --> "
-                         f"{parsed_image['_SequenceType']}")
-        else:
-            parsed_image["_SequenceType"] = "Other"
-        odict = OrderedDict(sorted(
-            [(k, v) for k, v in parsed_image.items()], key=lambda t: t[0]))
-        if "Volumes_info" in odict:
-            del odict["Volumes_info"]
-        try:
-            instances_collection.insert_one(odict)
-        except InvalidDocument:
-            raise RuntimeError("dot in k",
-                               odict["AccessionNumber"], odict["StudyInstanceUID"],
-                               odict["SeriesInstanceUID"], odict["SOPInstanceUID"])
+    parsed_images = list(parse_datasets(images))
+    assign_sequence_types(
+        parsed_images, url=kwargs["DEPLOYMENT_URL"], port=kwargs["SEQUENCE_CLASSIFICATION_PORT"], **kwargs)
+    with bulk_writer(instances_collection, **kwargs) as writer:
+        for parsed_image in parsed_images:
+            parsed_image["_SSRID"] = ssr_id
+            if "StudyDate" in parsed_image and "StudyTime" in parsed_image:
+                d = parsed_image["StudyDate"][:8] + parsed_image["StudyTime"][:6]
+                try:
+                    parsed_image["_StudyTimeExact"] = parse_date(d)
+                except ValueError:
+                    logging.error(f"{d} is an invalid study date/time format! "
+                                  f"({parsed_image['AccessionNumber']})")
+            if "SeriesDate" in parsed_image and "SeriesTime" in parsed_image:
+                d = parsed_image["SeriesDate"][:8] + parsed_image["SeriesTime"][:6]
+                try:
+                    parsed_image["_SeriesTimeExact"] = parse_date(d)
+                except ValueError:
+                    logging.error(f"{d} is an invalid series date/time format! "
+                                  f"({parsed_image['AccessionNumber']})")
+            if "AcquisitionDate" in parsed_image and "AcquisitionTime" in parsed_image:
+                d = parsed_image["AcquisitionDate"][:8] + parsed_image["AcquisitionTime"][:6]
+                try:
+                    parsed_image["_AcquisitionTimeExact"] = parse_date(d)
+                except ValueError:
+                    logging.error(f"{d} is an invalid acquisition date/time format! "
+                                  f"({parsed_image['AccessionNumber']})")
+            odict = OrderedDict(sorted(
+                [(k, v) for k, v in parsed_image.items()], key=lambda t: t[0]))
+            if "Volumes_info" in odict:
+                del odict["Volumes_info"]
+            writer.insert(odict)
+    writer.check()
 
 
 @task
@@ -324,11 +317,13 @@ def dump_failed(ssr_id, **kwargs):
     task_instance = kwargs["ti"]
     failed_queries = task_instance.xcom_pull(task_ids=f"failed_images_final")
     logging.info(f"Writing {len(failed_queries)} failed queries to database.")
-    for parsed_dataset in parse_datasets(failed_queries):
-        if not parsed_dataset:
-            continue
-        parsed_dataset["_SSRID"] = ssr_id
-        errors_collection.insert_one(parsed_dataset)
+    with bulk_writer(errors_collection, **kwargs) as writer:
+        for parsed_dataset in parse_datasets(failed_queries):
+            if not parsed_dataset:
+                continue
+            parsed_dataset["_SSRID"] = ssr_id
+            writer.insert(parsed_dataset)
+    writer.check()
 
 
 @task
@@ -339,11 +334,13 @@ def dump_failed_all(ssr_id, failed_queries, **kwargs):
         user=kwargs["MONGODB_USER"], password=kwargs["MONGODB_PASSWORD"],
         url=kwargs["DEPLOYMENT_URL"], port=kwargs["MONGODB_PORT"], db=kwargs["MONGODB_DATABASE_NAME"])
     logging.info(f"Writing {len(failed_queries)} failed queries to database.")
-    for parsed_dataset in parse_datasets(failed_queries):
-        if not parsed_dataset:
-            continue
-        parsed_dataset["_SSRID"] = ssr_id
-        errors_collection.insert_one(parsed_dataset)
+    with bulk_writer(errors_collection, **kwargs) as writer:
+        for parsed_dataset in parse_datasets(failed_queries):
+            if not parsed_dataset:
+                continue
+            parsed_dataset["_SSRID"] = ssr_id
+            writer.insert(parsed_dataset)
+    writer.check()
 
 
 @task
@@ -364,7 +361,7 @@ def dump_tests(**kwargs):
     logging.info(door_to_image_time)
     res = {**json.loads(external_imaging), **json.loads(first_internal_imaging),
            **json.loads(second_internal_imaging), **json.loads(door_to_image_time)}
-    tests_collection.insert_one(res)
+    tests_collection.replace_one({"_SSRID": res["_SSRID"]}, res, upsert=True)
 
 
 @task
@@ -382,4 +379,4 @@ def dump_tests_all(
     logging.info(door_to_image_time)
     res = {**json.loads(external_imaging), **json.loads(first_internal_imaging),
            **json.loads(second_internal_imaging), **json.loads(door_to_image_time)}
-    tests_collection.insert_one(res)
+    tests_collection.replace_one({"_SSRID": res["_SSRID"]}, res, upsert=True)
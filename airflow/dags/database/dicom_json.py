@@ -0,0 +1,118 @@
+from pydicom.datadict import DicomDictionary, private_dictionary_description
+
+import base64
+import json
+
+"""
+Single-pass conversion of DICOM JSON (as returned by the query and retrieve tasks) to MongoDB documents. Produces
+the same documents as Dataset.from_json + dicom_parser.Header.to_dict + parse_tag did, without building pydicom
+datasets: keywords are looked up in a precomputed table and values are converted by a dispatch table on the VR.
+Private tags are named after their description in the pydicom private dictionary of their private creator (e.g.,
+"[Autotrack Peak]" -> "AutotrackPeak"), like dicom_parser does.
+"""
+
+# string VRs are empty strings if no value is given, SQ an empty list and all other VRs None (same as pydicom)
+TEXT_VRS = {"AE", "AS", "CS", "DA", "DT", "LO", "LT", "PN", "SH", "ST", "TM", "UC", "UI", "UR", "UT"}
+
+_keywords = {f"{tag:08X}": entry[4] for tag, entry in DicomDictionary.items()}
+_private_keywords = {}
+
+
+def keyword(tag: str) -> str:
+    """Keyword of a standard tag ("0020000D"), empty for private, repeater and unknown tags (same as pydicom)."""
+    return _keywords.get(tag, "")
+
+
+def private_creator(ds_json: dict, tag: str):
+    """Private creator of a private tag ("00091001") in the dataset, None for private creator elements."""
+    block = int(tag[4:6], 16)
+    if block == 0:
+        return None
+    creator = (ds_json.get(f"{tag[:4]}00{block:02X}", {}).get("Value", None) or [None])[0]
+    return creator if isinstance(creator, str) else None
+
+
+def private_keyword(tag: str, creator) -> str:
+    """Keyword of a private tag derived from the private dictionary of its creator, empty if unknown."""
+    try:
+        return _private_keywords[(tag, creator)]
+    except KeyError:
+        pass
+    try:
+        name = private_dictionary_description(int(tag, 16), creator) if creator else ""
+    except KeyError:
+        name = ""
+    _private_keywords[(tag, creator)] = name.title().replace(" ", "") if " " in name else name
+    return _private_keywords[(tag, creator)]
+
+
+def _person_name(v):
+    if not isinstance(v, dict):
+        return v
+    return "=".join([v.get("Alphabetic", ""), v.get("Ideographic", ""), v.get("Phonetic", "")]).rstrip("=")
+
+
+def _decimal_string(v):
+    return None if v is None else float(v)
+
+
+def _integer_string(v):
+    return v if v is None or type(v) is int else int(float(v))
+
+
+def _attribute_tag(v):
+    # lower case, same as str(pydicom.tag.BaseTag)
+    return f"({v[:4].lower()}, {v[4:].lower()})"
+
+
+def _sequence_item(v):
+    return to_dict(v, top_level=False)
+
+
+VALUE_CONVERTERS = {
+    "PN": _person_name,
+    "DS": _decimal_string,
+    "IS": _integer_string,
+    "AT": _attribute_tag,
+    "SQ": _sequence_item}
+
+
+def convert_element(element: dict):
+    """Convert the value of a DICOM JSON element, bulk data references are not resolved (None)."""
+    vr = element.get("vr", "UN")
+    if "Value" in element and len(element["Value"]) > 0:
+        values = element["Value"]
+        if vr == "SQ":
+            return [_sequence_item(v) for v in values]
+        convert = VALUE_CONVERTERS.get(vr, None)
+        if convert is not None:
+            values = [convert(v) for v in values]
+        return values[0] if len(values) == 1 else values
+    if "InlineBinary" in element:
+        return base64.b64decode(element["InlineBinary"])
+    if vr == "SQ":
+        return []
+    return "" if vr in TEXT_VRS and "BulkDataURI" not in element else None
+
+
+def to_dict(ds_json: dict, top_level=True) -> dict:
+    """
+    Convert a DICOM JSON dataset to a MongoDB-compatible dictionary keyed by keywords. On the top level, unknown
+    tags as well as binary values are skipped (sequence items keep them, as before).
+    """
+    res = {}
+    for tag, element in ds_json.items():
+        private = tag[3] in "13579BDF"
+        k = private_keyword(tag, private_creator(ds_json, tag)) if private else keyword(tag)
+        if top_level and (k in ["", "Unknown"] or "UserData" in k):
+            continue
+        v = convert_element(element)
+        if top_level and type(v) is bytes:
+            continue
+        res[k.replace(".", "") if private else k] = v
+    return res
+
+
+def to_mongo_dict(ds) -> dict:
+    """Convert a DICOM JSON dataset (string or dict) to a MongoDB-compatible dictionary."""
+    return to_dict(json.loads(ds) if isinstance(ds, (str, bytes)) else ds)
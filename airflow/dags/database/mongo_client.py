@@ -0,0 +1,50 @@
+from threading import Lock
+
+from pymongo import MongoClient
+
+import importlib.util
+import os
+
+"""
+Process-wide MongoClient per connection string, i.e., connection pool, server discovery and auth are shared by all
+threads of a process. Shared with the gui-backend and sequence-classification images (copied to /shared, see their
+Dockerfiles), i.e., this module must not depend on Airflow.
+"""
+
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+_clients = {}
+_clients_lock = Lock()
+
+
+def _reset_clients():
+    """MongoClient is not fork-safe: forked workers (Celery, task runners, uvicorn) create their own clients."""
+    global _clients_lock
+    _clients.clear()
+    _clients_lock = Lock()
+
+
+os.register_at_fork(after_in_child=_reset_clients)
+
+
+def mongo_client_options(**kwargs) -> dict:
+    """
+    Pool sizes and wire compression (MONGODB_MAX_POOL_SIZE, MONGODB_MIN_POOL_SIZE, MONGODB_COMPRESSORS in order of
+    preference). Compressors whose Python module is not installed are skipped.
+    """
+    compressors = [c.strip() for c in kwargs.get("MONGODB_COMPRESSORS", "zstd,snappy,zlib").split(",")
+                   if c.strip() in COMPRESSOR_MODULES and importlib.util.find_spec(COMPRESSOR_MODULES[c.strip()])]
+    options = {
+        "maxPoolSize": int(kwargs.get("MONGODB_MAX_POOL_SIZE", 100)),
+        "minPoolSize": int(kwargs.get("MONGODB_MIN_POOL_SIZE", 0))}
+    if len(compressors) > 0:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+
+def mongo_client(connection_string, **kwargs) -> MongoClient:
+    """Get the client of this process for connection_string, created with the options in kwargs on first use."""
+    with _clients_lock:
+        if connection_string not in _clients:
+            _clients[connection_string] = MongoClient(connection_string, **mongo_client_options(**kwargs))
+        return _clients[connection_string]
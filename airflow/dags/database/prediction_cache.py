@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from utils.misc import mongo_get_collection
+
+import logging
+import requests
+import time
+
+"""
+Cache for sequence type predictions, keyed by (modality, tag, normalised value, model version). Each worker process
+keeps a bounded LRU cache (SEQUENCE_CACHE_SIZE entries, 0 disables the cache) whose entries expire after
+SEQUENCE_CACHE_TTL seconds. With SEQUENCE_CACHE_MONGO=true, predictions are also shared between workers in the MongoDB
+collection sequence_type_cache. The current model version is polled from /model_versions every
+SEQUENCE_MODEL_VERSION_TTL seconds, entries of previous versions are dropped when a new version appears.
+"""
+
+CACHE_COLLECTION = "sequence_type_cache"
+
+_cache = OrderedDict()
+_versions = {}
+_counters = {"hits": 0, "shared_hits": 0, "misses": 0}
+_lock = Lock()
+_indexed = set()
+
+
+def cache_size(**kwargs) -> int:
+    return int(kwargs.get("SEQUENCE_CACHE_SIZE", 10000))
+
+
+def cache_ttl(**kwargs) -> int:
+    """TTL of cache entries in seconds."""
+    return int(kwargs.get("SEQUENCE_CACHE_TTL", 7 * 24 * 3600))
+
+
+def shared(**kwargs) -> bool:
+    return str(kwargs.get("SEQUENCE_CACHE_MONGO", "false")).lower() == "true"
+
+
+def normalise(value) -> str:
+    """Same normalisation as the text encoder of the classifier, i.e., values with equal features share an entry."""
+    return " ".join(str(value).lower().replace("_", " ").split())
+
+
+def _collection(**kwargs):
+    collection = mongo_get_collection(
+        CACHE_COLLECTION,
+        user=kwargs["MONGODB_USER"], password=kwargs["MONGODB_PASSWORD"],
+        url=kwargs["DEPLOYMENT_URL"], port=kwargs["MONGODB_PORT"], db=kwargs["MONGODB_DATABASE_NAME"])
+    ttl = cache_ttl(**kwargs)
+    if ttl not in _indexed:
+        try:
+            collection.create_index("created_at", name="ttl", expireAfterSeconds=max(ttl, 0))
+        except OperationFailure as e:
+            logging.warning(f"Could not create TTL index: {e}")
+        _indexed.add(ttl)
+    return collection
+
+
+def _invalidate(mod, tag, version, **kwargs):
+    """Drop the entries of other model versions of modality and tag."""
+    with _lock:
+        for key in [k for k in _cache if k[:2] == (mod, tag) and k[3] != version]:
+            del _cache[key]
+    if shared(**kwargs):
+        _collection(**kwargs).delete_many({"modality": mod, "tag": tag, "model_version": {"$ne": version}})
+
+
+def model_version(mod, tag, url, port, **kwargs):
+    """Current model version for modality and tag, None if no model is available or the server is not reachable."""
+    checked = _versions.get((mod, tag), None)
+    if checked is not None and time.monotonic() - checked[1] < int(kwargs.get("SEQUENCE_MODEL_VERSION_TTL", 300)):
+        return checked[0]
+    try:
+        versions = requests.post(f"http://{url}:{port}/model_versions", json={"modality": mod, "tag": tag}).json()
+    except (requests.RequestException, ValueError) as e:
+        logging.warning(f"Could not get model versions for {mod}/{tag}: {e}")
+        return None
+    version = max(versions) if len(versions) > 0 else None
+    if checked is not None and checked[0] != version:
+        logging.info(f"Model version of {mod}/{tag} changed from {checked[0]} to {version}, invalidating cache.")
+        _invalidate(mod, tag, version, **kwargs)
+    _versions[(mod, tag)] = (version, time.monotonic())
+    return version
+
+
+def get_cached(mod, tag, values, version, **kwargs) -> dict:
+    """Cached labels of values (value -> label), values not in the cache are missing."""
+    if cache_size(**kwargs) <= 0 or version is None:
+        return {}
+    res, now = {}, time.monotonic()
+    with _lock:
+        for v in values:
+            key = (mod, tag, normalise(v), version)
+            entry = _cache.get(key, None)
+            if entry is not None and now - entry[1] < cache_ttl(**kwargs):
+                _cache.move_to_end(key)
+                res[v] = entry[0]
+    missing = [v for v in values if v not in res]
+    shared_res = {}
+    if shared(**kwargs) and len(missing) > 0:
+        entries = _collection(**kwargs).find(
+            {"_id": {"$in": [entry_id(mod, tag, v, version) for v in missing]}}, {"value": 1, "label": 1})
+        labels = {e["value"]: e["label"] for e in entries}
+        shared_res = {v: labels[normalise(v)] for v in missing if normalise(v) in labels}
+        _set_local(mod, tag, shared_res, version, **kwargs)
+    with _lock:
+        _counters["hits"] += len(res)
+        _counters["shared_hits"] += len(shared_res)
+        _counters["misses"] += len(missing) - len(shared_res)
+    return {**res, **shared_res}
+
+
+def entry_id(mod, tag, value, version) -> str:
+    return f"{mod}/{tag}/{version}/{normalise(value)}"
+
+
+def _set_local(mod, tag, labels, version, **kwargs):
+    now = time.monotonic()
+    with _lock:
+        for v, label in labels.items():
+            key = (mod, tag, normalise(v), version)
+            _cache[key] = (label, now)
+            _cache.move_to_end(key)
+        while len(_cache) > cache_size(**kwargs):
+            _cache.popitem(last=False)
+
+
+def set_cached(mod, tag, labels, version, **kwargs):
+    """Store predicted labels (value -> label) of a model version."""
+    if cache_size(**kwargs) <= 0 or version is None or len(labels) == 0:
+        return
+    _set_local(mod, tag, labels, version, **kwargs)
+    if shared(**kwargs):
+        now = datetime.utcnow()
+        _collection(**kwargs).bulk_write([
+            UpdateOne({"_id": entry_id(mod, tag, v, version)},
+                      {"$set": {"modality": mod, "tag": tag, "model_version": version, "value": normalise(v),
+                                "label": label, "created_at": now}},
+                      upsert=True)
+            for v, label in labels.items()], ordered=False)
+
+
+def cache_stats() -> dict:
+    """Hits and misses of this process and the resulting hit rate."""
+    with _lock:
+        stats = dict(_counters)
+    total = sum(stats.values())
+    stats["hit_rate"] = (stats["hits"] + stats["shared_hits"]) / total if total > 0 else 0.0
+    return stats
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from airflow.decorators import task
+
+from utils.misc import mongo_get_collection
+
+import pandas as pd
+
+import json
+import logging
+import os
+
+"""
+Local snapshot of the swiss_stroke_registry collection for DAG parsing. The snapshot only contains the columns
+required to define the DAGs and is stored as Parquet next to a JSON file with the version and the updated_at
+watermark. It is refreshed by the sync task, the DAG file only reads it, i.e., parsing does not access MongoDB.
+"""
+
+SNAPSHOT_COLUMNS = ["_SSRID", "PatientID", "arrival_time_at_hospital", "updated_at"]
+
+
+def snapshot_path(**kwargs) -> Path:
+    return Path(kwargs.get("REGISTRY_SNAPSHOT_PATH", "/opt/airflow/dags/snapshot/swiss_stroke_registry.parquet"))
+
+
+def watermark_path(path: Path) -> Path:
+    return path.with_suffix(".json")
+
+
+def read_watermark(path: Path) -> dict:
+    """Version, updated_at watermark and time of the last full sync of the snapshot, empty if not available."""
+    try:
+        with open(watermark_path(path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def load_snapshot(**kwargs) -> pd.DataFrame:
+    """Load the registry snapshot indexed by _SSRID, sorted by _SSRID. Empty if the snapshot does not exist yet."""
+    path = snapshot_path(**kwargs)
+    if not path.exists():
+        logging.warning(f"Registry snapshot {path} not found, run the registry_snapshot_sync DAG first.")
+        return pd.DataFrame(columns=SNAPSHOT_COLUMNS).set_index("_SSRID", drop=False)
+    df = pd.read_parquet(path)
+    df.index = df["_SSRID"]
+    return df.sort_index()
+
+
+def _write_atomic(path: Path, write):
+    """Write to a temporary file and rename it, such that the DAG processor never reads a partial file."""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+@task
+def sync_registry_snapshot(**kwargs):
+    """
+    Refresh the registry snapshot. Only entries with updated_at after the watermark are fetched. A full sync is
+    done if there is no snapshot yet or the last full sync is older than REGISTRY_SNAPSHOT_FULL_SYNC_HOURS, which
+    also removes deleted entries and picks up entries without updated_at.
+    """
+    path = snapshot_path(**kwargs)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    watermark = read_watermark(path)
+    full_sync_interval = timedelta(hours=float(kwargs.get("REGISTRY_SNAPSHOT_FULL_SYNC_HOURS", 24)))
+    now = datetime.utcnow()
+    full_sync = not path.exists() or "full_sync" not in watermark or \
+        datetime.fromisoformat(watermark["full_sync"]) < now - full_sync_interval
+
+    ssr_collection = mongo_get_collection(
+        "swiss_stroke_registry",
+        user=kwargs["MONGODB_USER"], password=kwargs["MONGODB_PASSWORD"],
+        url=kwargs["DEPLOYMENT_URL"], port=kwargs["MONGODB_PORT"], db=kwargs["MONGODB_DATABASE_NAME"])
+    query = {}
+    if not full_sync and watermark.get("updated_at", None) is not None:
+        query = {"updated_at": {"$gt": datetime.fromisoformat(watermark["updated_at"])}}
+    df_changed = pd.DataFrame(
+        list(ssr_collection.find(query, {"_id": 0, **{c: 1 for c in SNAPSHOT_COLUMNS}})),
+        columns=SNAPSHOT_COLUMNS)
+    df_changed.index = df_changed["_SSRID"]
+
+    if full_sync:
+        df = df_changed
+    else:
+        df = load_snapshot(**kwargs)
+        df = pd.concat([df[~df.index.isin(df_changed.index)], df_changed])
+    df = df.sort_index()
+
+    if len(df_changed) == 0 and not full_sync:
+        logging.info("Registry snapshot is up to date.")
+        return watermark
+
+    updated_at = df["updated_at"].dropna()
+    watermark = {
+        "version": watermark.get("version", 0) + 1,
+        "updated_at": updated_at.max().isoformat() if len(updated_at) > 0 else watermark.get("updated_at", None),
+        "full_sync": now.isoformat() if full_sync else watermark["full_sync"],
+        "count": len(df)}
+    _write_atomic(path, lambda p: df.to_parquet(p, index=False))
+    _write_atomic(watermark_path(path), lambda p: p.write_text(json.dumps(watermark)))
+    logging.info(f"Registry snapshot version {watermark['version']}: {len(df_changed)} entries updated, "
+                 f"{len(df)} in total ({'full' if full_sync else 'incremental'} sync).")
+    return watermark
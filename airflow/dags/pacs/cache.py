@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta
+from threading import Lock
+
+from pymongo.errors import OperationFailure
+
+from utils.misc import mongo_get_collection
+
+import hashlib
+import json
+import logging
+import time
+
+"""
+Persistent cache for C-FIND responses. Responses are stored in the MongoDB collection pacs_query_cache and keyed by
+the normalised query dataset, i.e., query model, QueryRetrieveLevel, UIDs, date range and requested return keys.
+Entries expire after PACS_CACHE_TTL seconds (0 disables the cache). Queries with a date range reaching into the
+present are not cached, since new data might still arrive, neither are STUDY level queries without date range. Hit and
+miss counters are added up per process and flushed to the _stats document every PACS_CACHE_STATS_INTERVAL seconds.
+"""
+
+CACHE_COLLECTION = "pacs_query_cache"
+STATS_ID = "_stats"
+
+_counters = {"hits": 0, "misses": 0}
+_unflushed = {"hits": 0, "misses": 0}
+_last_flush = None
+_counters_lock = Lock()
+_indexed = set()
+
+
+def _collection(**kwargs):
+    collection = mongo_get_collection(
+        CACHE_COLLECTION,
+        user=kwargs["MONGODB_USER"], password=kwargs["MONGODB_PASSWORD"],
+        url=kwargs["DEPLOYMENT_URL"], port=kwargs["MONGODB_PORT"], db=kwargs["MONGODB_DATABASE_NAME"])
+    ttl = cache_ttl(**kwargs)
+    if ttl not in _indexed:
+        try:
+            collection.create_index("created_at", name="ttl", expireAfterSeconds=max(ttl, 0))
+        except OperationFailure as e:
+            # index exists with a different TTL, expired entries are also skipped in get_cached
+            logging.warning(f"Could not create TTL index: {e}")
+        _indexed.add(ttl)
+    return collection
+
+
+def cache_ttl(**kwargs) -> int:
+    """TTL of cache entries in seconds."""
+    return int(kwargs.get("PACS_CACHE_TTL", 7 * 24 * 3600))
+
+
+def normalise_query(query_dataset, query_model) -> dict:
+    """Normalised, order-independent representation of a query."""
+    query = {"QueryModel": str(query_model)}
+    for elem in query_dataset:
+        value = elem.value
+        query[elem.keyword] = "" if value is None else str(value)
+    return dict(sorted(query.items()))
+
+
+def query_key(query) -> str:
+    """Cache key of a normalised query."""
+    return hashlib.sha256(json.dumps(query, sort_keys=True).encode()).hexdigest()
+
+
+def is_cacheable(query_dataset) -> bool:
+    """
+    Queries with an open or not yet past date range are not cached. STUDY level queries without date range (e.g.,
+    all studies of a patient) are not cached either, since new studies might still arrive.
+    """
+    date_range = str(query_dataset.get("StudyDate", "") or "")
+    if date_range == "":
+        return query_dataset.get("QueryRetrieveLevel", "") != "STUDY"
+    end = date_range.split("-")[-1]
+    return end != "" and end < datetime.now().strftime("%Y%m%d")
+
+
+def _count(name, **kwargs):
+    global _last_flush
+    now = time.monotonic()
+    with _counters_lock:
+        _counters[name] += 1
+        _unflushed[name] += 1
+        if _last_flush is None:
+            _last_flush = now
+        due = now - _last_flush >= float(kwargs.get("PACS_CACHE_STATS_INTERVAL", 60))
+    if due:
+        flush_stats(**kwargs)
+
+
+def flush_stats(**kwargs):
+    """Add the counters of this process since the last flush to the _stats document."""
+    global _last_flush
+    with _counters_lock:
+        increments = {k: v for k, v in _unflushed.items() if v > 0}
+        for k in increments:
+            _unflushed[k] = 0
+        _last_flush = time.monotonic()
+    if len(increments) > 0:
+        _collection(**kwargs).update_one({"_id": STATS_ID}, {"$inc": increments}, upsert=True)
+
+
+def get_cached(query_dataset, query_model, **kwargs):
+    """Get cached responses (DICOM JSON strings) for the query, None if not cached."""
+    if cache_ttl(**kwargs) <= 0 or not is_cacheable(query_dataset):
+        return None
+    query = normalise_query(query_dataset, query_model)
+    entry = _collection(**kwargs).find_one({"_id": query_key(query)})
+    expired = entry is not None and \
+        entry["created_at"] < datetime.utcnow() - timedelta(seconds=cache_ttl(**kwargs))
+    if entry is None or expired:
+        _count("misses", **kwargs)
+        return None
+    _count("hits", **kwargs)
+    return entry["responses"]
+
+
+def set_cached(query_dataset, query_model, responses, **kwargs):
+    """Store responses (DICOM JSON strings) for the query."""
+    if cache_ttl(**kwargs) <= 0 or not is_cacheable(query_dataset):
+        return
+    query = normalise_query(query_dataset, query_model)
+    _collection(**kwargs).replace_one(
+        {"_id": query_key(query)},
+        {"query": query, "responses": responses, "created_at": datetime.utcnow()},
+        upsert=True)
+
+
+def invalidate(query_filter=None, **kwargs):
+    """
+    Remove cache entries matching the query attributes in query_filter, e.g., {"PatientID": "123"}. Without
+    filter, the complete cache is cleared.
+    """
+    query_filter = {f"query.{k}": v for k, v in (query_filter or {}).items()}
+    res = _collection(**kwargs).delete_many({"_id": {"$ne": STATS_ID}, **query_filter})
+    logging.info(f"Removed {res.deleted_count} cached queries.")
+    return res.deleted_count
+
+
+def cache_stats(**kwargs) -> dict:
+    """Cache hits and misses of this process and of all workers."""
+    flush_stats(**kwargs)
+    total = _collection(**kwargs).find_one({"_id": STATS_ID}, {"_id": 0}) or {}
+    with _counters_lock:
+        return {"process": dict(_counters), "total": total}
+
+
+def cached_find(query_dataset, query_model, find, **kwargs):
+    """Return cached responses for the query or call find() and cache its result (if not None)."""
+    responses = get_cached(query_dataset, query_model, **kwargs)
+    if responses is not None:
+        logging.info(f"Cache hit for {query_dataset.QueryRetrieveLevel} level query.")
+        return responses
+    responses = find()
+    if responses is not None:
+        set_cached(query_dataset, query_model, responses, **kwargs)
+    return responses
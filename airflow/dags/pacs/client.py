@@ -0,0 +1,184 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock, BoundedSemaphore
+
+from pynetdicom import AE, QueryRetrievePresentationContexts, StoragePresentationContexts, \
+    build_context, build_role
+from pynetdicom.presentation import DEFAULT_TRANSFER_SYNTAXES
+from pynetdicom.sop_class import StudyRootQueryRetrieveInformationModelGet
+
+from pacs.rate_limit import Outcome, rate_limiter
+from pacs.transfer_syntax import storage_contexts, check_negotiated
+
+import logging
+import time
+
+"""
+Shared PACS client. Keeps a small pool of established associations per remote AE, such that consecutive
+C-FIND/C-MOVE requests of a worker do not have to negotiate a new association each time. C-GET requests use a
+separate pool, since their associations additionally negotiate the storage contexts (with SCP role).
+"""
+
+# C-GET associations: Study Root Get plus as many storage contexts as fit into the 128 contexts limit
+GET_ROLES = [build_role(cx.abstract_syntax, scp_role=True) for cx in StoragePresentationContexts[:127]]
+
+
+def get_contexts(transfer_syntax) -> list:
+    """Presentation contexts of C-GET associations, proposing the given transfer syntaxes for storage."""
+    return [build_context(StudyRootQueryRetrieveInformationModelGet)] + storage_contexts(transfer_syntax, 127)
+
+
+_clients = {}
+_clients_lock = Lock()
+
+
+class AssociationPool:
+    """Pool of established associations to one remote AE."""
+
+    def __init__(self, local_ae_title, remote_url, remote_port, remote_ae_title,
+                 max_size=4, idle_timeout=30, max_concurrency=4, limiter=None,
+                 contexts=QueryRetrievePresentationContexts, ext_neg=None, slots=None, transfer_syntax=None):
+        self.ae = AE(ae_title=local_ae_title)
+        self.remote_url = remote_url
+        self.remote_port = int(remote_port)
+        self.remote_ae_title = remote_ae_title
+        self.max_size = int(max_size)
+        self.idle_timeout = float(idle_timeout)
+        self.max_concurrency = int(max_concurrency)
+        self._slots = slots or BoundedSemaphore(self.max_concurrency)
+        self.contexts = contexts
+        self.ext_neg = ext_neg
+        self.transfer_syntax = transfer_syntax
+        self.limiter = limiter
+        self._idle = []
+        self._lock = Lock()
+        self.nr_of_associations = 0
+
+    def _associate(self):
+        """Negotiate a new association with the remote AE."""
+        with self._lock:
+            self.nr_of_associations += 1
+        logging.info(f"Associating with {self.remote_ae_title} "
+                     f"({self.remote_url}:{self.remote_port}).")
+        assoc = self.ae.associate(
+            self.remote_url, self.remote_port,
+            ae_title=self.remote_ae_title,
+            contexts=self.contexts, ext_neg=self.ext_neg)
+        if assoc.is_established and self.transfer_syntax is not None:
+            check_negotiated(assoc.accepted_contexts, self.transfer_syntax)
+        return assoc
+
+    def acquire(self):
+        """Get an idle association from the pool. Re-associate if aborted or idle for too long."""
+        with self._lock:
+            while len(self._idle) > 0:
+                assoc, last_used = self._idle.pop()
+                if not assoc.is_established:
+                    continue
+                if time.monotonic() - last_used > self.idle_timeout:
+                    assoc.release()
+                    continue
+                return assoc
+        return self._associate()
+
+    def put_back(self, assoc):
+        """Return association to the pool. Closes it if the pool is already full."""
+        if not assoc.is_established:
+            return
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((assoc, time.monotonic()))
+                return
+        assoc.release()
+
+    def close(self):
+        """Release all idle associations."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for assoc, _ in idle:
+            if assoc.is_established:
+                assoc.release()
+
+    @contextmanager
+    def association(self, operation="C-FIND", outcome=None):
+        """
+        Borrow an association for the duration of the with-block. Blocks if max_concurrency associations are
+        already in use or the rate limiter does not allow another request. The association is aborted instead of
+        being returned to the pool if the block raises, since a partially consumed response stream cannot be
+        reused. The caller reports response statuses via outcome (see pacs.rate_limit.Outcome), its latency is set
+        to the duration of the PACS exchange (excluding the wait for a slot and the rate limiter).
+        """
+        outcome = outcome or Outcome()
+        with self._slots:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            start = time.monotonic()
+            assoc = self.acquire()
+            try:
+                yield assoc
+            except BaseException:
+                if assoc.is_established:
+                    assoc.abort()
+                outcome.failed = True
+                self._record(operation, start, outcome)
+                raise
+            # aborted (e.g., stuck on PENDING) or never established
+            outcome.failed = outcome.failed or not assoc.is_established
+            self._record(operation, start, outcome)
+            self.put_back(assoc)
+
+    def _record(self, operation, start, outcome):
+        outcome.latency = time.monotonic() - start
+        if self.limiter is not None:
+            self.limiter.record(operation, outcome.latency, failed=outcome.failed, pending=outcome.pending,
+                                suboperations=outcome.suboperations, level=outcome.level)
+
+
+def pacs_client(c_get=False, transfer_syntax=None, **kwargs) -> AssociationPool:
+    """
+    Get the association pool for the remote PACS configured in kwargs. Pools are shared within a process. The
+    C-GET pools (c_get=True, one per transfer syntax preference list) share the concurrency limit with the
+    C-FIND/C-MOVE pool.
+    """
+    key = (kwargs["PACS_LOCAL_AE_TITLE"], kwargs["PACS_REMOTE_URL"],
+           int(kwargs["PACS_REMOTE_PORT"]), kwargs["PACS_REMOTE_AE_TITLE"])
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = AssociationPool(
+                *key,
+                max_size=kwargs.get("PACS_POOL_SIZE", 4),
+                idle_timeout=kwargs.get("PACS_POOL_IDLE_TIMEOUT", 30),
+                max_concurrency=kwargs.get("PACS_MAX_CONCURRENCY", 4),
+                limiter=rate_limiter(**kwargs))
+        if not c_get:
+            return _clients[key]
+        transfer_syntax = list(transfer_syntax or DEFAULT_TRANSFER_SYNTAXES)
+        get_key = key + ("C-GET", tuple(transfer_syntax))
+        if get_key not in _clients:
+            pool = _clients[key]
+            _clients[get_key] = AssociationPool(
+                *key,
+                max_size=pool.max_size, idle_timeout=pool.idle_timeout,
+                max_concurrency=pool.max_concurrency, limiter=pool.limiter,
+                contexts=get_contexts(transfer_syntax), ext_neg=GET_ROLES, slots=pool._slots,
+                transfer_syntax=transfer_syntax)
+        return _clients[get_key]
+
+
+def association_count() -> int:
+    """Number of associations negotiated by all pools of this process."""
+    with _clients_lock:
+        return sum(pool.nr_of_associations for pool in _clients.values())
+
+
+def map_queries(func, items, **kwargs) -> list:
+    """
+    Run func for all items concurrently, bounded by the concurrency limit of the PACS. Results are returned in
+    input order. Like a plain loop, the first failing item (in input order) raises its exception.
+    """
+    items = list(items)
+    max_workers = pacs_client(**kwargs).max_concurrency
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, items))
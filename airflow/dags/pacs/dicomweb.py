@@ -0,0 +1,158 @@
+from contextlib import contextmanager
+from threading import Lock
+from typing import List
+
+from pydicom import Dataset
+from requests.adapters import HTTPAdapter
+
+from pacs.rate_limit import Outcome, rate_limiter
+
+import logging
+import requests
+import time
+
+"""
+DICOMweb backend. QIDO-RS searches and WADO-RS /metadata retrievals return the header as DICOM JSON without pixel
+data. Requests go through one session per process, whose connection pool keeps up to PACS_MAX_CONCURRENCY
+connections alive, and are throttled by the same rate limiter as the DIMSE requests.
+"""
+
+_clients = {}
+_clients_lock = Lock()
+
+
+def _ignore_bulk_data(*args):
+    """Bulk data (e.g., PixelData) is not retrieved."""
+    return None
+
+
+class DICOMwebClient:
+    """QIDO-RS/WADO-RS client with HTTP keep-alive."""
+
+    def __init__(self, base_url, max_connections=4, timeout=30, limiter=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = float(timeout)
+        self.limiter = limiter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(max_connections))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @contextmanager
+    def _request(self, operation, outcome):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        start = time.monotonic()
+        outcome.failed = True
+        try:
+            yield
+            outcome.failed = False
+        finally:
+            outcome.latency = time.monotonic() - start
+            if self.limiter is not None:
+                self.limiter.record(operation, outcome.latency, failed=outcome.failed,
+                                    suboperations=outcome.suboperations, level=outcome.level)
+
+    def _get(self, operation, path, params=None, outcome=None) -> List[dict]:
+        """GET request, WADO-RS latencies are normalised by the number of returned instances."""
+        outcome = outcome or Outcome()
+        with self._request(operation, outcome):
+            response = self.session.get(
+                f"{self.base_url}/{path}", params=params, timeout=self.timeout,
+                headers={"Accept": "application/dicom+json"})
+            response.raise_for_status()
+            res = response.json() if response.status_code != 204 and response.content else []
+            outcome.suboperations = len(res) or None
+        return res
+
+    def search(self, query_dataset, outcome=None) -> List[Dataset]:
+        """
+        QIDO-RS search equivalent to a C-FIND with query_dataset. Non-empty attributes are used as matching keys,
+        empty ones as return keys. Like C-FIND responses, each result contains the attributes of the query only.
+        """
+        level = query_dataset.QueryRetrieveLevel
+        outcome = outcome or Outcome()
+        outcome.level = level
+        study_uid = query_dataset.get("StudyInstanceUID", "") or ""
+        series_uid = query_dataset.get("SeriesInstanceUID", "") or ""
+        in_path = set()
+        if level in ["PATIENT", "STUDY"]:
+            path = "studies"
+        elif level == "SERIES":
+            path = f"studies/{study_uid}/series" if study_uid else "series"
+            in_path = {"StudyInstanceUID"} if study_uid else set()
+        elif study_uid and series_uid:
+            path = f"studies/{study_uid}/series/{series_uid}/instances"
+            in_path = {"StudyInstanceUID", "SeriesInstanceUID"}
+        else:
+            path = f"studies/{study_uid}/instances" if study_uid else "instances"
+            in_path = {"StudyInstanceUID"} if study_uid else set()
+
+        params = {"includefield": []}
+        for elem in query_dataset:
+            if elem.keyword in ["QueryRetrieveLevel", "SpecificCharacterSet"] or elem.keyword in in_path:
+                continue
+            if elem.value in [None, ""]:
+                params["includefield"].append(elem.keyword)
+            else:
+                params[elem.keyword] = str(elem.value)
+
+        res, seen = [], set()
+        for json_dict in self._get("QIDO-RS", path, params, outcome):
+            ds = Dataset.from_json(json_dict, bulk_data_uri_handler=_ignore_bulk_data)
+            response_dataset = Dataset()
+            for elem in query_dataset:
+                if elem.keyword == "QueryRetrieveLevel":
+                    response_dataset.QueryRetrieveLevel = level
+                elif elem.tag in ds:
+                    response_dataset.add(ds[elem.tag])
+                else:
+                    response_dataset.add_new(elem.tag, elem.VR, None)
+            # QIDO-RS has no patient level, reduce the studies to unique patients
+            if level == "PATIENT":
+                if response_dataset.get("PatientID", None) in seen:
+                    continue
+                seen.add(response_dataset.get("PatientID", None))
+            res.append(response_dataset)
+        return res
+
+    def metadata(self, query_dataset) -> List[Dataset]:
+        """WADO-RS metadata of the series or, on IMAGE level, of the instance of query_dataset."""
+        path = f"studies/{query_dataset.StudyInstanceUID}/series/{query_dataset.SeriesInstanceUID}"
+        if query_dataset.QueryRetrieveLevel == "IMAGE":
+            path += f"/instances/{query_dataset.SOPInstanceUID}"
+        outcome = Outcome()
+        outcome.level = query_dataset.QueryRetrieveLevel
+        return [Dataset.from_json(json_dict, bulk_data_uri_handler=_ignore_bulk_data)
+                for json_dict in self._get("WADO-RS", f"{path}/metadata", outcome=outcome)]
+
+
+def dicomweb_client(**kwargs) -> DICOMwebClient:
+    """Get the DICOMweb client for PACS_DICOMWEB_URL. Clients (and their connections) are shared within a process."""
+    key = kwargs["PACS_DICOMWEB_URL"]
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = DICOMwebClient(
+                key,
+                max_connections=kwargs.get("PACS_MAX_CONCURRENCY", 4),
+                timeout=kwargs.get("PACS_DICOMWEB_TIMEOUT", 30),
+                limiter=rate_limiter(**kwargs))
+        return _clients[key]
+
+
+def search(query_dataset, convert, outcome=None, **kwargs):
+    """QIDO-RS search, returns the converted responses or None if the request failed."""
+    try:
+        return [convert(ds) for ds in dicomweb_client(**kwargs).search(query_dataset, outcome)]
+    except requests.RequestException as e:
+        logging.error(f"QIDO-RS request failed: {e}")
+        return None
+
+
+def metadata(query_dataset, **kwargs) -> List[Dataset]:
+    """WADO-RS metadata, returns an empty list if the request failed."""
+    try:
+        return dicomweb_client(**kwargs).metadata(query_dataset)
+    except requests.RequestException as e:
+        logging.error(f"WADO-RS request failed: {e}")
+        return []
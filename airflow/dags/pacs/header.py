@@ -0,0 +1,34 @@
+from io import BytesIO
+
+from pydicom.filereader import read_dataset
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+
+import zlib
+
+"""
+Header-only decoding of received C-STORE datasets. Only depends on pydicom, such that the sequence-classification
+image can use the same implementation (the module is copied into the image, see sequence-classification/Dockerfile).
+"""
+
+
+def read_header(event):
+    """
+    Decode the dataset of a C-STORE request without PixelData. Parses the encoded P-DATA directly and stops
+    before the pixel data element, such that the pixel buffer is never decoded. The header is decoded once per
+    event, i.e., routing and the route handler share the same dataset.
+    """
+    header = getattr(event, "_header", None)
+    if header is not None:
+        return header
+    transfer_syntax = event.context.transfer_syntax
+    # encoded dataset without file meta (Event.encoded_dataset is only available as of pynetdicom 2.1)
+    data = event.request.DataSet.getvalue()
+    if transfer_syntax == DeflatedExplicitVRLittleEndian:
+        data = zlib.decompress(data, -zlib.MAX_WBITS)
+    ds = read_dataset(
+        BytesIO(data), transfer_syntax.is_implicit_VR, transfer_syntax.is_little_endian,
+        stop_when=lambda tag, VR, length: tag >= 0x7FE00008)
+    ds.is_implicit_VR = transfer_syntax.is_implicit_VR
+    ds.is_little_endian = transfer_syntax.is_little_endian
+    event._header = ds
+    return ds
@@ -1,4 +1,4 @@
-import struct
+from threading import Lock
 
 from pynetdicom import \
     AE, evt, \
@@ -16,9 +16,15 @@ from pydicom import Dataset
 from pydicom.datadict import keyword_for_tag
 from pydicom.errors import BytesLengthException
 
-from utils.misc import rearrange_datasets
+from pacs import dicomweb
+from pacs.retrieve import retrieve
+from pacs.transport import transport
+from pacs.header import read_header
+
+from utils.misc import rearrange_datasets, middle_instance_number
 
 import logging
+import struct
 
 
 @task
@@ -62,48 +68,50 @@ def validate_entries(dataset):
     return ds
 
 
+def record_partial_retrieval(retrieval, **kwargs):
+    """Log and push (XCom key "partial_retrieval") the result of a retrieval ended by its deadline/stall check."""
+    if retrieval.timed_out is None:
+        return
+    result = retrieval.result()
+    logging.warning(f"Partial retrieval: {result}")
+    if "ti" in kwargs:
+        kwargs["ti"].xcom_push(key="partial_retrieval", value=result)
+
+
 @task
-def move_image(instance_dataset, **kwargs):
+def move_image(instance_dataset, header_only=True, **kwargs):
     """Move (download) reference image. Requires present SOPInstanceUID."""
 
     def handle_store(event, *args):
         """Handle a C-STORE service request"""
-        ds = event.dataset
-        try:
-            # we are only interested in the meta data
-            del ds.PixelData
-        except AttributeError:
-            pass
+        if header_only:
+            ds = read_header(event)
+        else:
+            ds = event.dataset
+            try:
+                # we are only interested in the meta data
+                del ds.PixelData
+            except AttributeError:
+                pass
         args[0].append(ds)
         return 0x0000
 
     image = []
     args = [image]
-    handlers = [(evt.EVT_C_STORE, handle_store, args)]
-
-    ae = AE()
-    ae.add_requested_context(StudyRootQueryRetrieveInformationModelMove)
-    ae.supported_contexts = StoragePresentationContexts
-    scp = ae.start_server(
-        ("0.0.0.0", int(kwargs["PACS_LOCAL_PORT"])), block=False, evt_handlers=handlers)
 
     query_dataset = Dataset.from_json(instance_dataset)
     query_dataset.QueryRetrieveLevel = "IMAGE"
 
-    ae = AE(ae_title=kwargs["PACS_LOCAL_AE_TITLE"])
-    assoc = ae.associate(
-        kwargs["PACS_REMOTE_URL"], int(kwargs["PACS_REMOTE_PORT"]),
-        ae_title=kwargs["PACS_REMOTE_AE_TITLE"],
-        contexts=QueryRetrievePresentationContexts)
-    if assoc.is_established:
-        responses = assoc.send_c_move(
-            query_dataset, kwargs["PACS_LOCAL_AE_TITLE"],
-            query_model=StudyRootQueryRetrieveInformationModelMove)
-        for (status, response_dataset) in responses:
-            print(status, response_dataset)
-        assoc.release()
-
-    scp.shutdown()
+    if transport(**kwargs) == "dicomweb":
+        image.extend(dicomweb.metadata(query_dataset, **kwargs))
+    else:
+        with retrieve(query_dataset, handle_store, args,
+                      {"SOPInstanceUID": query_dataset.get("SOPInstanceUID", None)},
+                      header_only=header_only, **kwargs) as retrieval:
+            if retrieval.is_established:
+                for (status, response_dataset) in retrieval.responses:
+                    print(status, response_dataset)
+            record_partial_retrieval(retrieval, **kwargs)
 
     try:
         ds = validate_entries(image[0])
@@ -114,13 +122,84 @@ def move_image(instance_dataset, **kwargs):
         return query_dataset.to_json()
 
 
+def series_size(status):
+    """Total number of C-MOVE sub-operations based on a pending status."""
+    return sum(status.get(tag, 0) for tag in [
+        "NumberOfRemainingSuboperations", "NumberOfCompletedSuboperations",
+        "NumberOfFailedSuboperations", "NumberOfWarningSuboperations"])
+
+
+class MiddleImage:
+    """
+    Keeps the received image closest to the middle of a series (same choice as rearrange_datasets for a series
+    numbered from 1). The middle image is known to have arrived if its InstanceNumber deviates at most 5% of the
+    series size from the middle. As long as the series size is unknown, all images are kept. If the series is not
+    numbered from 1, the retrieval is not cancelled and the closest image is kept.
+    """
+
+    def __init__(self, total=0):
+        self.total = total
+        self.images = []
+        self.received = 0
+        self._lock = Lock()
+
+    def _distance(self, ds):
+        number = ds.get("InstanceNumber", None)
+        if number is None or self.total <= 0:
+            return None
+        return abs(int(number) - middle_instance_number(self.total))
+
+    def _select(self) -> bool:
+        """Reduce the kept images to the closest one, True if it is close enough to the middle."""
+        if self.total <= 0 or len(self.images) == 0:
+            return False
+        numbered = [ds for ds in self.images if self._distance(ds) is not None]
+        if len(numbered) == 0:
+            self.images[:] = self.images[:1]
+            return False
+        self.images[:] = [min(numbered, key=self._distance)]
+        return self._distance(self.images[0]) <= self.total // 20
+
+    def add(self, ds) -> bool:
+        """Add a received image, True if the middle image has arrived."""
+        with self._lock:
+            self.received += 1
+            self.images.append(ds)
+            return self._select()
+
+    def set_total(self, total) -> bool:
+        """Set the series size (e.g., from the sub-operation counts), True if the middle image has arrived."""
+        with self._lock:
+            self.total = total or self.total
+            return self._select()
+
+
 @task
-def move_series(series_dataset, **kwargs):
-    """Move (download) complete series and return reference image."""
+def move_series(series_dataset, header_only=True, **kwargs):
+    """
+    Move (download) complete series and return reference image. If PACS_MOVE_SERIES_CANCEL_EARLY is set, the
+    C-MOVE/C-GET is cancelled as soon as the image from the middle of the series has arrived.
+    """
 
     def handle_store(event, *args):
         """Handle a C-STORE service request"""
-        args[0].append(event.dataset)
+        args[0].append(read_header(event) if header_only else event.dataset)
+        return 0x0000
+
+    def handle_store_cancel_early(event, *args):
+        """Handle a C-STORE service request. Cancel the retrieval once the middle image has arrived."""
+        middle, state = args
+        if header_only:
+            ds = read_header(event)
+        else:
+            ds = event.dataset
+            try:
+                # we are only interested in the meta data
+                del ds.PixelData
+            except AttributeError:
+                pass
+        if middle.add(ds) and state["retrieval"] is not None:
+            state["retrieval"].cancel()
         return 0x0000
 
     if "ti" in kwargs and kwargs["ti"].map_index == 0:
@@ -128,15 +207,7 @@ def move_series(series_dataset, **kwargs):
     elif series_dataset == Dataset().to_json():
         return "{}"
 
-    images = []
-    args = [images]
-    handlers = [(evt.EVT_C_STORE, handle_store, args)]
-
-    ae = AE()
-    ae.add_requested_context(StudyRootQueryRetrieveInformationModelMove)
-    ae.supported_contexts = StoragePresentationContexts
-    scp = ae.start_server(
-        ("0.0.0.0", int(kwargs["PACS_LOCAL_PORT"])), block=False, evt_handlers=handlers)
+    cancel_early = str(kwargs.get("PACS_MOVE_SERIES_CANCEL_EARLY", "false")).lower() == "true"
 
     ds = Dataset.from_json(series_dataset)
 
@@ -145,30 +216,41 @@ def move_series(series_dataset, **kwargs):
     query_dataset.SeriesInstanceUID = ds.SeriesInstanceUID
     query_dataset.QueryRetrieveLevel = "SERIES"
 
-    ae = AE(ae_title=kwargs["PACS_LOCAL_AE_TITLE"])
-    assoc = ae.associate(
-        kwargs["PACS_REMOTE_URL"], int(kwargs["PACS_REMOTE_PORT"]),
-        ae_title=kwargs["PACS_REMOTE_AE_TITLE"],
-        contexts=QueryRetrievePresentationContexts)
-
-    if assoc.is_established:
-        responses = assoc.send_c_move(
-            query_dataset, kwargs["PACS_LOCAL_AE_TITLE"],
-            query_model=StudyRootQueryRetrieveInformationModelMove)
-        cnt_pending = 0
-        for (status, response_dataset) in responses:
-            print(status, response_dataset)
-            # in case the server is stuck on state "PENDING", exit and close association
-            cnt_pending += 1 if status.get("Status", -1) == 65280 else 0
-            if cnt_pending == 70:
-                break
-        assoc.release()
+    middle = MiddleImage(int(ds.get("NumberOfSeriesRelatedInstances", None) or 0))
+    state = {"retrieval": None}
+    images = middle.images if cancel_early else []
+    args = [middle, state] if cancel_early else [images]
+    handler = handle_store_cancel_early if cancel_early else handle_store
+
+    if transport(**kwargs) == "dicomweb":
+        # the series metadata contains the headers of all images
+        images.extend(dicomweb.metadata(query_dataset, **kwargs))
+    else:
+        with retrieve(query_dataset, handler, args,
+                      {"SeriesInstanceUID": query_dataset.SeriesInstanceUID},
+                      header_only=header_only, **kwargs) as retrieval:
+            state["retrieval"] = retrieval
+            if retrieval.is_established:
+                # a PACS stuck on state "PENDING" is cancelled/aborted by the watchdog of the retrieval
+                for (status, response_dataset) in retrieval.responses:
+                    print(status, response_dataset)
+                    if cancel_early and status.get("Status", -1) == 65280 and middle.set_total(series_size(status)):
+                        retrieval.cancel()
+            record_partial_retrieval(retrieval, **kwargs)
+            result = retrieval.result()
+
+        if cancel_early and result["received"] > 0:
+            nr_saved = max(middle.total - result["received"], 0)
+            bytes_saved = int(nr_saved * result["bytes"] / result["received"])
+            logging.info(f"Received {result['received']} of {middle.total} images, "
+                         f"saved {nr_saved} images (~{bytes_saved} bytes).")
+            if "ti" in kwargs:
+                kwargs["ti"].xcom_push(
+                    key="move_series_saved", value={"instances": nr_saved, "bytes": bytes_saved})
 
     # in case no images have been downloaded
     if len(images) == 0:
-        args[0].append(query_dataset)
-
-    scp.shutdown()
+        images.append(query_dataset)
 
     return rearrange_datasets(images)[0].to_json(
         bulk_data_threshold=0,
@@ -176,41 +258,30 @@ def move_series(series_dataset, **kwargs):
 
 
 @task
-def store_image(instance_dataset, storage_path, **kwargs):
-    """Store image at storage_path."""
+def store_image(instance_dataset, storage_path, header_only=False, **kwargs):
+    """Store image at storage_path. Without PixelData if header_only is set."""
 
     def handle_store(event, *args):
         """Handle a C-STORE service request"""
         logging.info("Downloaded image")
-        ds = event.dataset
+        ds = read_header(event) if header_only else event.dataset
+        if not header_only and event.context.transfer_syntax.is_compressed:
+            # keep the encapsulated pixel data as negotiated
+            ds.file_meta = event.file_meta
+            ds.save_as(f"{storage_path}{ds.SOPInstanceUID}", write_like_original=False)
+            return 0x0000
         ds.is_little_endian = True
         ds.is_implicit_VR = True
         ds.save_as(f"{storage_path}{ds.SOPInstanceUID}")
         return 0x0000
 
-    handlers = [(evt.EVT_C_STORE, handle_store)]
-
-    ae = AE()
-    ae.add_requested_context(StudyRootQueryRetrieveInformationModelMove)
-    ae.supported_contexts = StoragePresentationContexts
-    ae.ae_title = kwargs["PACS_LOCAL_AE_TITLE"]
-    scp = ae.start_server(
-        ("0.0.0.0", int(kwargs["PACS_LOCAL_PORT"])), block=False, evt_handlers=handlers)
-
     query_dataset = Dataset.from_json(instance_dataset)
     query_dataset.QueryRetrieveLevel = "IMAGE"
 
-    ae = AE(ae_title=kwargs["PACS_LOCAL_AE_TITLE"])
-    assoc = ae.associate(
-        kwargs["PACS_REMOTE_URL"], int(kwargs["PACS_REMOTE_PORT"]),
-        ae_title=kwargs["PACS_REMOTE_AE_TITLE"],
-        contexts=QueryRetrievePresentationContexts)
-    if assoc.is_established:
-        responses = assoc.send_c_move(
-            query_dataset, kwargs["PACS_LOCAL_AE_TITLE"],
-            query_model=StudyRootQueryRetrieveInformationModelMove)
-        for (status, response_dataset) in responses:
-            print(status, response_dataset)
-        assoc.release()
-
-    scp.shutdown()
+    with retrieve(query_dataset, handle_store,
+                  uids={"SOPInstanceUID": query_dataset.get("SOPInstanceUID", None)},
+                  header_only=header_only, **kwargs) as retrieval:
+        if retrieval.is_established:
+            for (status, response_dataset) in retrieval.responses:
+                print(status, response_dataset)
+        record_partial_retrieval(retrieval, **kwargs)
@@ -1,5 +1,4 @@
 from pydicom import Dataset
-from pynetdicom import AE, QueryRetrievePresentationContexts
 from pynetdicom.sop_class import \
     StudyRootQueryRetrieveInformationModelMove, \
     PatientRootQueryRetrieveInformationModelMove, \
@@ -7,12 +6,15 @@ from pynetdicom.sop_class import \
 
 from airflow.decorators import task
 
-from utils.misc import rearrange_datasets
+from pacs.cache import cached_find
+from pacs.transport import find
+
+from utils.misc import select_middle_instance
 
 
 @task
 def query_instance_level(series_dataset, **kwargs):
-    """Get information about images from the PACS."""
+    """Get information about images from the PACS. Returns the image from the middle of the series."""
 
     ds = Dataset.from_json(series_dataset)
 
@@ -23,20 +25,26 @@ def query_instance_level(series_dataset, **kwargs):
     query_dataset.SOPInstanceUID = ""
     query_dataset.InstanceNumber = ""
 
-    ae = AE(ae_title=kwargs["PACS_LOCAL_AE_TITLE"])
-    assoc = ae.associate(
-        kwargs["PACS_REMOTE_URL"], int(kwargs["PACS_REMOTE_PORT"]),
-        ae_title=kwargs["PACS_REMOTE_AE_TITLE"],
-        contexts=QueryRetrievePresentationContexts)
-    if assoc.is_established:
-        responses = assoc.send_c_find(
-            query_dataset, query_model=StudyRootQueryRetrieveInformationModelFind)
-        instance_datasets = []
-        for (status, response_dataset) in responses:
-            if response_dataset is not None:
-                instance_datasets.append(response_dataset)
-        assoc.release()
-        try:
-            return rearrange_datasets(instance_datasets)[0].to_json()
-        except IndexError:
+    def to_instance(response_dataset):
+        # only keep (InstanceNumber, SOPInstanceUID) while the responses stream in
+        instance_number = response_dataset.get("InstanceNumber", None)
+        return (None if instance_number in [None, ""] else int(instance_number),
+                response_dataset.get("SOPInstanceUID", None))
+
+    instances = cached_find(
+        query_dataset, StudyRootQueryRetrieveInformationModelFind,
+        lambda: find(query_dataset, StudyRootQueryRetrieveInformationModelFind, to_instance, **kwargs), **kwargs)
+    if instances is not None:
+        instance = select_middle_instance(instances)
+        if instance is None:
             return query_dataset.to_json()
+        instance_number, sop_instance_uid = instance
+        instance_dataset = Dataset()
+        instance_dataset.QueryRetrieveLevel = "IMAGE"
+        instance_dataset.StudyInstanceUID = query_dataset.StudyInstanceUID
+        instance_dataset.SeriesInstanceUID = query_dataset.SeriesInstanceUID
+        if sop_instance_uid is not None:
+            instance_dataset.SOPInstanceUID = sop_instance_uid
+        if instance_number is not None:
+            instance_dataset.InstanceNumber = instance_number
+        return instance_dataset.to_json()
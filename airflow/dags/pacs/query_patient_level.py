@@ -1,7 +1,6 @@
 from typing import List
 
 from pydicom import Dataset
-from pynetdicom import AE, QueryRetrievePresentationContexts
 from pynetdicom.sop_class import \
     StudyRootQueryRetrieveInformationModelMove, \
     PatientRootQueryRetrieveInformationModelMove, \
@@ -9,6 +8,9 @@ from pynetdicom.sop_class import \
 
 from airflow.decorators import task
 
+from pacs.cache import cached_find
+from pacs.transport import find
+
 
 @task
 def query_patient_level(PatientName, PatientBirthDate, PatientID="", **kwargs) -> List[str]:
@@ -21,17 +23,6 @@ def query_patient_level(PatientName, PatientBirthDate, PatientID="", **kwargs) -
     query_dataset.PatientBirthDate = PatientBirthDate
     query_dataset.SpecificCharacterSet = ""
 
-    ae = AE(ae_title=kwargs["PACS_LOCAL_AE_TITLE"])
-    assoc = ae.associate(
-        kwargs["PACS_REMOTE_URL"], int(kwargs["PACS_REMOTE_PORT"]),
-        ae_title=kwargs["PACS_REMOTE_AE_TITLE"],
-        contexts=QueryRetrievePresentationContexts)
-    if assoc.is_established:
-        responses = assoc.send_c_find(
-            query_dataset, query_model=PatientRootQueryRetrieveInformationModelFind)
-        patient_datasets = []
-        for (status, response_dataset) in responses:
-            if response_dataset is not None:
-                patient_datasets.append(response_dataset.to_json())
-        assoc.release()
-        return patient_datasets
+    return cached_find(
+        query_dataset, PatientRootQueryRetrieveInformationModelFind,
+        lambda: find(query_dataset, PatientRootQueryRetrieveInformationModelFind, **kwargs), **kwargs)
@@ -1,5 +1,4 @@
 from pydicom import Dataset
-from pynetdicom import AE, QueryRetrievePresentationContexts
 from pynetdicom.sop_class import \
     StudyRootQueryRetrieveInformationModelMove, \
     PatientRootQueryRetrieveInformationModelMove, \
@@ -7,6 +6,9 @@ from pynetdicom.sop_class import \
 
 from airflow.decorators import task
 
+from pacs.cache import cached_find
+from pacs.transport import find
+
 import logging
 
 
@@ -20,20 +22,13 @@ def query_series_level(study_dataset, **kwargs):
     query_dataset.SeriesDate = ""
     query_dataset.SeriesTime = ""
     query_dataset.SeriesDescription = ""
+    query_dataset.NumberOfSeriesRelatedInstances = ""
     query_dataset.TimezoneOffsetFromUTC = ""
 
-    ae = AE(ae_title=kwargs["PACS_LOCAL_AE_TITLE"])
-    assoc = ae.associate(
-        kwargs["PACS_REMOTE_URL"], int(kwargs["PACS_REMOTE_PORT"]),
-        ae_title=kwargs["PACS_REMOTE_AE_TITLE"],
-        contexts=QueryRetrievePresentationContexts)
-    if assoc.is_established:
-        responses = assoc.send_c_find(
-            query_dataset, query_model=StudyRootQueryRetrieveInformationModelFind)
-        series_datasets = []
-        for (status, response_dataset) in responses:
-            if response_dataset is not None:
-                series_datasets.append(response_dataset.to_json())
-        assoc.release()
-        logging.info(f"# of series = {len(series_datasets)}")
-        return series_datasets
\ No newline at end of file
+    def find_series():
+        series_datasets = find(query_dataset, StudyRootQueryRetrieveInformationModelFind, **kwargs)
+        if series_datasets is not None:
+            logging.info(f"# of series = {len(series_datasets)}")
+        return series_datasets
+
+    return cached_find(query_dataset, StudyRootQueryRetrieveInformationModelFind, find_series, **kwargs)
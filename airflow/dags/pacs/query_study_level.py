@@ -1,5 +1,7 @@
+from copy import deepcopy
+from datetime import datetime, timedelta
+
 from pydicom import Dataset
-from pynetdicom import AE, QueryRetrievePresentationContexts
 from pynetdicom.sop_class import \
     StudyRootQueryRetrieveInformationModelMove, \
     PatientRootQueryRetrieveInformationModelMove, \
@@ -7,10 +9,75 @@ from pynetdicom.sop_class import \
 
 from airflow.decorators import task
 
+from pacs.cache import cached_find
+from pacs.rate_limit import Outcome
+from pacs.settings import settings_collection, pacs_id
+from pacs.transport import find
+
+import logging
+
+# slow windows are only split if they return at least this fraction of PACS_STUDY_QUERY_MAX_RESPONSES studies
+SLOW_SPLIT_FRACTION = 0.1
+MAX_WINDOW_DAYS = 400
+
+
+def get_window_size(**kwargs):
+    """Get the learned study query window size (in days) of the PACS, None if not known yet."""
+    settings = settings_collection(**kwargs).find_one({"_id": pacs_id(**kwargs)}) or {}
+    return settings.get("study_query_window_days", None)
+
+
+def set_window_size(days, **kwargs):
+    """Store the study query window size (in days) of the PACS for subsequent runs."""
+    logging.info(f"Setting study query window size to {days} days.")
+    settings_collection(**kwargs).update_one(
+        {"_id": pacs_id(**kwargs)}, {"$set": {"study_query_window_days": days}}, upsert=True)
+
+
+def split_date_range(start, end, days):
+    """Split the date range [start, end] into consecutive windows of at most days."""
+    windows = []
+    while start <= end:
+        window_end = min(start + timedelta(days=days - 1), end)
+        windows.append((start, window_end))
+        start = window_end + timedelta(days=1)
+    return windows
+
+
+def needs_split(nr_of_studies, latency, days, max_responses, max_latency, min_window_days) -> bool:
+    """
+    Split a window if the response might be truncated (max_responses studies) or if the PACS responded slowly
+    (latency of the C-FIND exchange, None for cached responses) with a non-trivial number of studies and the window
+    is still larger than min_window_days (at least one day).
+    """
+    if nr_of_studies >= max_responses:
+        return days > 1
+    slow = latency is not None and latency > max_latency and nr_of_studies >= SLOW_SPLIT_FRACTION * max_responses
+    return slow and days > max(1, min_window_days)
+
+
+def next_window_size(window_days, accepted_windows, split, nr_of_studies, max_responses):
+    """
+    Learned window size after a query: shrink to the largest window that did not have to be split, but at most by
+    half per query, such that a single patient with many studies cannot shrink the window of all queries. Grow if
+    the query was not split and returned few studies. None if the window size does not change.
+    """
+    if split:
+        return max(max(accepted_windows), (window_days + 1) // 2)
+    if nr_of_studies < max_responses / 2 and window_days < MAX_WINDOW_DAYS:
+        return min(2 * window_days, MAX_WINDOW_DAYS)
+    return None
+
 
 @task
 def query_study_level(PatientID, StudyInstanceUID="", StudyDate="", AccessionNumber="", **kwargs):
-    """Get information about studies from the PACS."""
+    """
+    Get information about studies from the PACS. Date ranges are queried in windows. A window is split in half
+    if the PACS returns too many studies (PACS_STUDY_QUERY_MAX_RESPONSES, i.e., the response might be truncated)
+    or responds too slowly (PACS_STUDY_QUERY_MAX_LATENCY seconds) with many studies, see needs_split. Slow windows
+    are not split below PACS_STUDY_QUERY_MIN_WINDOW days. The window size is learned per PACS, see
+    next_window_size.
+    """
 
     query_dataset = Dataset()
     query_dataset.QueryRetrieveLevel = "STUDY"
@@ -25,17 +92,70 @@ def query_study_level(PatientID, StudyInstanceUID="", StudyDate="", AccessionNum
     query_dataset.ModalitiesInStudy = ""
     query_dataset.AccessionNumber = AccessionNumber
 
-    ae = AE(ae_title=kwargs["PACS_LOCAL_AE_TITLE"])
-    assoc = ae.associate(
-        kwargs["PACS_REMOTE_URL"], int(kwargs["PACS_REMOTE_PORT"]),
-        ae_title=kwargs["PACS_REMOTE_AE_TITLE"],
-        contexts=QueryRetrievePresentationContexts)
-    if assoc.is_established:
-        responses = assoc.send_c_find(
-            query_dataset, query_model=StudyRootQueryRetrieveInformationModelFind)
-        study_datasets = []
-        for (status, response_dataset) in responses:
-            if response_dataset is not None:
-                study_datasets.append(response_dataset.to_json())
-        assoc.release()
-        return study_datasets
+    def query_window(start, end):
+        window_dataset = deepcopy(query_dataset)
+        window_dataset.StudyDate = f"{start.strftime('%Y%m%d')}-{end.strftime('%Y%m%d')}"
+        outcome = Outcome()
+        study_datasets = cached_find(
+            window_dataset, StudyRootQueryRetrieveInformationModelFind,
+            lambda: find(window_dataset, StudyRootQueryRetrieveInformationModelFind, outcome=outcome, **kwargs),
+            **kwargs)
+        if study_datasets is None:
+            return None
+        days = (end - start).days + 1
+        latency = outcome.latency
+        if not needs_split(len(study_datasets), latency, days, max_responses, max_latency, min_window_days):
+            if len(study_datasets) >= max_responses:
+                logging.warning(f"Study query for {start.date()} might be incomplete!")
+            accepted_windows.append(days)
+            return study_datasets
+        mid = start + (end - start) / 2
+        mid = datetime(mid.year, mid.month, mid.day)
+        logging.info(f"Splitting study query {window_dataset.StudyDate} ({len(study_datasets)} studies, "
+                     f"{'cached' if latency is None else f'{latency:.1f}s'}).")
+        split_windows.append(days)
+        first, second = query_window(start, mid), query_window(mid + timedelta(days=1), end)
+        if first is None or second is None:
+            return None
+        return first + second
+
+    date_range = StudyDate.split("-")
+    if len(date_range) != 2 or "" in date_range:
+        return cached_find(
+            query_dataset, StudyRootQueryRetrieveInformationModelFind,
+            lambda: find(query_dataset, StudyRootQueryRetrieveInformationModelFind, **kwargs), **kwargs)
+
+    max_responses = int(kwargs.get("PACS_STUDY_QUERY_MAX_RESPONSES", 500))
+    max_latency = float(kwargs.get("PACS_STUDY_QUERY_MAX_LATENCY", 30))
+    min_window_days = int(kwargs.get("PACS_STUDY_QUERY_MIN_WINDOW", 7))
+    if min_window_days < 1:
+        raise ValueError(f"PACS_STUDY_QUERY_MIN_WINDOW must be at least 1 day, got {min_window_days}.")
+    accepted_windows, split_windows = [], []
+
+    start, end = [datetime.strptime(d, "%Y%m%d") for d in date_range]
+    learn_window = str(kwargs.get("PACS_STUDY_QUERY_LEARN_WINDOW", "true")).lower() == "true"
+    learned_window_days = get_window_size(**kwargs) if learn_window else None
+    window_days = learned_window_days or (end - start).days + 1
+
+    study_datasets = []
+    for window_start, window_end in split_date_range(start, end, window_days):
+        study_datasets_ = query_window(window_start, window_end)
+        if study_datasets_ is None:
+            return None
+        study_datasets.extend(study_datasets_)
+
+    if learn_window and (learned_window_days is not None or len(split_windows) > 0):
+        new_window_days = next_window_size(
+            window_days, accepted_windows, len(split_windows) > 0, len(study_datasets), max_responses)
+        if new_window_days is not None and new_window_days != learned_window_days:
+            set_window_size(new_window_days, **kwargs)
+
+    # remove duplicates, e.g., due to studies returned for multiple windows
+    res, study_uids = [], set()
+    for study_dataset in study_datasets:
+        study_uid = Dataset.from_json(study_dataset).get("StudyInstanceUID", None)
+        if study_uid is not None and study_uid in study_uids:
+            continue
+        study_uids.add(study_uid)
+        res.append(study_dataset)
+    return res
@@ -0,0 +1,233 @@
+from datetime import datetime
+from threading import Lock
+
+import json
+import logging
+import os
+import time
+
+"""
+Adaptive rate limiter for PACS traffic. A token bucket limits the number of C-FIND/C-MOVE/C-GET requests per second.
+The rate is increased additively as long as the PACS responds quickly and is decreased multiplicatively if responses
+slow down or requests fail. Responses are slow if the short-term average latency exceeds the long-term average
+(baseline) of the same operation and query/retrieve level by slowdown times. The baseline adapts slowly, i.e., single
+fast outliers do not pin the rate at the floor and a lasting slowdown becomes the new normal after some tens of
+requests. Retrievals are compared by their latency per sub-operation, since their duration depends on the series
+size, and are left out of the latency signal if the number of sub-operations is unknown. Failure statuses and
+retrievals stuck on PENDING (i.e., without any completed sub-operation) count as failures.
+
+The state is written to PACS_RATE_LIMIT_STATE_FILE and, if MongoDB is configured, shared via the pacs_settings
+collection at most every PACS_RATE_LIMIT_SYNC_INTERVAL seconds: new processes start from the shared rate and rate
+decreases of one process are adopted by the others.
+"""
+
+RETRIEVE_OPERATIONS = ["C-MOVE", "C-GET", "WADO-RS"]
+
+_limiter = None
+_limiter_lock = Lock()
+
+
+class Outcome:
+    """Outcome of a PACS request as reported to the rate limiter."""
+
+    def __init__(self):
+        self.failed = False
+        self.pending = 0
+        self.suboperations = None
+        self.latency = None
+        self.level = None
+
+    def status(self, status):
+        """Track the status (dataset) of a DIMSE response, including the sub-operation counts of retrievals."""
+        code = status.get("Status", None) if status is not None else None
+        if code is None:
+            # empty status: connection aborted, timed out or invalid response
+            self.failed = True
+            return
+        if code in [0xFF00, 0xFF01]:
+            self.pending += 1
+        elif code not in [0x0000, 0xFE00] and code & 0xF000 != 0xB000:
+            # neither success, cancel nor warning
+            self.failed = True
+        completed = sum(status.get(tag, 0) for tag in [
+            "NumberOfCompletedSuboperations", "NumberOfFailedSuboperations", "NumberOfWarningSuboperations"])
+        if completed > 0:
+            self.suboperations = max(self.suboperations or 0, completed)
+
+
+class AdaptiveRateLimiter:
+    """Token bucket with AIMD rate control based on response latency and failures."""
+
+    def __init__(self, floor=0.2, ceiling=10.0, rate=1.0, burst=4, increase=0.1, decrease=0.5,
+                 slowdown=2.0, alpha=0.2, baseline_alpha=0.02, state_file=None, shared_state=None,
+                 sync_interval=10):
+        self.floor = float(floor)
+        self.ceiling = float(ceiling)
+        self.rate = min(max(float(rate), self.floor), self.ceiling)
+        self.burst = float(burst)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self.slowdown = float(slowdown)
+        self.alpha = float(alpha)
+        self.baseline_alpha = float(baseline_alpha)
+        self.state_file = state_file
+        self.shared_state = shared_state
+        self.sync_interval = float(sync_interval)
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+        self._last_sync = None
+        self._synced_rate = None
+        self._latency = {}
+        self._counts = {"requests": 0, "failures": 0, "slow": 0, "pending": 0}
+        self._lock = Lock()
+        self._sync_lock = Lock()
+        if shared_state is not None:
+            self._load_shared()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """Block until a request may be sent to the PACS."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def record(self, operation, latency, failed=False, pending=0, suboperations=None, level=None):
+        """
+        Adjust the rate based on the outcome of a finished request. For retrievals, suboperations is the number of
+        completed sub-operations (images), the latency is normalised by it. Latencies are tracked per operation and
+        query/retrieve level (e.g., "C-FIND STUDY"), since the levels differ in response time.
+        """
+        key = operation if level is None else f"{operation} {level}"
+        stuck = operation in RETRIEVE_OPERATIONS and pending > 0 and not suboperations
+        failed = failed or stuck
+        if operation in RETRIEVE_OPERATIONS:
+            latency = latency / suboperations if suboperations else None
+        with self._lock:
+            self._counts["requests"] += 1
+            self._counts["pending"] += pending
+            slow = False
+            if latency is not None:
+                ewma, baseline = self._latency.get(key, (latency, latency))
+                ewma = self.alpha * latency + (1 - self.alpha) * ewma
+                baseline = self.baseline_alpha * latency + (1 - self.baseline_alpha) * baseline
+                self._latency[key] = (ewma, baseline)
+                slow = ewma > self.slowdown * baseline
+            old_rate = self.rate
+            if failed:
+                self._counts["failures"] += 1
+                self.rate = max(self.floor, self.rate * self.decrease)
+            elif slow:
+                self._counts["slow"] += 1
+                self.rate = max(self.floor, self.rate * (1 + self.decrease) / 2)
+            else:
+                self.rate = min(self.ceiling, self.rate + self.increase)
+            changed = self.rate < old_rate
+        if changed:
+            logging.info(f"PACS rate limit decreased to {self.rate:.2f} requests/s ({key}: "
+                         f"latency {latency if latency is None else round(latency, 3)}s, failed: {failed}, "
+                         f"stuck on PENDING: {stuck}).")
+        self.sync()
+
+    def state(self) -> dict:
+        """Current state of the limiter, e.g., for monitoring."""
+        with self._lock:
+            return {
+                "rate": self.rate, "floor": self.floor, "ceiling": self.ceiling,
+                "tokens": self._tokens, **self._counts,
+                "latency": {key: {"ewma": ewma, "baseline": baseline}
+                            for key, (ewma, baseline) in self._latency.items()},
+                "updated_at": str(datetime.now())}
+
+    def sync(self, force=False):
+        """Write the state file and synchronise the shared rate, at most every sync_interval seconds."""
+        now = time.monotonic()
+        with self._sync_lock:
+            if not force and self._last_sync is not None and now - self._last_sync < self.sync_interval:
+                return
+            self._last_sync = now
+            self._sync_shared()
+            self.dump_state()
+
+    def _load_shared(self):
+        try:
+            shared = self.shared_state.load()
+        except Exception as e:
+            logging.warning(f"Could not load shared rate limit: {e}")
+            return
+        if shared is not None:
+            self.rate = min(max(float(shared["rate"]), self.floor), self.ceiling)
+            self._synced_rate = self.rate
+            logging.info(f"Starting with shared PACS rate limit of {self.rate:.2f} requests/s.")
+
+    def _sync_shared(self):
+        """Adopt a lower shared rate set by another process since the last sync, then publish the own rate."""
+        if self.shared_state is None:
+            return
+        try:
+            shared = self.shared_state.load()
+            with self._lock:
+                if shared is not None and self._synced_rate is not None and \
+                        shared["rate"] < self._synced_rate and shared["rate"] < self.rate:
+                    self.rate = max(self.floor, float(shared["rate"]))
+                rate = self.rate
+            self.shared_state.save(rate)
+            self._synced_rate = rate
+        except Exception as e:
+            logging.warning(f"Could not synchronise shared rate limit: {e}")
+
+    def dump_state(self):
+        """Write state to state_file (if configured), such that operators can follow the current rate."""
+        if self.state_file is None:
+            return
+        tmp_file = f"{self.state_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(self.state(), f)
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            logging.warning(f"Could not write rate limiter state: {e}")
+
+
+class MongoSharedState:
+    """Rate of the limiter shared by all workers, stored in the pacs_settings document of the PACS."""
+
+    def __init__(self, collection, pacs_id):
+        self.collection = collection
+        self.pacs_id = pacs_id
+
+    def load(self):
+        settings = self.collection.find_one({"_id": self.pacs_id}, {"rate_limit": 1}) or {}
+        return settings.get("rate_limit", None)
+
+    def save(self, rate):
+        self.collection.update_one(
+            {"_id": self.pacs_id},
+            {"$set": {"rate_limit": {"rate": rate, "updated_at": datetime.utcnow()}}}, upsert=True)
+
+
+def rate_limiter(**kwargs) -> AdaptiveRateLimiter:
+    """Get the rate limiter of this process."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            shared_state = None
+            if "MONGODB_USER" in kwargs and str(kwargs.get("PACS_RATE_LIMIT_SHARED", "true")).lower() == "true":
+                from pacs.settings import settings_collection, pacs_id
+                shared_state = MongoSharedState(settings_collection(**kwargs), pacs_id(**kwargs))
+            _limiter = AdaptiveRateLimiter(
+                floor=kwargs.get("PACS_RATE_LIMIT_FLOOR", 0.2),
+                ceiling=kwargs.get("PACS_RATE_LIMIT_CEILING", 10.0),
+                rate=kwargs.get("PACS_RATE_LIMIT_INITIAL", 1.0),
+                state_file=kwargs.get("PACS_RATE_LIMIT_STATE_FILE", None),
+                shared_state=shared_state,
+                sync_interval=kwargs.get("PACS_RATE_LIMIT_SYNC_INTERVAL", 10))
+        return _limiter
@@ -0,0 +1,197 @@
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+
+from pynetdicom import evt
+from pynetdicom.sop_class import \
+    StudyRootQueryRetrieveInformationModelMove, \
+    StudyRootQueryRetrieveInformationModelGet
+
+from pacs.client import pacs_client
+from pacs.rate_limit import Outcome
+from pacs.storage import storage_scp, next_message_id
+from pacs.transfer_syntax import transfer_syntaxes
+
+import logging
+import time
+
+"""
+Image retrieval via C-MOVE (default) or C-GET (PACS_RETRIEVE_MODE=get). C-MOVE requires the PACS to connect back to
+the Storage SCP on PACS_LOCAL_PORT. C-GET receives the images over the same association, i.e., no listening port is
+required and workers can be scaled without port allocation.
+
+Each retrieval is supervised by a watchdog: if it exceeds PACS_RETRIEVE_DEADLINE seconds or makes no progress
+(neither completed sub-operations nor received images) for PACS_RETRIEVE_STALL_TIMEOUT seconds, a C-CANCEL is sent.
+If the PACS does not end the request within CANCEL_GRACE seconds, the association is aborted. Either way the
+request ends with the images received so far and the slot is free for the next request.
+"""
+
+CANCEL_GRACE = 10
+
+
+class Retrieval:
+    """Running C-MOVE/C-GET request."""
+
+    def __init__(self, msg_id, query_model, deadline=None, stall_timeout=None):
+        self.assoc = None
+        self.msg_id = msg_id
+        self.query_model = query_model
+        self.deadline = deadline
+        self.stall_timeout = stall_timeout
+        self.received = 0
+        self.bytes = 0
+        self.completed = 0
+        self.remaining = None
+        self.timed_out = None
+        self.outcome = Outcome()
+        self.start = self.last_progress = time.monotonic()
+        self._responses = None
+        self._cancelled_at = None
+        self._lock = Lock()
+
+    @property
+    def is_established(self):
+        return self._responses is not None
+
+    @property
+    def responses(self):
+        """Responses of the request. Sub-operation counts of pending responses are tracked as progress."""
+        for (status, response_dataset) in self._responses:
+            completed = sum(status.get(tag, 0) for tag in [
+                "NumberOfCompletedSuboperations", "NumberOfFailedSuboperations", "NumberOfWarningSuboperations"])
+            with self._lock:
+                self.outcome.status(status)
+                if completed > self.completed:
+                    self.completed = completed
+                    self.last_progress = time.monotonic()
+                self.remaining = status.get("NumberOfRemainingSuboperations", self.remaining)
+            yield status, response_dataset
+
+    def progress(self, nr_of_bytes):
+        """Record a received image."""
+        with self._lock:
+            self.received += 1
+            self.bytes += nr_of_bytes
+            self.outcome.suboperations = max(self.outcome.suboperations or 0, self.received)
+            self.last_progress = time.monotonic()
+
+    def cancel(self):
+        """Send C-CANCEL for the request."""
+        with self._lock:
+            if self._cancelled_at is not None:
+                return
+            self._cancelled_at = time.monotonic()
+        self.assoc.send_c_cancel(self.msg_id, query_model=self.query_model)
+
+    def abort(self):
+        """Abort the association, e.g., if the PACS is stuck."""
+        self.assoc.abort()
+
+    def check(self):
+        """Cancel the request if the deadline is exceeded or it stalls, abort if the cancel is ignored."""
+        now = time.monotonic()
+        with self._lock:
+            cancelled_at = self._cancelled_at
+            if self.timed_out is None:
+                if self.deadline is not None and now - self.start > self.deadline:
+                    self.timed_out = "deadline"
+                elif self.stall_timeout is not None and now - self.last_progress > self.stall_timeout:
+                    self.timed_out = "stalled"
+                # a stuck PACS slows down the other requests as well
+                self.outcome.failed = self.outcome.failed or self.timed_out is not None
+            timed_out = self.timed_out
+        if timed_out is None:
+            return
+        if cancelled_at is None:
+            logging.warning(f"Retrieval {timed_out} after {now - self.start:.0f}s "
+                            f"({self.received} images received), sending C-CANCEL.")
+            self.cancel()
+        elif now - cancelled_at > CANCEL_GRACE and self.assoc.is_established:
+            logging.warning("C-CANCEL ignored, aborting association.")
+            self.abort()
+
+    def result(self) -> dict:
+        """Summary of the (possibly partial) retrieval."""
+        with self._lock:
+            return {"received": self.received, "bytes": self.bytes, "completed": self.completed,
+                    "remaining": self.remaining, "elapsed": round(time.monotonic() - self.start, 3),
+                    "timed_out": self.timed_out}
+
+
+def retrieve_mode(**kwargs) -> str:
+    return str(kwargs.get("PACS_RETRIEVE_MODE", "move")).lower()
+
+
+def _timeout(name, default, **kwargs):
+    """Timeout in seconds, None if disabled (<= 0)."""
+    value = float(kwargs.get(name, default))
+    return value if value > 0 else None
+
+
+@contextmanager
+def watch(retrieval):
+    """Run the watchdog of the retrieval for the duration of the with-block."""
+    if retrieval.deadline is None and retrieval.stall_timeout is None:
+        yield
+        return
+    stop = Event()
+
+    def run():
+        while not stop.wait(1):
+            retrieval.check()
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+@contextmanager
+def retrieve(query_dataset, handler, args=(), uids=None, header_only=True, **kwargs):
+    """
+    Retrieve the images matching query_dataset. Each received image is passed to handler(event, *args). Yields a
+    Retrieval, iterate over its responses to run the request. uids (e.g., {"SeriesInstanceUID": ...}) are used to
+    route C-MOVE images in case the PACS does not set the MoveOriginatorMessageID. header_only selects the
+    transfer syntax preference list proposed for C-GET.
+    """
+    msg_id = next_message_id()
+    retrieval = Retrieval(
+        msg_id, None,
+        deadline=_timeout("PACS_RETRIEVE_DEADLINE", 300, **kwargs),
+        stall_timeout=_timeout("PACS_RETRIEVE_STALL_TIMEOUT", 60, **kwargs))
+    retrieval.outcome.level = query_dataset.get("QueryRetrieveLevel", None)
+
+    def handle_store(event, *args_):
+        retrieval.progress(len(event.request.DataSet.getvalue()))
+        return handler(event, *args_)
+
+    if retrieve_mode(**kwargs) == "get":
+        retrieval.query_model = StudyRootQueryRetrieveInformationModelGet
+        transfer_syntax = transfer_syntaxes(header_only, **kwargs)
+        with pacs_client(c_get=True, transfer_syntax=transfer_syntax, **kwargs).association(
+                "C-GET", retrieval.outcome) as assoc:
+            retrieval.assoc = assoc
+            if not assoc.is_established:
+                yield retrieval
+                return
+            assoc.bind(evt.EVT_C_STORE, handle_store, list(args))
+            try:
+                retrieval._responses = assoc.send_c_get(query_dataset, retrieval.query_model, msg_id=msg_id)
+                with watch(retrieval):
+                    yield retrieval
+            finally:
+                assoc.unbind(evt.EVT_C_STORE, handle_store)
+    else:
+        retrieval.query_model = StudyRootQueryRetrieveInformationModelMove
+        with storage_scp(**kwargs).route(handle_store, msg_id, args, **(uids or {})), \
+                pacs_client(**kwargs).association("C-MOVE", retrieval.outcome) as assoc:
+            retrieval.assoc = assoc
+            if not assoc.is_established:
+                yield retrieval
+                return
+            retrieval._responses = assoc.send_c_move(
+                query_dataset, kwargs["PACS_LOCAL_AE_TITLE"], retrieval.query_model, msg_id=msg_id)
+            with watch(retrieval):
+                yield retrieval
@@ -0,0 +1,17 @@
+from utils.misc import mongo_get_collection
+
+"""
+Learned per-PACS settings (e.g., the study query window size and the rate limit), stored in the MongoDB collection
+pacs_settings with one document per remote AE, such that they are shared by all workers and kept across runs.
+"""
+
+
+def settings_collection(**kwargs):
+    return mongo_get_collection(
+        "pacs_settings",
+        user=kwargs["MONGODB_USER"], password=kwargs["MONGODB_PASSWORD"],
+        url=kwargs["DEPLOYMENT_URL"], port=kwargs["MONGODB_PORT"], db=kwargs["MONGODB_DATABASE_NAME"])
+
+
+def pacs_id(**kwargs) -> str:
+    return f"{kwargs['PACS_REMOTE_AE_TITLE']}@{kwargs['PACS_REMOTE_URL']}:{kwargs['PACS_REMOTE_PORT']}"
@@ -0,0 +1,120 @@
+from contextlib import contextmanager
+from itertools import count
+from threading import Lock
+
+from pynetdicom import AE, evt
+from pynetdicom.sop_class import StudyRootQueryRetrieveInformationModelMove
+
+from pacs.header import read_header
+from pacs.transfer_syntax import transfer_syntaxes, merge_transfer_syntaxes, storage_contexts, check_negotiated
+
+import atexit
+import logging
+
+"""
+Long-lived Storage SCP. One C-STORE listener per task process receives the images of all C-MOVE requests and
+routes each dataset to the waiting request, either based on the MoveOriginatorMessageID or, if the PACS does not
+set it, based on the SOPInstanceUID/SeriesInstanceUID. Since the PACS proposes the transfer syntaxes of the C-STORE
+sub-association, the listener supports the union of the header-only and full preference lists.
+
+The listener binds PACS_LOCAL_PORT, i.e., only one process per host (worker container) can receive C-MOVE images at
+a time. Airflow runs each task in its own process and the listener is not shared between processes, hence concurrent
+C-MOVE tasks on the same worker fail to start the listener (the DAGs keep max_active_tasks=1 for this reason).
+Either limit the retrieve tasks to one per worker (e.g., with an Airflow pool), run one worker container per local AE
+title/port (each pair has to be registered at the PACS), or use C-GET (PACS_RETRIEVE_MODE=get), which does not
+require a listening port.
+"""
+
+_scp = None
+_scp_lock = Lock()
+
+_message_ids = count()
+_message_ids_lock = Lock()
+
+
+def next_message_id() -> int:
+    """Get a process-wide unique DIMSE message ID (1-65535)."""
+    with _message_ids_lock:
+        return next(_message_ids) % 65535 + 1
+
+
+class StorageSCP:
+    """C-STORE listener which dispatches incoming datasets to registered routes."""
+
+    def __init__(self, ae_title, port, transfer_syntax):
+        self.port = int(port)
+        self.transfer_syntax = transfer_syntax
+        self._routes = {}
+        self._lock = Lock()
+        ae = AE(ae_title=ae_title)
+        ae.add_requested_context(StudyRootQueryRetrieveInformationModelMove)
+        ae.supported_contexts = storage_contexts(transfer_syntax)
+        try:
+            self._server = ae.start_server(
+                ("0.0.0.0", self.port), block=False,
+                evt_handlers=[(evt.EVT_ACCEPTED, self._handle_accepted), (evt.EVT_C_STORE, self._handle_store)])
+        except OSError as e:
+            raise RuntimeError(
+                f"Could not start the Storage SCP on port {self.port} ({e}). Another task process on this worker "
+                f"is probably receiving C-MOVE images, see pacs/storage.py for the options.") from e
+
+    def _handle_accepted(self, event):
+        """Log the transfer syntaxes negotiated by the PACS."""
+        check_negotiated(event.assoc.accepted_contexts, self.transfer_syntax)
+
+    def _find_route(self, event):
+        """Find the route for a C-STORE request. Prefer the message ID, fall back to the UIDs of the dataset."""
+        with self._lock:
+            routes = list(self._routes.values())
+        message_id = getattr(event.request, "MoveOriginatorMessageID", None)
+        if message_id is not None:
+            for route in routes:
+                if route["message_id"] == message_id:
+                    return route
+        ds = read_header(event)
+        for tag in ["SOPInstanceUID", "SeriesInstanceUID", "StudyInstanceUID"]:
+            for route in routes:
+                if tag in route["uids"] and route["uids"][tag] == ds.get(tag, None):
+                    return route
+        return None
+
+    def _handle_store(self, event):
+        """Handle a C-STORE service request"""
+        route = self._find_route(event)
+        if route is None:
+            logging.warning("Received unexpected image, no matching C-MOVE request found.")
+            return 0xC000
+        return route["handler"](event, *route["args"])
+
+    @contextmanager
+    def route(self, handler, message_id, args=(), **uids):
+        """
+        Route incoming images to handler(event, *args) for the duration of the with-block. Images are matched
+        by message_id or by the UIDs given as keyword arguments, e.g., SeriesInstanceUID=...
+        """
+        token = object()
+        with self._lock:
+            self._routes[token] = {
+                "handler": handler, "message_id": message_id, "args": args,
+                "uids": {k: v for k, v in uids.items() if v not in [None, ""]}}
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._routes[token]
+
+    def shutdown(self):
+        """Stop the listener."""
+        self._server.shutdown()
+
+
+def storage_scp(**kwargs) -> StorageSCP:
+    """Get the Storage SCP of this process. The listener is started on first use and stopped at exit."""
+    global _scp
+    with _scp_lock:
+        if _scp is None:
+            _scp = StorageSCP(
+                kwargs["PACS_LOCAL_AE_TITLE"], kwargs["PACS_LOCAL_PORT"],
+                merge_transfer_syntaxes(transfer_syntaxes(True, **kwargs), transfer_syntaxes(False, **kwargs)))
+            atexit.register(_scp.shutdown)
+        return _scp
@@ -0,0 +1,78 @@
+from collections import Counter
+from typing import List
+
+from pydicom import uid
+from pydicom.uid import UID, \
+    ImplicitVRLittleEndian, ExplicitVRLittleEndian, DeflatedExplicitVRLittleEndian, \
+    JPEGLSLossless, JPEG2000Lossless
+from pynetdicom import StoragePresentationContexts, build_context
+
+import logging
+
+"""
+Transfer syntax preferences of the storage contexts. Header-only retrievals prefer Deflated Explicit VR Little
+Endian, full downloads prefer lossless JPEG-LS/JPEG 2000. The lists can be configured per task type via
+PACS_TRANSFER_SYNTAXES_HEADER and PACS_TRANSFER_SYNTAXES_FULL (comma-separated pydicom names or UIDs, in order of
+preference). Implicit VR Little Endian is always appended, since it is the default transfer syntax every PACS has
+to support. Only depends on pydicom/pynetdicom, such that the sequence-classification image can use the same
+implementation (the module is copied into the image, see sequence-classification/Dockerfile).
+"""
+
+HEADER_TRANSFER_SYNTAXES = [DeflatedExplicitVRLittleEndian, ExplicitVRLittleEndian, ImplicitVRLittleEndian]
+FULL_TRANSFER_SYNTAXES = [
+    JPEGLSLossless, JPEG2000Lossless, DeflatedExplicitVRLittleEndian, ExplicitVRLittleEndian,
+    ImplicitVRLittleEndian]
+
+
+def parse_transfer_syntaxes(value) -> List[UID]:
+    """Parse a comma-separated list of transfer syntaxes, given as pydicom names or UIDs."""
+    transfer_syntaxes = []
+    for name in [n.strip() for n in str(value).split(",") if n.strip() != ""]:
+        transfer_syntax = UID(getattr(uid, name, name))
+        if not transfer_syntax.is_transfer_syntax:
+            raise ValueError(f"Unknown transfer syntax '{name}'!")
+        if transfer_syntax not in transfer_syntaxes:
+            transfer_syntaxes.append(transfer_syntax)
+    if ImplicitVRLittleEndian not in transfer_syntaxes:
+        transfer_syntaxes.append(ImplicitVRLittleEndian)
+    return transfer_syntaxes
+
+
+def transfer_syntaxes(header_only=True, **kwargs) -> List[UID]:
+    """Transfer syntax preference list for header-only or full retrievals."""
+    if header_only:
+        value = kwargs.get("PACS_TRANSFER_SYNTAXES_HEADER", None)
+        return parse_transfer_syntaxes(value) if value else list(HEADER_TRANSFER_SYNTAXES)
+    value = kwargs.get("PACS_TRANSFER_SYNTAXES_FULL", None)
+    return parse_transfer_syntaxes(value) if value else list(FULL_TRANSFER_SYNTAXES)
+
+
+def merge_transfer_syntaxes(*preferences) -> List[UID]:
+    """Union of the preference lists, keeping the order."""
+    res = []
+    for transfer_syntax in [ts for preference in preferences for ts in preference]:
+        if transfer_syntax not in res:
+            res.append(transfer_syntax)
+    return res
+
+
+def storage_contexts(transfer_syntax, n=None) -> list:
+    """Storage presentation contexts (the first n) proposing/supporting the given transfer syntaxes."""
+    return [build_context(cx.abstract_syntax, transfer_syntax) for cx in StoragePresentationContexts[:n]]
+
+
+def check_negotiated(contexts, transfer_syntax) -> Counter:
+    """
+    Check the accepted storage contexts of an association against the preference list. Warns if the PACS did not
+    accept any of the preferred deflated/compressed transfer syntaxes, i.e., the data is sent uncompressed.
+    """
+    storage_uids = set(cx.abstract_syntax for cx in StoragePresentationContexts)
+    negotiated = Counter(
+        UID(cx.transfer_syntax[0]).name for cx in contexts
+        if cx.abstract_syntax in storage_uids and len(cx.transfer_syntax) > 0)
+    logging.info(f"Negotiated transfer syntaxes: {dict(negotiated)}")
+    preferred = set(ts.name for ts in transfer_syntax if ts.is_deflated or ts.is_compressed)
+    if len(negotiated) > 0 and len(preferred) > 0 and len(preferred & set(negotiated)) == 0:
+        logging.warning(f"PACS does not accept any of the preferred transfer syntaxes "
+                        f"({', '.join(sorted(preferred))}).")
+    return negotiated
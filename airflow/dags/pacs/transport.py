@@ -0,0 +1,45 @@
+from pacs import dicomweb
+from pacs.client import pacs_client
+from pacs.rate_limit import Outcome
+
+import logging
+
+"""
+Pluggable transport for queries and header retrievals: DIMSE (default) or DICOMweb (PACS_TRANSPORT=dicomweb, requires
+PACS_DICOMWEB_URL). Both return the same DICOM JSON to the downstream tasks. Full image downloads (store_image) always
+use DIMSE.
+"""
+
+
+def transport(**kwargs) -> str:
+    return str(kwargs.get("PACS_TRANSPORT", "dimse")).lower()
+
+
+def to_json(response_dataset):
+    return response_dataset.to_json()
+
+
+def find(query_dataset, query_model, convert=to_json, outcome=None, **kwargs):
+    """
+    C-FIND (or QIDO-RS search) for query_dataset. Each response dataset is passed through convert while the
+    responses stream in. Returns the converted responses, None if the PACS could not be reached or the query did not
+    complete successfully (failure status, aborted association), i.e., partial results are neither returned nor
+    cached. If given, outcome (pacs.rate_limit.Outcome) receives the statuses and the latency of the exchange.
+    """
+    if transport(**kwargs) == "dicomweb":
+        return dicomweb.search(query_dataset, convert, outcome=outcome, **kwargs)
+    outcome = outcome or Outcome()
+    outcome.level = query_dataset.get("QueryRetrieveLevel", None)
+    with pacs_client(**kwargs).association("C-FIND", outcome) as assoc:
+        if assoc.is_established:
+            res, code = [], None
+            for (status, response_dataset) in assoc.send_c_find(query_dataset, query_model=query_model):
+                outcome.status(status)
+                code = status.get("Status", None) if status is not None else None
+                if response_dataset is not None:
+                    res.append(convert(response_dataset))
+            if outcome.failed or code != 0x0000:
+                logging.error(f"C-FIND failed with status {code if code is None else hex(code)}, "
+                              f"discarding {len(res)} responses.")
+                return None
+            return res
@@ -1,7 +1,11 @@
+from airflow.utils.task_group import TaskGroup
 from airflow.utils.trigger_rule import TriggerRule
 from airflow.models import DAG
+from contextlib import nullcontext
 from datetime import datetime
 
+from pacs.cache import flush_stats
+from pacs.client import map_queries
 from pacs.query_study_level import query_study_level
 from pacs.query_series_level import query_series_level
 from pacs.query_instance_level import query_instance_level
@@ -11,23 +15,33 @@ from pacs.move_images import \
 from database.database import *
 from database.acquisition_state import acquisition_state
 from database.sanitize_studies import sanitize_studies
+from database.registry_snapshot import load_snapshot
 
 from validation.external_imaging import test_external_imaging
 from validation.first_internal_imaging import test_first_internal_imaging
 from validation.second_internal_imaging import test_second_internal_imaging
 from validation.door_to_image_time import test_door_to_image_time
 
-from utils.misc import mongo_get_collection, get_time_frame
+from utils.misc import mongo_get_collection, get_time_frames, assign_to_time_frames
 from utils.filter import *
 
+from pydicom import Dataset
+
+from typing import Dict, List
+
+from airflow.operators.python import get_current_context
+
 import pandas as pd
 
 import pymongo
+import time
 import os
 
 """
 DAG definition and creation. The file will be automatically parsed from the Airflow worker. All DAGs are configured 
 to run once after un-pausing. This is also the reason why the start_date is in the past. 
+With PACS_DAG_MODE=registry, a single DAG processing the registry in batches is created instead of one DAG per case.
+Parsing does not access MongoDB, the per-case DAGs are defined based on the local registry snapshot.
 """
 
 config = {k: v for k, v in os.environ.items()}
@@ -36,24 +50,6 @@ args = {
     'owner': 'Airflow',
     'start_date': datetime(2022, 6, 17)}
 
-ssr_collection = mongo_get_collection(
-    "swiss_stroke_registry",
-    user=config["MONGODB_USER"],
-    password=config["MONGODB_PASSWORD"],
-    url=config["DEPLOYMENT_URL"],
-    port=config["MONGODB_PORT"],
-    db=config["MONGODB_DATABASE_NAME"])
-
-ssr_cursor = ssr_collection.find(
-    {},
-    {"_id": 0}).sort([("_SSRID", pymongo.ASCENDING)])
-df = pd.DataFrame(ssr_cursor)
-df.index = df["_SSRID"]
-
-# For performance reasons, only load around 500 cases at a time.
-# More will increase the scheduling time between tasks.
-# df = df.iloc[:500, :]
-
 
 @task
 def flatten(list_of_list):
@@ -64,16 +60,45 @@ def flatten(list_of_list):
     return res
 
 
-@task
-def query_and_filter_series(patient_id, study_date) -> dict:
-    """Combined function to get study and series data. Unrelated studies/series will be skipped."""
+def query_patient_studies(patient_id, time_frames) -> Dict[str, list]:
+    """
+    Query the studies of a patient once for the time frames (ssr_id, start, end) of all its cases and assign them to
+    the cases, see assign_to_time_frames. Returns the studies per ssr_id (as string).
+    """
     studies = query_study_level.function(
-        PatientID=patient_id, StudyDate=study_date, **config)
+        PatientID=patient_id,
+        StudyDate=f"{min(f[1] for f in time_frames)}-{max(f[2] for f in time_frames)}", **config)
+    res = {str(f[0]): [] for f in time_frames}
+    study_dates = [Dataset.from_json(study).get("StudyDate", "") for study in studies]
+    for study, ssr_ids in zip(studies, assign_to_time_frames(study_dates, time_frames)):
+        for ssr_id in ssr_ids:
+            res[str(ssr_id)].append(study)
+    logging.info(f"Assigned {len(studies)} studies to {len(res)} cases of the patient.")
+    return res
+
+
+@task(show_return_value_in_logs=False)
+def query_patient(patient_id, time_frames) -> Dict[str, list]:
+    """Shared study query of all cases of a patient (per-patient mode), see query_patient_studies."""
+    return query_patient_studies(patient_id, time_frames)
+
+
+@task
+def query_and_filter_series(patient_id=None, study_date=None, studies=None) -> dict:
+    """
+    Combined function to get study and series data. Unrelated studies/series will be skipped. If the studies of
+    the case are given (per-patient mode, see query_patient_studies), the study level query is skipped.
+    """
+    if studies is None:
+        studies = query_study_level.function(
+            PatientID=patient_id, StudyDate=study_date, **config)
     filtered_studies = filter_studies.function(studies)
     series = []
-    for study in filtered_studies:
-        series_ = query_series_level.function(study_dataset=study, **config)
+    for series_ in map_queries(
+            lambda study: query_series_level.function(study_dataset=study, **config),
+            filtered_studies, **config):
         series.extend(series_)
+    flush_stats(**config)
     filtered_series = filter_series.function(series)
     logging.info(f"Number of filtered studies is {len(filtered_studies)}")
     logging.info(f"Number of filtered series is {len(filtered_series)}")
@@ -86,10 +111,10 @@ def query_and_filter_series(patient_id, study_date) -> dict:
 @task
 def query_all_instances(series):
     """Query all instance information."""
-    instances = []
-    for s in series:
-        instances_ = query_instance_level.function(series_dataset=s, **config)
-        instances.append(instances_)
+    instances = map_queries(
+        lambda s: query_instance_level.function(series_dataset=s, **config),
+        series, **config)
+    flush_stats(**config)
     logging.info(f"Found {len(instances)} instances.")
     return instances
 
@@ -116,12 +141,17 @@ def move_all_series(instances):
 
 @task
 def dump_results(ssr_id, studies, series, failed_images, successful_images):
-    """Save all studies/series/reference images in database. Will raise an error if no data is available."""
+    """
+    Save all studies/series/reference images in database, replacing those of a previous try. Will raise an error if
+    no data is available.
+    """
     if len(studies) == 0 or len(series) == 0 or len(successful_images) == 0:
         logging.warning(f"Number of studies to dump is {len(studies)}")
         logging.warning(f"Number of series to dump is {len(series)}")
         logging.warning(f"Number of images to dump is {len(successful_images)}")
         raise ValueError
+    # documents of a previous, interrupted try
+    delete_case(ssr_id=ssr_id, **config)
     dump_studies_all.function(ssr_id=ssr_id, studies=studies, **config),
     dump_series_all.function(ssr_id=ssr_id, series=series, **config)
     dump_images_all.function(ssr_id=ssr_id, images=successful_images, **config)
@@ -143,72 +173,327 @@ def run_all_tests(ssr_id) -> dict:
     }
 
 
-# Iterate over cases, extract PatientID and time range to query for studies and define the DAGs
-for idx, (n, s) in enumerate(df.iterrows()):
+@task(retries=2, show_return_value_in_logs=False)
+def post_download(ssr_id, arrival_time_at_hospital, filtered_studies, filtered_series, images_1, images_2):
+    """
+    Fused post-download stages of the fast pipeline (PACS_FUSED_POST_DOWNLOAD). The stages from successful_images to
+    dump_tests_all run in-process instead of as separate tasks. Stages writing to the database are checkpointed per
+    DAG run, i.e., a retry continues after the last completed stage.
+    """
+    context = get_current_context()
+    checkpoint_id = f"{context['dag'].dag_id}/{context['run_id']}"
+    checkpoints = mongo_get_collection(
+        "pacs_stage_checkpoints",
+        user=config["MONGODB_USER"], password=config["MONGODB_PASSWORD"],
+        url=config["DEPLOYMENT_URL"], port=config["MONGODB_PORT"], db=config["MONGODB_DATABASE_NAME"])
+    completed = set((checkpoints.find_one({"_id": checkpoint_id}) or {}).get("stages", []))
+
+    def stage(name, func, checkpoint=False):
+        if name in completed:
+            logging.info(f"Stage {name}: completed in a previous try, skipped.")
+            return None
+        logging.info(f"Stage {name}: started.")
+        start = time.monotonic()
+        res = func()
+        logging.info(f"Stage {name}: finished in {time.monotonic() - start:.2f}s.")
+        if checkpoint:
+            checkpoints.update_one({"_id": checkpoint_id}, {"$addToSet": {"stages": name}}, upsert=True)
+        return res
+
+    images = stage("filter_images", lambda: filter_images.function(flatten.function(
+        [successful_images.function(images_1), successful_images.function(images_2)])))
+    failed_i = stage("failed_images_final", lambda: failed_images.function(images_2))
+    stage("dump_results", lambda: dump_results.function(
+        ssr_id, filtered_studies, filtered_series, failed_i, images), checkpoint=True)
+    stage("acquisition_state", lambda: acquisition_state.function(
+        ssr_id=ssr_id, arrival_time_at_hospital=arrival_time_at_hospital, **config), checkpoint=True)
+    stage("sanitize_studies", lambda: sanitize_studies.function(ssr_id=ssr_id, **config), checkpoint=True)
+    res_tests = stage("run_all_tests", lambda: run_all_tests.function(ssr_id=ssr_id))
+    stage("dump_tests_all", lambda: dump_tests_all.function(**res_tests, **config), checkpoint=True)
+
+
+def run_stage(case, stage, func):
+    """
+    Run stage func(case) of a case in the registry DAG and add its results to the case. Errors are recorded in the
+    case instead of failing the mapped task instance, such that the other cases of the batch continue. Later stages
+    skip failed cases.
+    """
+    if "error" in case:
+        return case
+    logging.info(f"Case {case['ssr_id']}: {stage}")
+    try:
+        case.update(func(case))
+    except Exception as e:
+        logging.exception(f"Case {case['ssr_id']}: {stage} failed.")
+        case["error"] = f"{stage}: {e!r}"
+    return case
+
+
+def registry_collection():
+    return mongo_get_collection(
+        "swiss_stroke_registry",
+        user=config["MONGODB_USER"], password=config["MONGODB_PASSWORD"],
+        url=config["DEPLOYMENT_URL"], port=config["MONGODB_PORT"], db=config["MONGODB_DATABASE_NAME"])
+
+
+def case_state_collection():
+    return mongo_get_collection(
+        "pacs_case_state",
+        user=config["MONGODB_USER"], password=config["MONGODB_PASSWORD"],
+        url=config["DEPLOYMENT_URL"], port=config["MONGODB_PORT"], db=config["MONGODB_DATABASE_NAME"])
 
-    # Create DAG and allow at most one running task and run per time.
-    # This due to technical limitations of the PACS.
-    with DAG(
-        dag_id=f'query_pacs_for_{n}', tags=["query_pacs"],
-        default_args=args, schedule_interval="@once",
-        max_active_tasks=1, max_active_runs=1
-    ) as dag:
 
-        patient_id = s.PatientID
-
-        try:
-            dates = df.loc[df.PatientID == patient_id, "arrival_time_at_hospital"]
-            dates = dates.sort_values()
-            start_time, end_time = get_time_frame(s.arrival_time_at_hospital, dates)
-            start_time_str = start_time.strftime("%Y%m%d")
-            end_time_str = end_time.strftime("%Y%m%d")
-        except TypeError:
+@task
+def select_cases() -> List[dict]:
+    """
+    Bounded queue of cases in flight. Selects the next PACS_CASES_IN_FLIGHT cases (by _SSRID) which are neither
+    done nor failed PACS_CASE_MAX_ATTEMPTS times and computes their time frames. In per-patient mode, the batch is
+    extended by the other open cases of the selected patients, such that each patient is queried once.
+    """
+    max_cases = int(config.get("PACS_CASES_IN_FLIGHT", 50))
+    max_attempts = int(config.get("PACS_CASE_MAX_ATTEMPTS", 3))
+    ssr_collection = registry_collection()
+    state_collection = case_state_collection()
+    finished = state_collection.distinct("_id", {"$or": [
+        {"state": {"$in": ["done", "skipped"]}}, {"attempts": {"$gte": max_attempts}}]})
+    selected = list(ssr_collection.find(
+        {"_SSRID": {"$nin": finished}}, {"_id": 0, "_SSRID": 1, "PatientID": 1}
+    ).sort([("_SSRID", pymongo.ASCENDING)]).limit(max_cases))
+    if len(selected) == 0:
+        logging.info("No cases left.")
+        return []
+    if query_per_patient:
+        selected = list(ssr_collection.find(
+            {"_SSRID": {"$nin": finished}, "PatientID": {"$in": list(set(c["PatientID"] for c in selected))}},
+            {"_id": 0, "_SSRID": 1, "PatientID": 1}
+        ).sort([("_SSRID", pymongo.ASCENDING)]))
+
+    # time frames depend on all cases of a patient
+    df_patients = pd.DataFrame(ssr_collection.find(
+        {"PatientID": {"$in": list(set(c["PatientID"] for c in selected))}},
+        {"_id": 0, "_SSRID": 1, "PatientID": 1, "arrival_time_at_hospital": 1}))
+    df_patients.index = df_patients["_SSRID"]
+    time_frames = get_time_frames(df_patients)
+    patient_time_frames = {}
+    for n, (start_time_str, end_time_str) in time_frames.items():
+        patient_time_frames.setdefault(df_patients.loc[n, "PatientID"], []).append((n, start_time_str, end_time_str))
+
+    cases = []
+    now = datetime.utcnow()
+    for c in selected:
+        n = c["_SSRID"]
+        if n not in time_frames:
             # in case an SSR entry is not available
+            state_collection.update_one(
+                {"_id": n}, {"$set": {"state": "skipped", "updated_at": now}}, upsert=True)
+            continue
+        start_time_str, end_time_str = time_frames[n]
+        case = {"ssr_id": n, "patient_id": c["PatientID"],
+                "arrival_time_at_hospital": df_patients.loc[n, "arrival_time_at_hospital"].isoformat(),
+                "study_date": f"{start_time_str}-{end_time_str}", "time_frames": None}
+        if query_per_patient:
+            frames = patient_time_frames[c["PatientID"]]
+            case["study_date"] = f"{min(f[1] for f in frames)}-{max(f[2] for f in frames)}"
+            case["time_frames"] = frames
+        state_collection.update_one(
+            {"_id": n}, {"$set": {"state": "in_flight", "updated_at": now}, "$inc": {"attempts": 1}}, upsert=True)
+        cases.append(case)
+    logging.info(f"Selected {len(cases)} cases.")
+    return cases
+
+
+def assign_patient_studies(cases) -> List[dict]:
+    """
+    Query the studies of each patient of the cases once (per-patient mode) and add them to its cases. If the query
+    fails, the error is recorded in all cases of the patient.
+    """
+    patients = {}
+    for case in cases:
+        if "error" not in case:
+            patients.setdefault(case["patient_id"], []).append(case)
+    for patient_id, patient_cases in patients.items():
+        try:
+            studies = query_patient_studies(patient_id, patient_cases[0]["time_frames"])
+        except Exception as e:
+            logging.exception(f"Patient of cases {[c['ssr_id'] for c in patient_cases]}: study query failed.")
+            for case in patient_cases:
+                case["error"] = f"query_patient_studies: {e!r}"
             continue
+        for case in patient_cases:
+            case["studies"] = studies[str(case["ssr_id"])]
+    return cases
+
+
+@task(show_return_value_in_logs=False)
+def query_patients(cases) -> List[dict]:
+    """Shared study queries of the patients of the batch (per-patient mode), see assign_patient_studies."""
+    return assign_patient_studies(cases) if query_per_patient else cases
+
+
+@task(show_return_value_in_logs=False)
+def query_case(case) -> dict:
+    return run_stage(case, "query_and_filter_series", lambda c: query_and_filter_series.function(
+        patient_id=c["patient_id"], study_date=c["study_date"], studies=c.pop("studies", None)))
+
+
+@task(show_return_value_in_logs=False)
+def query_case_instances(case) -> dict:
+    return run_stage(case, "query_all_instances", lambda c: {
+        "instances": query_all_instances.function(c["filtered_series"])})
 
-        # -- Fast pipeline -- #
-
-        res = query_and_filter_series(
-            patient_id=patient_id, study_date=f"{start_time_str}-{end_time_str}")
-        filtered_studies, filtered_series = res["filtered_studies"], res["filtered_series"]
-        instances = query_all_instances.override(show_return_value_in_logs=False)(filtered_series)
-        images_1 = move_all_images.override(show_return_value_in_logs=False)(instances)
-        images_2 = move_all_series.override(show_return_value_in_logs=False)(failed_images(images_1))
-        images = filter_images.override(trigger_rule=TriggerRule.ALL_DONE) \
-            (flatten([successful_images(images_1), successful_images(images_2)]))
-        failed_i = failed_images.override(task_id="failed_images_final")(images_2)
-        get_acquisition_state = \
-            acquisition_state(ssr_id=n, arrival_time_at_hospital=s.arrival_time_at_hospital, **config)
-        res_tests = dump_results(n, filtered_studies, filtered_series, failed_i, images) \
-                    >> get_acquisition_state \
-                    >> sanitize_studies(ssr_id=n, **config) \
-                    >> run_all_tests(ssr_id=n)
-        dump_tests_all(res_tests["external_imaging"], res_tests["first_internal_imaging"],
-                       res_tests["second_internal_imaging"], res_tests["door_to_image_time"], **config)
-
-        # -- Exhaustive pipeline -- #
-
-        # studies = query_study_level(
-        #     PatientID=patient_id, StudyDate=f"{start_time_str}-{end_time_str}", **config)
-        # filtered_studies = filter_studies(studies)
-        # series = query_series_level.expand(study_dataset=filtered_studies, **config)
-        # filtered_series = filter_series(flatten(series))
-        # instances = query_instance_level.override(retries=3).expand(series_dataset=filtered_series, **config)
-        # images_1 = move_image.expand(instance_dataset=instances, **config)
-        # images_2 = move_series.expand(series_dataset=failed_images(images_1))
-        # dump_to_database = [
-        #     images >> dump_images.override(trigger_rule=TriggerRule.ALL_SUCCESS)(ssr_id=n, **config),
-        #     filtered_studies >> dump_studies.override(trigger_rule=TriggerRule.ALL_SUCCESS)(ssr_id=n, **config),
-        #     failed_images.override(task_id="failed_images_final")(images_2) >> dump_failed(ssr_id=n, **config),
-        #     filtered_series >> dump_series.override(trigger_rule=TriggerRule.ALL_SUCCESS)(ssr_id=n, **config)
-        # ]
-        # tests = [
-        #     test_external_imaging(n),
-        #     test_first_internal_imaging(n),
-        #     test_second_internal_imaging(n),
-        #     test_door_to_image_time(n)
-        #     ]
-        # dump_to_database >> get_acquisition_state >> tests >> dump_tests(**config)
-        # # get_acquisition_state >> tests >> dump_tests(, **config)
-
-        globals()[n] = dag
+
+@task(show_return_value_in_logs=False)
+def move_case_images(case) -> dict:
+    def move(c):
+        images_1 = move_all_images.function(c.pop("instances"))
+        images_2 = move_all_series.function(failed_images.function(images_1))
+        return {"images": filter_images.function(flatten.function(
+                    [successful_images.function(images_1), successful_images.function(images_2)])),
+                "failed_images": failed_images.function(images_2)}
+    return run_stage(case, "move_images", move)
+
+
+@task(show_return_value_in_logs=False)
+def dump_case(case) -> dict:
+    def dump(c):
+        n = c["ssr_id"]
+        dump_results.function(n, c.pop("filtered_studies"), c.pop("filtered_series"),
+                              c.pop("failed_images"), c.pop("images"))
+        acquisition_state.function(
+            ssr_id=n, arrival_time_at_hospital=datetime.fromisoformat(c["arrival_time_at_hospital"]), **config)
+        sanitize_studies.function(ssr_id=n, **config)
+        dump_tests_all.function(**run_all_tests.function(ssr_id=n), **config)
+        return {}
+    return run_stage(case, "dump_results", dump)
+
+
+@task
+def finish_cases(cases):
+    """Mark the cases of the batch as done or failed (retried in a later run)."""
+    state_collection = case_state_collection()
+    now = datetime.utcnow()
+    nr_failed = 0
+    for case in cases:
+        state = "failed" if "error" in case else "done"
+        nr_failed += 1 if state == "failed" else 0
+        state_collection.update_one(
+            {"_id": case["ssr_id"]}, {"$set": {"state": state, "error": case.get("error", None), "updated_at": now}})
+    logging.info(f"Finished {len(cases)} cases, {nr_failed} failed.")
+
+
+# In per-patient mode, the studies of all cases of a patient are queried once (covering the time frames of all cases)
+# and assigned to the cases by their time frames. Per-case DAGs are replaced by one DAG per patient (named after its
+# first case) with a task group per case, the registry DAG queries the patients of each batch in one task.
+query_per_patient = config.get("PACS_QUERY_PER_PATIENT", "false").lower() == "true"
+
+# Run the stages after the downloads in a single task per case, see post_download.
+fused_post_download = config.get("PACS_FUSED_POST_DOWNLOAD", "false").lower() == "true"
+
+if config.get("PACS_DAG_MODE", "per_case").lower() == "registry":
+
+    # One DAG for the whole registry. Cases are loaded at runtime, i.e., parsing does not depend on the size of the
+    # registry. Each run processes a bounded batch of cases via dynamic task mapping, one task at a time (the C-MOVE
+    # Storage SCP listens in the task process, see pacs/storage.py).
+    with DAG(
+        dag_id="query_pacs_registry", tags=["query_pacs"],
+        default_args=args, schedule_interval=config.get("PACS_REGISTRY_SCHEDULE", "*/10 * * * *"),
+        catchup=False, max_active_tasks=1, max_active_runs=1
+    ) as dag:
+        cases = dump_case.expand(case=move_case_images.expand(case=query_case_instances.expand(
+            case=query_case.expand(case=query_patients(select_cases())))))
+        finish_cases(cases)
+
+else:
+
+    # cases are read from the local registry snapshot (see database/registry_snapshot.py), not from MongoDB
+    df = load_snapshot(**config)
+
+    # For performance reasons, only load around 500 cases at a time.
+    # More will increase the scheduling time between tasks.
+    # df = df.iloc[:500, :]
+
+    time_frames = get_time_frames(df)
+
+    patient_time_frames = {}
+    for n, (start_time_str, end_time_str) in time_frames.items():
+        patient_time_frames.setdefault(df.loc[n, "PatientID"], []).append((n, start_time_str, end_time_str))
+
+    # Iterate over cases, extract PatientID and time range to query for studies and define the DAGs
+    patient_dags, patient_studies = {}, {}
+    for n, patient_id, arrival_time_at_hospital in zip(df.index, df["PatientID"], df["arrival_time_at_hospital"]):
+
+        # Create DAG and allow at most one running task and run per time.
+        # This due to technical limitations of the PACS and since the C-MOVE Storage SCP listens in the task process,
+        # i.e., only one task per worker can receive images (see pacs/storage.py).
+        if query_per_patient and patient_id in patient_dags:
+            dag = patient_dags[patient_id]
+        else:
+            dag = DAG(
+                dag_id=f'query_pacs_for_{n}', tags=["query_pacs"],
+                default_args=args, schedule_interval="@once",
+                max_active_tasks=1, max_active_runs=1)
+            patient_dags[patient_id] = dag
+        with dag:
+
+            if n not in time_frames:
+                # in case an SSR entry is not available
+                continue
+            start_time_str, end_time_str = time_frames[n]
+
+            # -- Fast pipeline -- #
+
+            if query_per_patient and patient_id not in patient_studies:
+                patient_studies[patient_id] = query_patient(
+                    patient_id=patient_id, time_frames=patient_time_frames[patient_id])
+
+            with TaskGroup(group_id=f"case_{n}") if query_per_patient else nullcontext():
+                if query_per_patient:
+                    res = query_and_filter_series(studies=patient_studies[patient_id][str(n)])
+                else:
+                    res = query_and_filter_series(
+                        patient_id=patient_id, study_date=f"{start_time_str}-{end_time_str}")
+                filtered_studies, filtered_series = res["filtered_studies"], res["filtered_series"]
+                instances = query_all_instances.override(show_return_value_in_logs=False)(filtered_series)
+                images_1 = move_all_images.override(show_return_value_in_logs=False)(instances)
+                images_2 = move_all_series.override(show_return_value_in_logs=False)(failed_images(images_1))
+                if fused_post_download:
+                    post_download(n, arrival_time_at_hospital, filtered_studies, filtered_series, images_1, images_2)
+                else:
+                    images = filter_images.override(trigger_rule=TriggerRule.ALL_DONE) \
+                        (flatten([successful_images(images_1), successful_images(images_2)]))
+                    failed_i = failed_images.override(task_id="failed_images_final")(images_2)
+                    get_acquisition_state = \
+                        acquisition_state(ssr_id=n, arrival_time_at_hospital=arrival_time_at_hospital, **config)
+                    res_tests = dump_results(n, filtered_studies, filtered_series, failed_i, images) \
+                                >> get_acquisition_state \
+                                >> sanitize_studies(ssr_id=n, **config) \
+                                >> run_all_tests(ssr_id=n)
+                    dump_tests_all(res_tests["external_imaging"], res_tests["first_internal_imaging"],
+                                   res_tests["second_internal_imaging"], res_tests["door_to_image_time"], **config)
+
+            # -- Exhaustive pipeline -- #
+
+            # studies = query_study_level(
+            #     PatientID=patient_id, StudyDate=f"{start_time_str}-{end_time_str}", **config)
+            # filtered_studies = filter_studies(studies)
+            # series = query_series_level.expand(study_dataset=filtered_studies, **config)
+            # filtered_series = filter_series(flatten(series))
+            # instances = query_instance_level.override(retries=3).expand(series_dataset=filtered_series, **config)
+            # images_1 = move_image.expand(instance_dataset=instances, **config)
+            # images_2 = move_series.expand(series_dataset=failed_images(images_1))
+            # dump_to_database = [
+            #     images >> dump_images.override(trigger_rule=TriggerRule.ALL_SUCCESS)(ssr_id=n, **config),
+            #     filtered_studies >> dump_studies.override(trigger_rule=TriggerRule.ALL_SUCCESS)(ssr_id=n, **config),
+            #     failed_images.override(task_id="failed_images_final")(images_2) >> dump_failed(ssr_id=n, **config),
+            #     filtered_series >> dump_series.override(trigger_rule=TriggerRule.ALL_SUCCESS)(ssr_id=n, **config)
+            # ]
+            # tests = [
+            #     test_external_imaging(n),
+            #     test_first_internal_imaging(n),
+            #     test_second_internal_imaging(n),
+            #     test_door_to_image_time(n)
+            #     ]
+            # dump_to_database >> get_acquisition_state >> tests >> dump_tests(**config)
+            # # get_acquisition_state >> tests >> dump_tests(, **config)
+
+            globals()[dag.dag_id] = dag
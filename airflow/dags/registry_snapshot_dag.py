@@ -0,0 +1,23 @@
+from airflow.models import DAG
+from datetime import datetime
+
+from database.registry_snapshot import sync_registry_snapshot
+
+import os
+
+"""
+DAG refreshing the local registry snapshot, which is read by query_pacs_dags.py during parsing.
+"""
+
+config = {k: v for k, v in os.environ.items()}
+
+args = {
+    'owner': 'Airflow',
+    'start_date': datetime(2022, 6, 17)}
+
+with DAG(
+    dag_id="registry_snapshot_sync", tags=["query_pacs"],
+    default_args=args, schedule_interval=config.get("REGISTRY_SNAPSHOT_SCHEDULE", "*/15 * * * *"),
+    catchup=False, max_active_runs=1
+) as dag:
+    sync_registry_snapshot(**config)
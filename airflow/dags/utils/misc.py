@@ -1,17 +1,21 @@
-from pymongo import MongoClient
 from itertools import zip_longest
 from datetime import datetime, timedelta
-from typing import List, Tuple
+from typing import List, Tuple, Dict
 from more_itertools import partition
+from bisect import bisect_right
+from itertools import accumulate
 
 import numpy as np
 
+from database.mongo_client import mongo_client
+
+import os
 import re
 
 
 def mongo_get_collection(collection_name, user, password, url, port, db="PACS_DB"):
     """Get reference to MongoDB collection from the database db."""
-    mongo_db = MongoClient(f"mongodb://{user}:{password}@{url}:{port}")
+    mongo_db = mongo_client(f"mongodb://{user}:{password}@{url}:{port}", **os.environ)
     db = mongo_db[db]
     return db[collection_name]
 
@@ -33,6 +37,22 @@ def rearrange_datasets(datasets):
     return datasets + list(datasets_none)
 
 
+def middle_instance_number(total: int) -> int:
+    """InstanceNumber of the image selected by rearrange_datasets in a series of total images numbered from 1."""
+    return int(total / 2) + 1
+
+
+def select_middle_instance(instances: List[Tuple[int, str]]):
+    """
+    Select the (InstanceNumber, SOPInstanceUID) tuple from the middle of a series, same as rearrange_datasets. Tuples
+    without InstanceNumber are only selected if none has an InstanceNumber. Returns None for empty series.
+    """
+    numbered = sorted((i for i in instances if i[0] is not None), key=lambda i: i[0])
+    if len(numbered) != 0:
+        return numbered[int(len(numbered) / 2)]
+    return instances[0] if len(instances) != 0 else None
+
+
 def get_time_frame(arrival_time: datetime, dates: List[datetime]):
     """
     Get time frame for follow-up imaging based on the arrival_time at hospital and all visiting dates of a patient.
@@ -50,6 +70,45 @@ def get_time_frame(arrival_time: datetime, dates: List[datetime]):
             return start - delta_12h, end
 
 
+def get_time_frames(cases) -> Dict[str, Tuple[str, str]]:
+    """
+    Get time frames (start and end date as YYYYMMDD) for all cases, see get_time_frame. Cases is a DataFrame with
+    the columns PatientID and arrival_time_at_hospital, indexed by _SSRID. Cases without time frame are skipped.
+    """
+    res = {}
+    for _, df_patient in cases.groupby("PatientID"):
+        dates = df_patient["arrival_time_at_hospital"].sort_values()
+        for ssr_id, arrival_time in df_patient["arrival_time_at_hospital"].items():
+            try:
+                start_time, end_time = get_time_frame(arrival_time, dates)
+            except TypeError:
+                # in case an SSR entry is not available
+                continue
+            res[ssr_id] = (start_time.strftime("%Y%m%d"), end_time.strftime("%Y%m%d"))
+    return res
+
+
+def assign_to_time_frames(dates: List[str], time_frames: List[Tuple[str, str, str]]) -> List[List[str]]:
+    """
+    Assign each date (YYYYMMDD) to all cases whose time frame (ssr_id, start, end) contains it. Uses an interval
+    index sorted by start date, i.e., only time frames starting before the date are checked, and the search stops
+    as soon as no earlier time frame can reach the date anymore.
+    """
+    time_frames = sorted(time_frames, key=lambda t: t[1])
+    starts = [t[1] for t in time_frames]
+    max_ends = list(accumulate([t[2] for t in time_frames], max))
+    res = []
+    for date in dates:
+        ssr_ids = []
+        idx = bisect_right(starts, date) - 1
+        while idx >= 0 and max_ends[idx] >= date:
+            if time_frames[idx][2] >= date:
+                ssr_ids.append(time_frames[idx][0])
+            idx -= 1
+        res.append(ssr_ids)
+    return res
+
+
 def filter_examined_body_part(case_description=None) -> bool:
     """Filter examined body part based on a white- and blacklist of keywords."""
 
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Lock
+
+from airflow.models.xcom import BaseXCom
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import time
+
+"""
+XCom backend storing large values (e.g., lists of DICOM JSON strings) out-of-band as zstd (gzip if zstandard is not
+installed) compressed JSON blobs on a volume shared by all workers (XCOM_BLOB_DIR). Only a reference is stored in the
+metadata database. Values smaller than XCOM_OFFLOAD_THRESHOLD bytes are stored inline as usual. Blobs are removed
+after XCOM_BLOB_RETENTION_DAYS, independently of the XCom rows: reading the XCom of a purged blob (e.g., clearing
+a task of an old DAG run) logs a warning and returns None.
+
+Enable with AIRFLOW__CORE__XCOM_BACKEND=utils.xcom_backend.OffloadingXCom.
+"""
+
+REFERENCE_KEY = "__xcom_blob__"
+
+_last_purge = None
+_purge_lock = Lock()
+
+
+def blob_dir() -> Path:
+    return Path(os.environ.get("XCOM_BLOB_DIR", "/opt/airflow/xcom"))
+
+
+def _safe(name) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(name))
+
+
+def purge_blobs(retention_days=None):
+    """Remove blob directories of DAG runs older than retention_days. Runs at most once per hour and process."""
+    global _last_purge
+    retention_days = float(retention_days or os.environ.get("XCOM_BLOB_RETENTION_DAYS", 7))
+    with _purge_lock:
+        if _last_purge is not None and time.monotonic() - _last_purge < 3600:
+            return
+        _last_purge = time.monotonic()
+    threshold = (datetime.now() - timedelta(days=retention_days)).timestamp()
+    for run_dir in blob_dir().glob("*/*"):
+        if run_dir.is_dir() and run_dir.stat().st_mtime < threshold:
+            shutil.rmtree(run_dir, ignore_errors=True)
+            logging.info(f"Removed XCom blobs {run_dir}.")
+
+
+def write_blob(path, data):
+    """Write compressed data atomically, the suffix of path selects the compression."""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    if path.suffix == ".zst":
+        with open(tmp_path, "wb") as f:
+            f.write(zstandard.ZstdCompressor(level=3).compress(data))
+    else:
+        with gzip.open(tmp_path, "wb", compresslevel=3) as f:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_blob(path) -> bytes:
+    """Read a blob written by write_blob (or by previous versions, which used gzip only)."""
+    if str(path).endswith(".zst"):
+        with open(path, "rb") as f:
+            return zstandard.ZstdDecompressor().decompress(f.read())
+    with gzip.open(path, "rb") as f:
+        return f.read()
+
+
+class OffloadingXCom(BaseXCom):
+    """XCom backend offloading large values to compressed blobs on a shared volume."""
+
+    @staticmethod
+    def serialize_value(value, *, key=None, task_id=None, dag_id=None, run_id=None, map_index=None):
+        data = json.dumps(value).encode("UTF-8")
+        if len(data) < int(os.environ.get("XCOM_OFFLOAD_THRESHOLD", 64 * 1024)):
+            return BaseXCom.serialize_value(value)
+        path = blob_dir() / _safe(dag_id) / _safe(run_id) / \
+            f"{_safe(task_id)}.{map_index if map_index is not None else -1}.{_safe(key)}." \
+            f"{'json.zst' if zstandard is not None else 'json.gz'}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_blob(path, data)
+        purge_blobs()
+        return BaseXCom.serialize_value({REFERENCE_KEY: str(path), "size": len(data)})
+
+    @staticmethod
+    def deserialize_value(result):
+        value = BaseXCom.deserialize_value(result)
+        if isinstance(value, dict) and REFERENCE_KEY in value:
+            try:
+                data = read_blob(value[REFERENCE_KEY])
+            except FileNotFoundError:
+                logging.warning(f"XCom blob {value[REFERENCE_KEY]} not found (purged after "
+                                f"XCOM_BLOB_RETENTION_DAYS?), returning None.")
+                return None
+            return json.loads(data.decode("UTF-8"))
+        return value
+
+    def orm_deserialize_value(self):
+        """Show the reference instead of loading the blob in the web interface."""
+        return BaseXCom.deserialize_value(self)
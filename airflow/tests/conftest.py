@@ -0,0 +1,6 @@
+from pathlib import Path
+
+import sys
+
+# the DAG modules import each other relative to the dags folder (same as in the Airflow workers)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "dags"))
@@ -0,0 +1,63 @@
+import pytest
+
+bson = pytest.importorskip("bson")
+pymongo_errors = pytest.importorskip("pymongo.errors")
+
+from database.bulk_writer import BulkWriter
+
+
+class InsertManyResult:
+
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+
+
+class FakeCollection:
+    """Collection rejecting documents with an "invalid" key, like BSON encoding of unsupported types."""
+
+    name = "fake"
+
+    def __init__(self):
+        self.docs = {}
+        self.insert_many_calls = 0
+
+    def insert_many(self, docs, ordered=True):
+        self.insert_many_calls += 1
+        for i, doc in enumerate(docs):
+            doc.setdefault("_id", f"{self.insert_many_calls}.{i}")
+        for doc in docs:
+            if "invalid" in doc:
+                raise bson.InvalidDocument("cannot encode object")
+            self.docs[doc["_id"]] = doc
+        return InsertManyResult([doc["_id"] for doc in docs])
+
+    def insert_one(self, doc):
+        if "invalid" in doc:
+            raise bson.InvalidDocument("cannot encode object")
+        if doc.get("_id", None) in self.docs:
+            raise pymongo_errors.DuplicateKeyError("duplicate key")
+        self.docs[doc["_id"]] = doc
+
+
+def test_batches():
+    collection = FakeCollection()
+    with BulkWriter(collection, batch_size=2) as writer:
+        for i in range(5):
+            writer.insert({"SOPInstanceUID": str(i)})
+    writer.check()
+    assert collection.insert_many_calls == 3
+    assert writer.inserted == 5
+
+
+def test_invalid_document_falls_back_to_single_inserts():
+    collection = FakeCollection()
+    with BulkWriter(collection, batch_size=10) as writer:
+        writer.insert({"SOPInstanceUID": "1"})
+        writer.insert({"SOPInstanceUID": "2", "invalid": object()})
+        writer.insert({"SOPInstanceUID": "3"})
+    # the document inserted before the failing one is not inserted twice
+    assert sorted(doc["SOPInstanceUID"] for doc in collection.docs.values()) == ["1", "3"]
+    assert writer.inserted == 2
+    assert [e["document"] for e in writer.errors] == ["SOPInstanceUID=2"]
+    with pytest.raises(RuntimeError):
+        writer.check()
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("pymongo")
+pydicom = pytest.importorskip("pydicom")
+
+from pacs import cache
+from pacs.cache import cached_find, is_cacheable, normalise_query, query_key
+
+
+def query(level, study_date=None):
+    ds = pydicom.Dataset()
+    ds.QueryRetrieveLevel = level
+    ds.PatientID = "123"
+    if study_date is not None:
+        ds.StudyDate = study_date
+    return ds
+
+
+def test_closed_past_ranges_are_cacheable():
+    assert is_cacheable(query("STUDY", "20200101-20200131"))
+    assert is_cacheable(query("STUDY", "20200101"))
+    assert is_cacheable(query("STUDY", "-20200131"))
+
+
+def test_open_or_current_ranges_are_not_cacheable():
+    today = datetime.now().strftime("%Y%m%d")
+    tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y%m%d")
+    assert not is_cacheable(query("STUDY", "20200101-"))
+    assert not is_cacheable(query("STUDY", f"20200101-{today}"))
+    assert not is_cacheable(query("STUDY", f"20200101-{tomorrow}"))
+
+
+def test_study_queries_without_range_are_not_cacheable():
+    assert not is_cacheable(query("STUDY"))
+    assert not is_cacheable(query("STUDY", ""))
+    assert is_cacheable(query("SERIES"))
+    assert is_cacheable(query("IMAGE", ""))
+
+
+def test_query_key_is_order_independent():
+    a, b = pydicom.Dataset(), pydicom.Dataset()
+    a.QueryRetrieveLevel, a.PatientID, a.StudyDate = "STUDY", "123", ""
+    b.StudyDate, b.PatientID, b.QueryRetrieveLevel = None, "123", "STUDY"
+    assert query_key(normalise_query(a, "model")) == query_key(normalise_query(b, "model"))
+    assert query_key(normalise_query(a, "model")) != query_key(normalise_query(a, "other model"))
+
+
+def test_failed_queries_are_not_cached(monkeypatch):
+    cached = []
+    monkeypatch.setattr(cache, "get_cached", lambda *args, **kwargs: None)
+    monkeypatch.setattr(cache, "set_cached", lambda query_dataset, query_model, responses, **kwargs:
+                        cached.append(responses))
+    assert cached_find(query("SERIES"), "model", lambda: None) is None
+    assert cached == []
+    assert cached_find(query("SERIES"), "model", lambda: ["series"]) == ["series"]
+    assert cached == [["series"]]
@@ -0,0 +1,128 @@
+import pytest
+
+pytest.importorskip("pynetdicom")
+
+from pacs import client
+from pacs.client import AssociationPool
+
+
+class FakeAssociation:
+
+    def __init__(self, established=True):
+        self.is_established = established
+        self.released = False
+        self.aborted = False
+
+    def release(self):
+        self.is_established = False
+        self.released = True
+
+    def abort(self):
+        self.is_established = False
+        self.aborted = True
+
+
+class FakeAE:
+
+    def __init__(self):
+        self.associations = []
+        self.established = True
+
+    def associate(self, *args, **kwargs):
+        assoc = FakeAssociation(self.established)
+        self.associations.append(assoc)
+        return assoc
+
+
+class FakeLimiter:
+
+    def __init__(self):
+        self.acquired = 0
+        self.records = []
+
+    def acquire(self):
+        self.acquired += 1
+
+    def record(self, operation, latency, failed=False, pending=0, suboperations=None, level=None):
+        self.records.append((operation, failed))
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(client, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def pool(clock):
+    pool = AssociationPool("LOCAL", "127.0.0.1", 11112, "PACS", max_size=2, idle_timeout=30,
+                           max_concurrency=2, limiter=FakeLimiter())
+    pool.ae = FakeAE()
+    return pool
+
+
+def test_associations_are_reused(pool):
+    for _ in range(3):
+        with pool.association() as assoc:
+            assert assoc.is_established
+    assert pool.nr_of_associations == 1
+    assert pool.limiter.acquired == 3
+    assert pool.limiter.records == [("C-FIND", False)] * 3
+
+
+def test_idle_associations_are_released(pool, clock):
+    with pool.association() as first:
+        pass
+    clock.now += 31
+    with pool.association() as second:
+        pass
+    assert first is not second
+    assert first.released
+    assert pool.nr_of_associations == 2
+
+
+def test_dead_associations_are_replaced(pool):
+    with pool.association() as first:
+        pass
+    # aborted by the PACS while idle
+    first.is_established = False
+    with pool.association() as second:
+        assert second.is_established
+    assert first is not second
+
+
+def test_failing_block_aborts_association(pool):
+    with pytest.raises(ValueError):
+        with pool.association("C-MOVE") as assoc:
+            raise ValueError()
+    assert assoc.aborted
+    assert pool._idle == []
+    assert pool.limiter.records == [("C-MOVE", True)]
+
+
+def test_rejected_association_is_recorded_as_failure(pool):
+    pool.ae.established = False
+    with pool.association() as assoc:
+        assert not assoc.is_established
+    assert pool._idle == []
+    assert pool.limiter.records == [("C-FIND", True)]
+
+
+def test_full_pool_releases_surplus_associations(pool):
+    associations = [pool.acquire() for _ in range(3)]
+    for assoc in associations:
+        pool.put_back(assoc)
+    assert len(pool._idle) == 2
+    assert associations[2].released
+    pool.close()
+    assert all(assoc.released for assoc in associations)
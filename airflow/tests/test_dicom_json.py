@@ -0,0 +1,70 @@
+from pathlib import Path
+
+import importlib.util
+import json
+
+import pytest
+
+pydicom = pytest.importorskip("pydicom")
+
+from database.dicom_json import to_mongo_dict
+
+
+@pytest.fixture
+def dataset():
+    ds = pydicom.Dataset()
+    ds.PatientName = "Doe^John"
+    ds.PatientID = "123"
+    ds.StudyDescription = ""
+    ds.ImageType = ["ORIGINAL", "PRIMARY"]
+    ds.SliceThickness = "1.5"
+    ds.WindowCenter = ["40", "400"]
+    ds.InstanceNumber = "7"
+    ds.Rows = 512
+    item = pydicom.Dataset()
+    item.SeriesInstanceUID = "1.2.3"
+    ds.ReferencedSeriesSequence = [item]
+    ds.ReferencedImageSequence = []
+    ds.FrameIncrementPointer = 0x0020000E
+    ds.add_new(0x00091001, "LO", "private")
+    ds.private_block(0x0019, "GEMS_ACQU_01", create=True).add_new(0x02, "SL", 5)
+    ds.private_block(0x0019, "GEMS_ACQU_01").add_new(0x0F, "DS", "1.5")
+    ds.add_new(0x00420011, "OB", b"\x00\x01")
+    return ds
+
+
+def test_to_mongo_dict(dataset):
+    doc = to_mongo_dict(dataset.to_json_dict())
+    assert doc == {
+        "PatientName": "Doe^John",
+        "PatientID": "123",
+        "StudyDescription": "",
+        "ImageType": ["ORIGINAL", "PRIMARY"],
+        "SliceThickness": 1.5,
+        "WindowCenter": [40.0, 400.0],
+        "InstanceNumber": 7,
+        "Rows": 512,
+        "FrameIncrementPointer": "(0020, 000e)",
+        "DetectorChannel": 5,
+        "HorizFrameOfRef": 1.5,
+        "ReferencedSeriesSequence": [{"SeriesInstanceUID": "1.2.3"}],
+        "ReferencedImageSequence": []}
+
+
+def test_json_string_and_dict_are_equivalent(dataset):
+    assert to_mongo_dict(dataset.to_json()) == to_mongo_dict(json.loads(dataset.to_json()))
+
+
+def test_same_as_reference_implementation():
+    pytest.importorskip("dicom_parser")
+    from pydicom.data import get_testdata_files
+
+    path = Path(__file__).resolve().parent.parent / "benchmark" / "bench_dicom_json.py"
+    spec = importlib.util.spec_from_file_location("bench_dicom_json", path)
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+
+    headers = bench.load_headers(get_testdata_files("*.dcm"))
+    assert len(headers) > 0
+    for ds in headers:
+        assert to_mongo_dict(ds) == bench.reference_to_mongo_dict(ds)
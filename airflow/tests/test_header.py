@@ -0,0 +1,60 @@
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip("pynetdicom")
+
+from pydicom import Dataset
+from pydicom.uid import ImplicitVRLittleEndian, ExplicitVRLittleEndian, DeflatedExplicitVRLittleEndian, \
+    CTImageStorage
+from pynetdicom import evt
+from pynetdicom.dimse_primitives import C_STORE
+from pynetdicom.dsutils import encode
+from pynetdicom.events import Event
+from pynetdicom.presentation import build_context
+
+from pacs.header import read_header
+
+
+def store_event(ds, transfer_syntax):
+    """C-STORE event as created by pynetdicom for a received dataset."""
+    request = C_STORE()
+    request.DataSet = BytesIO(encode(
+        ds, transfer_syntax.is_implicit_VR, transfer_syntax.is_little_endian,
+        transfer_syntax == DeflatedExplicitVRLittleEndian))
+    context = build_context(CTImageStorage, transfer_syntax)
+    context.context_id = 1
+    return Event(None, evt.EVT_C_STORE, {"request": request, "context": context.as_tuple})
+
+
+@pytest.fixture
+def dataset():
+    ds = Dataset()
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = "1.2.3.4"
+    ds.SeriesInstanceUID = "1.2.3"
+    ds.PatientName = "Doe^John"
+    ds.InstanceNumber = 7
+    ds.Rows = 2
+    ds.Columns = 2
+    ds.BitsAllocated = 16
+    ds.add_new(0x7FE00010, "OW", b"\x00\x01" * 4)
+    ds.add_new(0x7FE10010, "LO", "after pixel data")
+    return ds
+
+
+@pytest.mark.parametrize("transfer_syntax", [
+    ImplicitVRLittleEndian, ExplicitVRLittleEndian, DeflatedExplicitVRLittleEndian])
+def test_read_header(dataset, transfer_syntax):
+    header = read_header(store_event(dataset, transfer_syntax))
+    assert header.SOPInstanceUID == "1.2.3.4"
+    assert header.PatientName == "Doe^John"
+    assert header.InstanceNumber == 7
+    assert "PixelData" not in header
+    assert 0x7FE10010 not in header
+    assert header.is_implicit_VR == transfer_syntax.is_implicit_VR
+
+
+def test_header_decoded_once_per_event(dataset):
+    event = store_event(dataset, ExplicitVRLittleEndian)
+    assert read_header(event) is read_header(event)
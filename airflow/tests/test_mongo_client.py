@@ -0,0 +1,67 @@
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+from database import mongo_client
+
+
+class FakeMongoClient:
+
+    created = 0
+
+    def __init__(self, connection_string, **options):
+        FakeMongoClient.created += 1
+        # widen the race window between the check and the insert
+        time.sleep(0.01)
+        self.connection_string = connection_string
+        self.options = options
+
+
+@pytest.fixture(autouse=True)
+def fake_client(monkeypatch):
+    monkeypatch.setattr(mongo_client, "MongoClient", FakeMongoClient)
+    FakeMongoClient.created = 0
+    mongo_client._clients.clear()
+    yield
+    mongo_client._clients.clear()
+
+
+def test_one_client_per_connection_string():
+    a = mongo_client.mongo_client("mongodb://a")
+    assert mongo_client.mongo_client("mongodb://a") is a
+    assert mongo_client.mongo_client("mongodb://b") is not a
+    assert FakeMongoClient.created == 2
+
+
+def test_concurrent_first_use_creates_one_client():
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(mongo_client.mongo_client("mongodb://a")))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert FakeMongoClient.created == 1
+    assert all(c is clients[0] for c in clients)
+
+
+def test_options():
+    options = mongo_client.mongo_client_options(
+        MONGODB_MAX_POOL_SIZE="10", MONGODB_MIN_POOL_SIZE="1", MONGODB_COMPRESSORS="unknown, zlib")
+    assert options == {"maxPoolSize": 10, "minPoolSize": 1, "compressors": "zlib"}
+    assert "compressors" not in mongo_client.mongo_client_options(MONGODB_COMPRESSORS="unknown")
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_clients_are_reset_after_fork():
+    mongo_client.mongo_client("mongodb://a")
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if len(mongo_client._clients) == 0 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert len(mongo_client._clients) == 1
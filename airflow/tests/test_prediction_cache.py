@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("pymongo")
+pytest.importorskip("requests")
+pytest.importorskip("numpy")
+pytest.importorskip("more_itertools")
+
+from database import prediction_cache
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prediction_cache, "time", clock)
+    prediction_cache._cache.clear()
+    for k in prediction_cache._counters:
+        prediction_cache._counters[k] = 0
+    return clock
+
+
+def test_values_share_normalised_entries(clock):
+    prediction_cache.set_cached("MR", "SeriesDescription", {"T1_Axial": "T1"}, 3, SEQUENCE_CACHE_SIZE=10)
+    assert prediction_cache.get_cached("MR", "SeriesDescription", ["t1 axial", "dwi"], 3, SEQUENCE_CACHE_SIZE=10) \
+        == {"t1 axial": "T1"}
+    # other model version
+    assert prediction_cache.get_cached("MR", "SeriesDescription", ["t1 axial"], 4, SEQUENCE_CACHE_SIZE=10) == {}
+
+
+def test_entries_expire(clock):
+    kwargs = {"SEQUENCE_CACHE_SIZE": 10, "SEQUENCE_CACHE_TTL": 60}
+    prediction_cache.set_cached("MR", "SeriesDescription", {"dwi": "DWI"}, 1, **kwargs)
+    clock.now += 59
+    assert prediction_cache.get_cached("MR", "SeriesDescription", ["dwi"], 1, **kwargs) == {"dwi": "DWI"}
+    clock.now += 2
+    assert prediction_cache.get_cached("MR", "SeriesDescription", ["dwi"], 1, **kwargs) == {}
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    kwargs = {"SEQUENCE_CACHE_SIZE": 2}
+    prediction_cache.set_cached("CT", "SeriesDescription", {"a": "A", "b": "B"}, 1, **kwargs)
+    prediction_cache.get_cached("CT", "SeriesDescription", ["a"], 1, **kwargs)
+    prediction_cache.set_cached("CT", "SeriesDescription", {"c": "C"}, 1, **kwargs)
+    assert prediction_cache.get_cached("CT", "SeriesDescription", ["a", "b", "c"], 1, **kwargs) == \
+        {"a": "A", "c": "C"}
+
+
+def test_disabled_cache(clock):
+    prediction_cache.set_cached("CT", "SeriesDescription", {"a": "A"}, 1, SEQUENCE_CACHE_SIZE=0)
+    assert prediction_cache.get_cached("CT", "SeriesDescription", ["a"], 1, SEQUENCE_CACHE_SIZE=0) == {}
+    assert prediction_cache.cache_stats()["hit_rate"] == 0.0
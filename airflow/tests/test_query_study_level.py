@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("airflow.decorators")
+pytest.importorskip("pynetdicom")
+
+from pacs.query_study_level import MAX_WINDOW_DAYS, needs_split, next_window_size, split_date_range
+
+
+def test_split_date_range():
+    windows = split_date_range(datetime(2022, 1, 1), datetime(2022, 1, 10), 4)
+    assert [(s.day, e.day) for s, e in windows] == [(1, 4), (5, 8), (9, 10)]
+    assert split_date_range(datetime(2022, 1, 1), datetime(2022, 1, 1), 30) == \
+        [(datetime(2022, 1, 1), datetime(2022, 1, 1))]
+
+
+def test_split_on_possibly_truncated_responses():
+    assert needs_split(500, None, 10, max_responses=500, max_latency=30, min_window_days=7)
+    assert needs_split(500, 1.0, 2, max_responses=500, max_latency=30, min_window_days=7)
+    # a single day cannot be split any further
+    assert not needs_split(500, 1.0, 1, max_responses=500, max_latency=30, min_window_days=7)
+
+
+def test_split_slow_windows_with_many_studies_only():
+    assert needs_split(100, 60.0, 30, max_responses=500, max_latency=30, min_window_days=7)
+    # few studies: the PACS is slow, not the query
+    assert not needs_split(3, 60.0, 30, max_responses=500, max_latency=30, min_window_days=7)
+    # cached responses carry no latency
+    assert not needs_split(100, None, 30, max_responses=500, max_latency=30, min_window_days=7)
+    # minimum window reached
+    assert not needs_split(100, 60.0, 7, max_responses=500, max_latency=30, min_window_days=7)
+
+
+def test_window_shrinks_at_most_by_half():
+    assert next_window_size(100, [2, 3], split=True, nr_of_studies=900, max_responses=500) == 50
+    assert next_window_size(100, [60, 40], split=True, nr_of_studies=900, max_responses=500) == 60
+
+
+def test_window_grows_for_small_results():
+    assert next_window_size(100, [100], split=False, nr_of_studies=10, max_responses=500) == 200
+    assert next_window_size(300, [300], split=False, nr_of_studies=10, max_responses=500) == MAX_WINDOW_DAYS
+    assert next_window_size(MAX_WINDOW_DAYS, [MAX_WINDOW_DAYS], split=False, nr_of_studies=10,
+                            max_responses=500) is None
+    assert next_window_size(100, [100], split=False, nr_of_studies=300, max_responses=500) is None
+
+
+def test_slow_single_day_is_not_split():
+    for min_window_days in [1, 0, -3]:
+        assert not needs_split(100, 60.0, 1, max_responses=500, max_latency=30, min_window_days=min_window_days)
+    assert needs_split(100, 60.0, 2, max_responses=500, max_latency=30, min_window_days=0)
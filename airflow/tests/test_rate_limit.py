@@ -0,0 +1,140 @@
+import json
+
+import pytest
+
+from pacs.rate_limit import AdaptiveRateLimiter, Outcome
+
+
+class FakeSharedState:
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.saved = []
+
+    def load(self):
+        return None if self.rate is None else {"rate": self.rate}
+
+    def save(self, rate):
+        self.saved.append(rate)
+        self.rate = rate
+
+
+def test_increase_on_fast_responses():
+    limiter = AdaptiveRateLimiter(rate=1.0, increase=0.1)
+    for _ in range(5):
+        limiter.record("C-FIND", 0.1)
+    assert limiter.rate == pytest.approx(1.5)
+
+
+def test_rate_bounded_by_floor_and_ceiling():
+    limiter = AdaptiveRateLimiter(floor=0.5, ceiling=1.2, rate=1.0)
+    for _ in range(10):
+        limiter.record("C-FIND", 0.1)
+    assert limiter.rate == 1.2
+    for _ in range(10):
+        limiter.record("C-FIND", 0.1, failed=True)
+    assert limiter.rate == 0.5
+
+
+def test_decrease_on_slow_responses():
+    limiter = AdaptiveRateLimiter(rate=2.0, alpha=1.0, slowdown=2.0, decrease=0.5)
+    limiter.record("C-FIND", 0.1)
+    rate = limiter.rate
+    limiter.record("C-FIND", 1.0)
+    assert limiter.rate < rate
+    assert limiter.state()["slow"] == 1
+
+
+def test_retrievals_normalised_per_suboperation():
+    limiter = AdaptiveRateLimiter(rate=2.0, alpha=1.0)
+    limiter.record("C-MOVE", 1.0, suboperations=10)
+    rate = limiter.rate
+    # a large series takes longer, but not per image
+    limiter.record("C-MOVE", 100.0, suboperations=1000)
+    assert limiter.rate > rate
+    assert limiter.state()["latency"]["C-MOVE"]["ewma"] == pytest.approx(0.1)
+
+
+def test_retrievals_without_suboperations_skip_latency():
+    limiter = AdaptiveRateLimiter(rate=2.0)
+    limiter.record("C-MOVE", 100.0)
+    assert "C-MOVE" not in limiter.state()["latency"]
+    assert limiter.state()["failures"] == 0
+
+
+def test_retrieval_stuck_on_pending_is_failure():
+    limiter = AdaptiveRateLimiter(rate=2.0, decrease=0.5)
+    limiter.record("C-MOVE", 5.0, pending=3)
+    assert limiter.rate == 1.0
+    assert limiter.state()["failures"] == 1
+    assert limiter.state()["pending"] == 3
+
+
+def test_outcome_statuses():
+    outcome = Outcome()
+    outcome.status({"Status": 0xFF00, "NumberOfCompletedSuboperations": 2})
+    outcome.status({"Status": 0xFF00, "NumberOfCompletedSuboperations": 5, "NumberOfFailedSuboperations": 1})
+    outcome.status({"Status": 0x0000})
+    assert (outcome.pending, outcome.suboperations, outcome.failed) == (2, 6, False)
+
+    for status in [{"Status": 0xA700}, {"Status": 0xC000}, {}, None]:
+        outcome = Outcome()
+        outcome.status(status)
+        assert outcome.failed
+
+    for status in [{"Status": 0xFE00}, {"Status": 0xB000}]:
+        outcome = Outcome()
+        outcome.status(status)
+        assert not outcome.failed
+
+
+def test_state_file_written_atomically_and_throttled(tmp_path):
+    state_file = tmp_path / "state.json"
+    limiter = AdaptiveRateLimiter(rate=1.0, state_file=str(state_file), sync_interval=3600)
+    limiter.record("C-FIND", 0.1)
+    assert json.loads(state_file.read_text())["requests"] == 1
+    limiter.record("C-FIND", 0.1)
+    assert json.loads(state_file.read_text())["requests"] == 1
+    limiter.sync(force=True)
+    assert json.loads(state_file.read_text())["requests"] == 2
+    assert [p.name for p in tmp_path.iterdir()] == ["state.json"]
+
+
+def test_shared_state():
+    shared = FakeSharedState(rate=3.0)
+    limiter = AdaptiveRateLimiter(rate=1.0, shared_state=shared, sync_interval=0)
+    assert limiter.rate == 3.0
+
+    # another process decreased the shared rate
+    shared.rate = 0.5
+    limiter.record("C-FIND", 0.1, failed=False)
+    assert limiter.rate == 0.5
+    assert shared.saved[-1] == 0.5
+
+
+def test_fast_outlier_does_not_pin_the_rate():
+    limiter = AdaptiveRateLimiter(rate=1.0, floor=0.2, increase=0.1)
+    limiter.record("C-FIND", 0.001)
+    for _ in range(200):
+        limiter.record("C-FIND", 0.2)
+    # the baseline caught up with the steady latency, the rate recovered from the outlier
+    assert limiter.state()["latency"]["C-FIND"]["baseline"] == pytest.approx(0.2, rel=0.05)
+    assert limiter.rate == limiter.ceiling
+
+
+def test_latency_spread_rarely_slow():
+    limiter = AdaptiveRateLimiter(rate=1.0)
+    for i in range(500):
+        limiter.record("C-FIND", 0.05 + 0.25 * ((i * 7) % 11) / 10)
+    assert limiter.state()["slow"] < 25
+
+
+def test_latency_tracked_per_level():
+    limiter = AdaptiveRateLimiter(rate=2.0, alpha=1.0)
+    limiter.record("C-FIND", 0.05, level="SERIES")
+    rate = limiter.rate
+    # a study query is slower than a series query, but not slower than other study queries
+    limiter.record("C-FIND", 2.0, level="STUDY")
+    assert limiter.rate > rate
+    assert limiter.state()["slow"] == 0
+    assert set(limiter.state()["latency"]) == {"C-FIND SERIES", "C-FIND STUDY"}
@@ -0,0 +1,100 @@
+import pytest
+
+pytest.importorskip("pynetdicom")
+
+from pacs import retrieve
+from pacs.retrieve import CANCEL_GRACE, Retrieval
+
+
+class FakeAssociation:
+
+    def __init__(self):
+        self.is_established = True
+        self.cancelled = []
+        self.aborted = False
+
+    def send_c_cancel(self, msg_id, query_model=None):
+        self.cancelled.append(msg_id)
+
+    def abort(self):
+        self.aborted = True
+        self.is_established = False
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retrieve, "time", clock)
+    return clock
+
+
+def retrieval(deadline=None, stall_timeout=None, responses=()):
+    res = Retrieval(7, "model", deadline=deadline, stall_timeout=stall_timeout)
+    res.assoc = FakeAssociation()
+    res._responses = iter(responses)
+    return res
+
+
+def test_progress_resets_stall_timeout(clock):
+    res = retrieval(stall_timeout=60)
+    clock.now += 50
+    res.progress(100)
+    clock.now += 50
+    res.check()
+    assert res.timed_out is None
+    assert res.assoc.cancelled == []
+    assert res.result()["received"] == 1
+
+
+def test_completed_suboperations_count_as_progress(clock):
+    res = retrieval(stall_timeout=60, responses=[({"Status": 0xFF00, "NumberOfCompletedSuboperations": 3,
+                                                   "NumberOfRemainingSuboperations": 2}, None)])
+    clock.now += 50
+    list(res.responses)
+    clock.now += 50
+    res.check()
+    assert res.timed_out is None
+    assert (res.completed, res.remaining) == (3, 2)
+
+
+def test_stalled_retrieval_is_cancelled_then_aborted(clock):
+    res = retrieval(stall_timeout=60)
+    clock.now += 61
+    res.check()
+    assert res.timed_out == "stalled"
+    assert res.assoc.cancelled == [7]
+    assert res.outcome.failed
+    # the cancel is sent once
+    res.check()
+    assert res.assoc.cancelled == [7]
+    assert not res.assoc.aborted
+    clock.now += CANCEL_GRACE + 1
+    res.check()
+    assert res.assoc.aborted
+
+
+def test_deadline(clock):
+    res = retrieval(deadline=300, stall_timeout=60)
+    for _ in range(10):
+        clock.now += 31
+        res.progress(100)
+        res.check()
+    assert res.timed_out == "deadline"
+    assert res.result()["received"] == 10
+
+
+def test_disabled_timeouts(clock):
+    res = retrieval()
+    clock.now += 10 ** 6
+    res.check()
+    assert res.timed_out is None
+    assert retrieve._timeout("PACS_RETRIEVE_DEADLINE", 300, PACS_RETRIEVE_DEADLINE="0") is None
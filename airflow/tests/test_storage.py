@@ -0,0 +1,63 @@
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip("pynetdicom")
+
+from pydicom import Dataset
+from pydicom.uid import ImplicitVRLittleEndian, ExplicitVRLittleEndian, CTImageStorage
+from pynetdicom import evt
+from pynetdicom.dimse_primitives import C_STORE
+from pynetdicom.dsutils import encode
+from pynetdicom.events import Event
+from pynetdicom.presentation import build_context
+
+from pacs.storage import StorageSCP
+
+
+def store_event(series_uid, sop_instance_uid, message_id=None):
+    """C-STORE event as created by pynetdicom for an image received via C-MOVE."""
+    ds = Dataset()
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = sop_instance_uid
+    ds.SeriesInstanceUID = series_uid
+    request = C_STORE()
+    request.DataSet = BytesIO(encode(ds, True, True))
+    if message_id is not None:
+        request.MoveOriginatorMessageID = message_id
+    context = build_context(CTImageStorage, ImplicitVRLittleEndian)
+    context.context_id = 1
+    return Event(None, evt.EVT_C_STORE, {"request": request, "context": context.as_tuple})
+
+
+@pytest.fixture
+def scp():
+    # port 0: any free port
+    scp = StorageSCP("LOCAL", 0, [ExplicitVRLittleEndian, ImplicitVRLittleEndian])
+    yield scp
+    scp.shutdown()
+
+
+def test_route_by_message_id(scp):
+    received = []
+    with scp.route(lambda event, name: received.append(name) or 0x0000, 1, ("first",), SeriesInstanceUID="1.2"), \
+            scp.route(lambda event, name: received.append(name) or 0x0000, 2, ("second",), SeriesInstanceUID="1.2"):
+        assert scp._handle_store(store_event("1.2", "1.2.1", message_id=2)) == 0x0000
+        assert scp._handle_store(store_event("1.2", "1.2.2", message_id=1)) == 0x0000
+    assert received == ["second", "first"]
+
+
+def test_route_by_uids_without_message_id(scp):
+    received = []
+    with scp.route(lambda event: received.append("series") or 0x0000, 1, SeriesInstanceUID="1.2"), \
+            scp.route(lambda event: received.append("instance") or 0x0000, 2, SOPInstanceUID="1.3.1"):
+        scp._handle_store(store_event("1.3", "1.3.1"))
+        scp._handle_store(store_event("1.2", "1.2.1"))
+    assert received == ["instance", "series"]
+
+
+def test_unexpected_images_are_rejected(scp):
+    with scp.route(lambda event: 0x0000, 1, SeriesInstanceUID="1.2"):
+        assert scp._handle_store(store_event("1.3", "1.3.1")) == 0xC000
+    # routes are removed after the with-block
+    assert scp._handle_store(store_event("1.2", "1.2.1", message_id=1)) == 0xC000
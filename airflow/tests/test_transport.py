@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+
+import pytest
+
+pydicom = pytest.importorskip("pydicom")
+pytest.importorskip("pynetdicom")
+
+from pacs import transport
+from pacs.rate_limit import Outcome
+
+
+class FakeAssociation:
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.is_established = True
+
+    def send_c_find(self, query_dataset, query_model):
+        for code, identifier in self.responses:
+            status = pydicom.Dataset()
+            if code is not None:
+                status.Status = code
+            yield status, identifier
+
+
+class FakePool:
+
+    def __init__(self, responses):
+        self.assoc = FakeAssociation(responses)
+
+    @contextmanager
+    def association(self, operation, outcome):
+        yield self.assoc
+
+
+def study(uid):
+    ds = pydicom.Dataset()
+    ds.StudyInstanceUID = uid
+    return ds
+
+
+def find(monkeypatch, responses):
+    monkeypatch.setattr(transport, "pacs_client", lambda **kwargs: FakePool(responses))
+    query_dataset = pydicom.Dataset()
+    query_dataset.QueryRetrieveLevel = "STUDY"
+    outcome = Outcome()
+    return transport.find(query_dataset, "model", lambda ds: ds.StudyInstanceUID, outcome=outcome), outcome
+
+
+def test_find_returns_responses_on_success(monkeypatch):
+    res, outcome = find(monkeypatch, [(0xFF00, study("1")), (0xFF00, study("2")), (0x0000, None)])
+    assert res == ["1", "2"]
+    assert outcome.level == "STUDY"
+
+
+@pytest.mark.parametrize("final", [0xA700, 0xC000, 0xFE00, None])
+def test_find_discards_partial_responses(monkeypatch, final):
+    res, outcome = find(monkeypatch, [(0xFF00, study("1")), (final, None)])
+    assert res is None
+
+
+def test_find_discards_responses_of_aborted_association(monkeypatch):
+    # pynetdicom yields an empty status if the association is aborted while the responses stream in
+    res, outcome = find(monkeypatch, [(0xFF00, study("1")), (None, None)])
+    assert res is None
+    assert outcome.failed
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip("airflow.models.xcom")
+
+from utils import xcom_backend
+from utils.xcom_backend import OffloadingXCom, REFERENCE_KEY, purge_blobs
+
+
+@pytest.fixture(autouse=True)
+def blob_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("XCOM_BLOB_DIR", str(tmp_path))
+    monkeypatch.setenv("XCOM_OFFLOAD_THRESHOLD", "100")
+    monkeypatch.setattr(xcom_backend, "_last_purge", None)
+    return tmp_path
+
+
+def serialize(value, **kwargs):
+    return OffloadingXCom.serialize_value(
+        value, key="return_value", task_id="query_case", dag_id="query_pacs", run_id="manual__2022-10-01", **kwargs)
+
+
+def deserialize(result):
+    return OffloadingXCom.deserialize_value(SimpleNamespace(value=result))
+
+
+def reference(result):
+    return xcom_backend.BaseXCom.deserialize_value(SimpleNamespace(value=result))
+
+
+def test_small_values_are_stored_inline(blob_dir):
+    result = serialize({"PatientID": "123"})
+    assert deserialize(result) == {"PatientID": "123"}
+    assert list(blob_dir.rglob("*.json.*")) == []
+
+
+@pytest.mark.parametrize("compressor", ["zstd", "gzip"])
+def test_large_values_are_offloaded(blob_dir, monkeypatch, compressor):
+    if compressor == "zstd":
+        pytest.importorskip("zstandard")
+    else:
+        monkeypatch.setattr(xcom_backend, "zstandard", None)
+    value = [{"SeriesInstanceUID": f"1.2.{i}"} for i in range(100)]
+    result = serialize(value, map_index=3)
+    path = reference(result)[REFERENCE_KEY]
+    assert path.endswith(".json.zst" if compressor == "zstd" else ".json.gz")
+    assert os.path.dirname(path) == str(blob_dir / "query_pacs" / "manual__2022-10-01")
+    assert deserialize(result) == value
+    assert [p.name for p in (blob_dir / "query_pacs" / "manual__2022-10-01").iterdir()] == [os.path.basename(path)]
+
+
+def test_purged_blob_returns_none(blob_dir):
+    result = serialize(["x" * 200])
+    os.remove(reference(result)[REFERENCE_KEY])
+    assert deserialize(result) is None
+
+
+def test_purge_old_runs(blob_dir, monkeypatch):
+    serialize(["x" * 200])
+    run_dir = blob_dir / "query_pacs" / "manual__2022-10-01"
+    old = time.time() - 8 * 24 * 3600
+    os.utime(run_dir, (old, old))
+    # purges run at most once per hour, the first one ran while serializing
+    purge_blobs(retention_days=7)
+    assert run_dir.exists()
+    monkeypatch.setattr(xcom_backend, "_last_purge", None)
+    purge_blobs(retention_days=7)
+    assert not run_dir.exists()
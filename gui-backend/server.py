@@ -1,5 +1,4 @@
 from typing import Dict, Any
-from pymongo import MongoClient
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from datetime import datetime
@@ -12,10 +11,15 @@ from fastapi.responses import JSONResponse
 import pandas as pd
 
 import orjson
+import os
 import re
 import math
 from dotenv import dotenv_values
 
+# MongoDB client shared with the Airflow DAGs: copied to /shared in the image, which is on the PYTHONPATH (see
+# Dockerfile). Outside the image, add airflow/dags to the PYTHONPATH instead.
+from database.mongo_client import mongo_client
+
 
 config = dotenv_values()
 
@@ -53,7 +57,7 @@ app.add_middleware(
 
 def mongo_get_collection(collection_name):
     """Get reference to MongoDB collection."""
-    mongo_db = MongoClient(config["DB_CONN_STRING"])
+    mongo_db = mongo_client(config["DB_CONN_STRING"], **config)
     db = mongo_db[config["DB_NAME"]]
     return db[collection_name]
 
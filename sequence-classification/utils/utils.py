@@ -1,4 +1,4 @@
-from pynetdicom import AE, evt, StoragePresentationContexts, QueryRetrievePresentationContexts
+from pynetdicom import AE, evt, QueryRetrievePresentationContexts
 from pynetdicom.sop_class import \
     StudyRootQueryRetrieveInformationModelMove, \
     PatientRootQueryRetrieveInformationModelMove, \
@@ -6,16 +6,22 @@ from pynetdicom.sop_class import \
 
 from pydicom import Dataset
 from pathlib import Path
-from pymongo import MongoClient
 
 import os
 
+# header decoding, transfer syntax preferences and the MongoDB client are shared with the Airflow DAGs: copied to
+# /shared in the image, which is on the PYTHONPATH (see Dockerfile). Outside the image, add airflow/dags to the
+# PYTHONPATH instead.
+from database.mongo_client import mongo_client
+from pacs.header import read_header
+from pacs.transfer_syntax import transfer_syntaxes, storage_contexts, check_negotiated
+
 config = {k: v for k, v in os.environ.items()}
 
 
 def mongo_get_collection(collection_name):
     """Returns the reference to a collection in the database DB_NAME."""
-    mongo_db = MongoClient(config["DB_CONN_STRING"])
+    mongo_db = mongo_client(config["DB_CONN_STRING"], **config)
     db = mongo_db[config["DB_NAME"]]
     return db[collection_name]
 
@@ -51,27 +57,35 @@ def query_study_level(PatientID, StudyInstanceUID="", StudyDate="", AccessionNum
 
 
 def store_image(instance_dataset, storage_path, delete_pixel_data=True, **kwargs):
-    """Store image at storage_path. Delete PixelData attribute if required."""
+    """Store image at storage_path. Skip decoding of PixelData if delete_pixel_data is set."""
+
+    def handle_accepted(event):
+        """Log the transfer syntaxes the PACS chose for the C-STORE sub-association."""
+        check_negotiated(event.assoc.accepted_contexts, transfer_syntax)
 
     def handle_store(event, *args):
         """Handle a C-STORE service request"""
-        ds = event.dataset
-        ds.is_little_endian = True
-        ds.is_implicit_VR = True
-        if delete_pixel_data:
-            del ds.PixelData
+        ds = read_header(event) if delete_pixel_data else event.dataset
         path = f"{storage_path}{ds.Modality}/{ds.AccessionNumber}/" + \
                f"{ds.SeriesInstanceUID}/"
         Path(path).mkdir(parents=True, exist_ok=True)
         print("Storing " + path + f"{ds.SOPInstanceUID}.dcm")
+        if not delete_pixel_data and event.context.transfer_syntax.is_compressed:
+            # keep the encapsulated pixel data as negotiated
+            ds.file_meta = event.file_meta
+            ds.save_as(path + f"{ds.SOPInstanceUID}.dcm", write_like_original=False)
+            return 0x0000
+        ds.is_little_endian = True
+        ds.is_implicit_VR = True
         ds.save_as(path + f"{ds.SOPInstanceUID}.dcm")
         return 0x0000
 
-    handlers = [(evt.EVT_C_STORE, handle_store)]
+    handlers = [(evt.EVT_ACCEPTED, handle_accepted), (evt.EVT_C_STORE, handle_store)]
 
+    transfer_syntax = transfer_syntaxes(delete_pixel_data, **config)
     ae = AE()
     ae.add_requested_context(StudyRootQueryRetrieveInformationModelMove)
-    ae.supported_contexts = StoragePresentationContexts
+    ae.supported_contexts = storage_contexts(transfer_syntax)
     ae.ae_title = kwargs["PACS_LOCAL_AE_TITLE"]
     scp = ae.start_server(("0.0.0.0", kwargs["PACS_LOCAL_PORT"]), block=False, evt_handlers=handlers)
 